@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+# Standard Library Imports
+from codecs import open as _open
+import platform
+import numbers
+import json
+import time
+import os
+
+# Package imports
+from addondev.interactive import execute_addon
+from addondev.utils import unicode_type, feature
+from addondev import tracing
+
+# The number of captured log records to display for each failed route
+log_lines = 5
+
+
+def load_urls(filename, base_url):
+    """
+    Load a list of callback urls from file, one url per line.
+
+    Blank lines and lines starting with '#' are ignored. Urls starting with '/'
+    are taken to be relative to the base url of the add-on.
+
+    :param str filename: The path to the file containing the callback urls.
+    :param str base_url: The base url of the add-on. e.g. plugin://plugin.video.example/
+    :rtype: list
+    """
+    urls = []
+    with _open(filename, "r", "utf8") as stream:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                urls.append(base_url + line.lstrip("/") if line.startswith("/") else line)
+    return urls
+
+
+def run_route(pluginpath, callback_url, content_type="video"):
+    """
+    Execute a single callback url and return the route result.
+
+    :param unicode pluginpath: The path to the plugin to execute.
+    :param str callback_url: The url containing the route path and callback params.
+    :param str content_type: The content type to list, if more than one type is available.
+    :returns: A dictionary of url, succeeded, items, elapsed and the raw plugin data.
+    :rtype: dict
+    """
+    # Reuse the stored result if none of the inputs of the route have changed
+    selective = feature("selective")
+    if selective and selective.enabled:
+        result = selective.lookup(callback_url, content_type)
+        if result is not None:
+            return result
+
+    start = time.time()
+    with tracing.span("route", url=callback_url):
+        data = execute_addon(pluginpath, callback_url, content_type)
+
+    result = {"url": callback_url, "succeeded": data["succeeded"], "items": len(data["listitem"]),
+              "elapsed": time.time() - start, "error": data.get("error"), "log": data.get("log"), "data": data}
+    if selective and selective.enabled:
+        selective.store(callback_url, content_type, normalize(result))
+    return result
+
+
+def batch(pluginpath, urls, content_type="video"):
+    """
+    Execute each of the given callback urls in turn.
+
+    :param unicode pluginpath: The path to the plugin to execute.
+    :param list urls: List of callback urls to execute.
+    :param str content_type: The content type to list, if more than one type is available.
+    :returns: List of route results.
+    :rtype: list
+    """
+    return [run_route(pluginpath, url, content_type) for url in urls]
+
+
+def crawl(pluginpath, content_type="video", max_depth=1):
+    """
+    Crawl the add-on, executing every folder listitem that is found, breadth first.
+
+    :param unicode pluginpath: The path to the plugin to execute.
+    :param str content_type: The content type to list, if more than one type is available.
+    :param int max_depth: The maximum depth of folders to follow, 0 will only execute the root route.
+    :returns: List of route results.
+    :rtype: list
+    """
+    base_url = u"plugin://{}/".format(os.path.basename(pluginpath))
+    queue = [(base_url, 0)]
+    visited = {base_url}
+    results = []
+
+    while queue:
+        callback_url, depth = queue.pop(0)
+        result = run_route(pluginpath, callback_url, content_type)
+        results.append(result)
+
+        # Queue up all sub folders of the add-on
+        if depth < max_depth:
+            for url, _, isfolder in result["data"]["listitem"]:
+                if isfolder and url.startswith(base_url) and url not in visited:
+                    visited.add(url)
+                    queue.append((url, depth + 1))
+
+    return results
+
+
+def print_report(results):
+    """
+    Display a summary table of route results.
+
+    :param list results: List of route results.
+    """
+    url_len = max(len(result["url"]) for result in results) if results else 0
+    print("")
+    print("{} {} {} Url".format("Status".ljust(7), "Items".rjust(6), "Time".rjust(9)))
+    print("-" * (url_len + 26))
+    for result in results:
+        status = "reused" if result.get("reused") else "ok" if result["succeeded"] else "FAILED"
+        print("{} {} {:>8.3f}s {}".format(status.ljust(7), str(result["items"]).rjust(6),
+                                          result["elapsed"], result["url"]))
+        if result["error"]:
+            print("{}{}".format(" " * 25, result["error"]))
+        if result["log"] and not result["succeeded"]:
+            from addondev import kodilog
+            print("\n".join(kodilog.format_log(result["log"][-log_lines:], " " * 25)))
+
+    failed = len([result for result in results if not result["succeeded"]])
+    reused = len([result for result in results if result.get("reused")])
+    print("-" * (url_len + 26))
+    print("{} routes executed{}, {} failed, {:.3f}s total".format(
+        len(results) - reused, ", {} reused".format(reused) if reused else "", failed,
+        sum(result["elapsed"] for result in results)))
+
+
+def normalize(value):
+    """
+    Convert plugin data into json compatible types, so that results from python 2 and 3 can be compared.
+
+    Text and bytes both become unicode, tuples become lists and any other objects are replaced by their repr.
+    """
+    if isinstance(value, bytes):
+        return value.decode("utf8", "replace")
+    elif value is None or isinstance(value, (unicode_type, bool, numbers.Number)):
+        return value
+    elif isinstance(value, dict):
+        return dict((key if isinstance(key, unicode_type) else unicode_type(normalize(key)), normalize(item))
+                    for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    else:
+        return repr(value)
+
+
+def save_report(results, filename):
+    """
+    Save the route results as json, with the listing of each route normalized.
+
+    :param list results: List of route results.
+    :param str filename: The path to save the report to.
+    """
+    routes = []
+    for result in results:
+        data = result["data"]
+        routes.append({"url": result["url"], "succeeded": result["succeeded"], "items": result["items"],
+                       "elapsed": result["elapsed"], "error": result["error"], "log": result["log"],
+                       "listitem": normalize(data["listitem"]), "resolved": normalize(data["resolved"]),
+                       "contenttype": normalize(data["contenttype"]), "category": normalize(data["category"]),
+                       "sortmethods": normalize(data["sortmethods"])})
+
+    report = {"python": platform.python_version(), "implementation": platform.python_implementation(),
+              "routes": routes}
+    with _open(filename, "w", "utf8") as stream:
+        stream.write(json.dumps(report, indent=2, sort_keys=True))
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Packaging of add-ons into release zips and a repository index.
+
+The output directory uses the layout of the official kodi repositories, <id>/<id>-<version>.zip
+along with addons.xml and addons.xml.md5, so it can be used directly as a repository by addondev.
+
+Builds are incremental. The content hash of every add-on is kept in a cache file within the output
+directory, along with the modification time and size of each file, so only files that have changed
+are read again and only add-ons that have changed are zipped again.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from codecs import open as _open
+import multiprocessing
+import hashlib
+import zipfile
+import json
+import time
+import os
+import re
+
+# Package imports
+from addondev.utils import safe_path, format_size
+from addondev import support
+
+# Directories and files that are never included in a release zip
+exclude_dirs = {".git", ".svn", ".hg", ".idea", ".vscode", "__pycache__", ".pytest_cache", ".tox"}
+exclude_files = (".pyc", ".pyo", ".DS_Store", "Thumbs.db", ".gitignore", ".gitattributes")
+
+# The name of the build cache file within the output directory
+CACHE_FILE = ".build-cache.json"
+
+# Fixed timestamp given to every zip entry, so that unchanged content produces identical zips
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+def list_files(path):
+    """Return the sorted relative paths of all files of the add-on that belong in a release."""
+    files = []
+    for root, dirs, filenames in os.walk(path):
+        dirs[:] = [name for name in dirs if name not in exclude_dirs]
+        for filename in filenames:
+            if not filename.endswith(exclude_files):
+                files.append(os.path.relpath(os.path.join(root, filename), path).replace(os.sep, "/"))
+    return sorted(files)
+
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(65536), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def content_hash(path, cached=None):
+    """
+    Return the content hash of an add-on, reusing the file hashes of any unmodified files.
+
+    :param str path: The path to the add-on.
+    :param dict cached: The file stats of the last build, as returned from this function.
+    :returns: A tuple of the content hash and the file stats, keyed by relative path.
+    """
+    cached = cached or {}
+    files = {}
+    sha1 = hashlib.sha1()
+    for name in list_files(path):
+        stat = os.stat(os.path.join(path, name))
+        entry = cached.get(name)
+        if entry is None or entry[0] != stat.st_mtime or entry[1] != stat.st_size:
+            entry = [stat.st_mtime, stat.st_size, file_hash(os.path.join(path, name))]
+        files[name] = entry
+        sha1.update("{} {}\n".format(name, entry[2]).encode("utf8"))
+    return sha1.hexdigest(), files
+
+
+def index_entry(path):
+    """Return the addon.xml of the add-on without the xml declaration, for inclusion within addons.xml."""
+    with _open(os.path.join(path, "addon.xml"), "r", "utf8") as stream:
+        content = stream.read()
+    return re.sub(r"^\s*<\?xml[^>]*\?>", "", content).strip()
+
+
+def build_zip(args):
+    """
+    Create the release zip of an add-on. Runs within a worker process.
+
+    :param tuple args: The add-on id, the path to the add-on, the list of files and the zip path.
+    :returns: A tuple of the add-on id, zip size and the time taken.
+    """
+    addon_id, path, files, zip_path = args
+    start = time.time()
+    tmp_path = zip_path + ".tmp"
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zipobj:
+        for name in files:
+            filename = os.path.join(path, name)
+            info = zipfile.ZipInfo("{}/{}".format(addon_id, name), ZIP_DATE)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = (os.stat(filename).st_mode & 0o777) << 16
+            with open(filename, "rb") as stream:
+                zipobj.writestr(info, stream.read())
+
+    # Replace the old zip in one step, so that a failed build never leaves a broken zip behind
+    _replace(tmp_path, zip_path)
+    return addon_id, os.path.getsize(zip_path), time.time() - start
+
+
+def _replace(src, dst):
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # Python 2 has no atomic replace
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def load_cache(output):
+    cache_path = os.path.join(output, CACHE_FILE)
+    if os.path.exists(cache_path):
+        with open(cache_path) as stream:
+            return json.load(stream)
+    return {}
+
+
+def save_cache(output, cache):
+    with open(os.path.join(output, CACHE_FILE), "w") as stream:
+        json.dump(cache, stream, indent=1, sort_keys=True)
+
+
+def write_index(output, cache):
+    """Write addons.xml and addons.xml.md5, covering every add-on that was ever built into the output."""
+    entries = [cache[addon_id]["xml"] for addon_id in sorted(cache)]
+    content = u'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<addons>\n{}\n</addons>\n'.format(
+        u"\n\n".join(entries)).encode("utf8")
+
+    with open(os.path.join(output, "addons.xml"), "wb") as stream:
+        stream.write(content)
+    with open(os.path.join(output, "addons.xml.md5"), "w") as stream:
+        stream.write(hashlib.md5(content).hexdigest())
+
+
+def build(paths, output, processes=None, force=False):
+    """
+    Build the release zips of the given add-ons, along with the repository index.
+
+    :param list paths: The paths to the add-ons to build.
+    :param str output: The repository directory to build into.
+    :param int processes: The number of worker processes used to create the zips, defaults to the cpu count.
+    :param bool force: Zip every add-on, even if unchanged.
+    :returns: List of tuples of add-on id, version, status and zip size.
+    :rtype: list
+    """
+    if not os.path.exists(output):
+        os.makedirs(output)
+
+    cache = load_cache(output)
+    jobs = []
+    results = {}
+    for path in paths:
+        path = os.path.realpath(path)
+        addon = support.Addon.from_file(os.path.join(path, u"addon.xml"))
+        entry = cache.get(addon.id, {})
+        digest, files = content_hash(path, entry.get("files"))
+
+        zip_dir = os.path.join(output, addon.id)
+        zip_path = os.path.join(zip_dir, u"{}-{}.zip".format(addon.id, addon.version))
+        unchanged = entry.get("hash") == digest and os.path.exists(safe_path(zip_path))
+        cache[addon.id] = {"hash": digest, "files": files, "version": addon.version, "xml": index_entry(path)}
+
+        if unchanged and not force:
+            results[addon.id] = (addon.id, addon.version, "unchanged", os.path.getsize(zip_path))
+        else:
+            if not os.path.exists(zip_dir):
+                os.makedirs(zip_dir)
+            jobs.append((addon.id, path, sorted(files), zip_path))
+            results[addon.id] = (addon.id, addon.version, "built", None)
+
+    if jobs:
+        pool = multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(jobs)))
+        try:
+            for addon_id, size, _ in pool.imap_unordered(build_zip, jobs):
+                results[addon_id] = results[addon_id][:3] + (size,)
+        finally:
+            pool.close()
+            pool.join()
+
+    write_index(output, cache)
+    save_cache(output, cache)
+    return [results[addon_id] for addon_id in sorted(results)]
+
+
+def print_results(results, elapsed):
+    """Display the outcome of a build."""
+    print("{} {} {} Add-on".format("Status".ljust(9), "Version".ljust(10), "Size".rjust(9)))
+    print("-" * 60)
+    for addon_id, version, status, size in results:
+        print("{} {} {:>9} {}".format(status.ljust(9), version.ljust(10), format_size(size), addon_id))
+    print("-" * 60)
+    built = len([result for result in results if result[2] == "built"])
+    print("{} add-ons, {} built, {} unchanged, {:.3f}s".format(len(results), built, len(results) - built, elapsed))
+
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Record and replay of the http traffic made by the add-on.
+
+In record mode every http exchange is captured into a per route cassette file.
+In replay mode the responses are served from memory without touching the network.
+
+Requests made using the requests library are intercepted at the transport adapter,
+everything else is intercepted at the http.client level, which covers urllib.
+"""
+
+# Standard Library Imports
+from contextlib import contextmanager
+from collections import OrderedDict
+import threading
+import fnmatch
+import hashlib
+import base64
+import json
+import zlib
+import io
+import os
+
+try:
+    import urllib.parse as urlparse
+    from urllib.parse import urlencode
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    import urlparse
+    from urllib import urlencode
+
+# Package imports
+from addondev.utils import ensure_bytes, ensure_native_str
+from addondev.network import full_url, http_client
+
+# The cassette mode, either 'record' or 'replay'
+mode = None
+
+# The directory where cassettes are stored
+directory = None
+
+# List of query parameter names to ignore when matching requests, may contain wildcards
+ignore_params = []
+
+# Headers that are regenerated when the response is rebuilt
+_skip_headers = ("transfer-encoding", "content-length", "content-encoding")
+
+# The cassette of the current route
+_cassette = None
+
+# Set when a request made by the requests library is passing through http.client
+_local = threading.local()
+
+# The original methods that get patched
+_originals = {}
+
+
+def normalize_url(url):
+    """Return the url with the query params sorted and all ignored params removed."""
+    parts = urlparse.urlsplit(url)
+    query = [(key, value) for key, value in urlparse.parse_qsl(parts.query, keep_blank_values=True)
+             if not any(fnmatch.fnmatch(key, pattern) for pattern in ignore_params)]
+    return urlparse.urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(sorted(query)), ""))
+
+
+def request_key(method, url, body=None):
+    """
+    Return the key used to match a request to its recorded response.
+
+    :param str method: The http method.
+    :param str url: The full request url.
+    :param body: The request body if any.
+    :rtype: str
+    """
+    key = "{} {}".format(method.upper(), normalize_url(url))
+    if body:
+        if hasattr(body, "read"):
+            # File objects can only be read once, so they are matched on method and url only
+            return key
+        key += " {}".format(hashlib.sha1(ensure_bytes(body)).hexdigest()[:16])
+    return key
+
+
+def cassette_path(callback_url):
+    """Return the path of the cassette file for the given callback url."""
+    name = hashlib.sha1(ensure_bytes(normalize_url(callback_url))).hexdigest()[:16]
+    return os.path.join(directory, "{}.cassette".format(name))
+
+
+class Cassette(object):
+    """
+    Compressed store of recorded http exchanges, indexed by request key.
+
+    Requests that are made more than once have each response replayed in the order they were recorded.
+
+    :param str path: The path to the cassette file.
+    :param str route: The callback url that the cassette belongs to.
+    """
+
+    def __init__(self, path, route):
+        self.path = path
+        self.route = route
+        self.interactions = OrderedDict()
+        self._played = {}
+
+    @classmethod
+    def load(cls, path, route):
+        obj = cls(path, route)
+        if os.path.exists(path):
+            with open(path, "rb") as stream:
+                data = json.loads(zlib.decompress(stream.read()).decode("utf8"), object_pairs_hook=OrderedDict)
+            obj.interactions = data["interactions"]
+        return obj
+
+    def save(self):
+        data = {"version": 1, "route": self.route, "interactions": self.interactions}
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.path, "wb") as stream:
+            stream.write(zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf8"), 9))
+
+    def add(self, key, status, reason, headers, body):
+        """Record a response for the given request key."""
+        headers = [[name, value] for name, value in headers if name.lower() not in _skip_headers]
+        self.interactions.setdefault(key, []).append({
+            "status": status, "reason": reason, "headers": headers,
+            "body": base64.b64encode(body).decode("ascii")})
+
+    def play(self, key):
+        """
+        Return the next recorded response for the given request key.
+
+        :returns: A tuple of status, reason, list of headers and body.
+        :raises RuntimeError: If there is no recorded response.
+        """
+        responses = self.interactions.get(key)
+        if not responses:
+            raise RuntimeError("no recorded response for '{}' in cassette {}".format(key, self.path))
+
+        index = self._played.get(key, 0)
+        self._played[key] = index + 1
+        resp = responses[min(index, len(responses) - 1)]
+        return resp["status"], resp["reason"], resp["headers"], base64.b64decode(resp["body"])
+
+
+class FakeSocket(object):
+    """Socket replacement that allows http.client to parse a response from bytes."""
+
+    def __init__(self, data):
+        self._data = data
+
+    def makefile(self, *_, **__):
+        return io.BytesIO(self._data)
+
+
+def build_response(method, status, reason, headers, body):
+    """Build a http.client response object from a recorded response."""
+    lines = ["HTTP/1.1 {} {}".format(status, reason)]
+    lines.extend("{}: {}".format(name, value) for name, value in headers)
+    lines.append("Content-Length: {}".format(len(body)))
+    raw = ensure_bytes("\r\n".join(lines) + "\r\n\r\n", "latin-1") + body
+
+    response = http_client().HTTPResponse(FakeSocket(raw), method=method)
+    response.begin()
+    return response
+
+
+def _request(self, method, url, body=None, *args, **kwargs):
+    if not getattr(_local, "passthrough", False):
+        self._addondev_cassette = (method, request_key(method, full_url(self, url), body))
+        if mode == "replay":
+            return None
+    return _originals["request"](self, method, url, body, *args, **kwargs)
+
+
+def _getresponse(self, *args, **kwargs):
+    pending = getattr(self, "_addondev_cassette", None)
+    if pending is None:
+        return _originals["getresponse"](self, *args, **kwargs)
+
+    self._addondev_cassette = None
+    method, key = pending
+    if mode == "replay":
+        return build_response(method, *_cassette.play(key))
+
+    response = _originals["getresponse"](self, *args, **kwargs)
+    body = response.read()
+    _cassette.add(key, response.status, response.reason, response.getheaders(), body)
+    return build_response(method, response.status, response.reason, response.getheaders(), body)
+
+
+def _adapter_send(self, request, *args, **kwargs):
+    from urllib3.response import HTTPResponse
+
+    key = request_key(request.method, request.url, request.body)
+    if mode == "replay":
+        status, reason, headers, body = _cassette.play(key)
+    else:
+        _local.passthrough = True
+        try:
+            resp = _originals["adapter_send"](self, request, *args, **kwargs)
+        finally:
+            _local.passthrough = False
+
+        # Content is stored decoded, which is why the content-encoding header is dropped
+        status, reason, headers, body = resp.status_code, resp.reason, list(resp.raw.headers.items()), resp.content
+        _cassette.add(key, status, reason, headers, body)
+        headers = [(name, value) for name, value in headers if name.lower() not in _skip_headers]
+
+    headers.append(("Content-Length", str(len(body))))
+    raw = HTTPResponse(body=io.BytesIO(body), headers=headers, status=status, reason=reason,
+                       preload_content=False, decode_content=False)
+    return self.build_response(request, raw)
+
+
+def install():
+    """Patch http.client and requests to record or replay all http traffic."""
+    if _originals:
+        return
+
+    conn = http_client().HTTPConnection
+    _originals.update(request=conn.request, getresponse=conn.getresponse)
+    conn.request = _request
+    conn.getresponse = _getresponse
+
+    try:
+        from requests.adapters import HTTPAdapter
+    except ImportError:
+        pass
+    else:
+        _originals["adapter_send"] = HTTPAdapter.send
+        HTTPAdapter.send = _adapter_send
+
+
+def uninstall():
+    """Restore the original http.client and requests methods."""
+    if not _originals:
+        return
+
+    conn = http_client().HTTPConnection
+    conn.request = _originals.pop("request")
+    conn.getresponse = _originals.pop("getresponse")
+    if "adapter_send" in _originals:
+        from requests.adapters import HTTPAdapter
+        HTTPAdapter.send = _originals.pop("adapter_send")
+
+
+@contextmanager
+def use(callback_url):
+    """
+    Record or replay all http traffic within the with block using the cassette of the given route.
+
+    :param str callback_url: The callback url that is being executed.
+    """
+    global _cassette
+    if mode is None:
+        yield
+        return
+
+    path = cassette_path(ensure_native_str(callback_url))
+    if mode == "replay":
+        _cassette = Cassette.load(path, callback_url)
+    else:
+        _cassette = Cassette(path, callback_url)
+
+    install()
+    try:
+        yield
+    finally:
+        uninstall()
+        if mode == "record":
+            _cassette.save()
+        _cassette = None
@@ -2,17 +2,26 @@
 
 # Standard Library Imports
 from argparse import ArgumentParser
+from collections import OrderedDict
 import logging
+import time
 import sys
 import os
 
-# Package imports
-from addondev.interactive import interactive
+# Start of the package imports, for the start-up stats
+_import_start = time.time()
+
+# Package imports, the feature modules and the modules that are only needed by some modes are imported when used
 from addondev.utils import safe_path, ensure_unicode
 from addondev.support import logger, Repo
+from addondev import tracing, support
+
+_import_end = time.time()
 
 # Create Parser to parse the required arguments
-parser = ArgumentParser(description="Execute kodi plugin")
+parser = ArgumentParser(description="Execute kodi plugin",
+                        epilog="Other commands: perf-diff, watch, matrix, build, search, sweep, fuzz, query, "
+                        "snapshot. Use 'addondev <command> -h' for help on a command.")
 parser.add_argument("addonpath",
                     help="The path to the addon to execute. Path can be full or relative")
 
@@ -34,12 +43,140 @@ parser.add_argument("-t", "--content-type",
                     "within provides section of addon.xml. If this is not set it will default to video.")
 
 parser.add_argument("-r", "--repo", default="krypton",
-                    help="The official kodi repository to use when downloading dependencies. (krypton)")
+                    help="The official kodi repository to use when downloading dependencies. (krypton) "
+                    "Can also be the url or local path of a repository, e.g. one created by 'addondev build'.")
+
+parser.add_argument("-b", "--batch", metavar="FILE",
+                    help="Execute every callback url listed in FILE, one per line, and display a summary report.")
+
+parser.add_argument("--crawl", metavar="DEPTH", type=int,
+                    help="Crawl all folders of the add-on, up to DEPTH levels deep, and display a summary report.")
+
+parser.add_argument("--report", metavar="FILE",
+                    help="Save the results of batch or crawl mode to FILE as json, with the listings normalized.")
+
+parser.add_argument("--trace", metavar="FILE",
+                    help="Save a timeline of every execution phase to FILE in the chrome trace format. "
+                    "Open with chrome://tracing or https://ui.perfetto.dev")
+
+parser.add_argument("--profile", action="store_true",
+                    help="Profile the add-on with cProfile, displaying the hot functions of each route.")
+
+parser.add_argument("--profile-dir", metavar="DIR",
+                    help="Save the merged profile of each route as a .pstats file within DIR. Implies --profile")
+
+parser.add_argument("--memory", action="store_true",
+                    help="Display the peak memory, top allocation sites and payload size of each route.")
+
+parser.add_argument("--memory-budget", metavar="MB", type=float,
+                    help="Fail any route where the peak memory of the add-on process exceeds MB. Implies --memory")
+
+parser.add_argument("--import-profile", action="store_true",
+                    help="Display the import time of every module imported by each route, grouped by add-on.")
+
+parser.add_argument("--network", action="store_true",
+                    help="Display every http request made by each route, with timings, sizes and connection reuse.")
+
+parser.add_argument("--record", metavar="DIR",
+                    help="Record all http traffic of each route into a cassette file within DIR.")
+
+parser.add_argument("--replay", metavar="DIR",
+                    help="Replay the http traffic of each route from the cassettes within DIR, without network access.")
+
+parser.add_argument("--cassette-ignore", metavar="PARAM", action="append", default=[],
+                    help="Query parameter to ignore when matching recorded requests, wildcards are allowed. "
+                    "Can be given multiple times. e.g. --cassette-ignore _ --cassette-ignore 'token*'")
+
+parser.add_argument("--virtual-time", action="store_true",
+                    help="Run the add-on on a virtual clock, sleeps and monitor waits return instantly "
+                    "while advancing the time seen by the add-on.")
+
+parser.add_argument("--check-links", action="store_true",
+                    help="Check that the artwork and playable links of every listitem are reachable, reporting dead "
+                    "and slow links. In batch and crawl mode, all links are checked at once after the report.")
+
+parser.add_argument("--slow-link", metavar="SECONDS", type=float, default=2.0,
+                    help="Links that take longer than SECONDS to respond are reported as slow. (2)")
+
+parser.add_argument("--kodi-log", action="store_true",
+                    help="Write the add-on log to kodi.log within the mock kodi temp directory, using buffered writes "
+                    "and rotation by size. Only warnings and errors are then shown on the console.")
+
+parser.add_argument("--capture-log", metavar="LEVEL", type=str.upper,
+                    choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+                    help="Capture the add-on log records of at least LEVEL for each route. The records of failed "
+                    "routes are shown in batch and crawl reports, and all are saved with --report.")
+
+parser.add_argument("--coverage", action="store_true",
+                    help="Collect the line coverage of the add-on files within the add-on process, and display the "
+                    "coverage merged from all routes along with the time spent in the coverage callbacks.")
+
+parser.add_argument("--changed-only", action="store_true",
+                    help="Only execute the routes whose inputs have changed since the last run, the add-on modules "
+                    "and the settings and strings files that each route loaded. The stored results are reused for "
+                    "all other routes. Batch and crawl mode only. Can't be combined with the options that "
+                    "instrument each execution, e.g. --coverage, --history and --store.")
+
+parser.add_argument("--route-state", metavar="FILE",
+                    help="The file storing the inputs and results of each route. Implies --changed-only")
+
+parser.add_argument("--history", action="store_true",
+                    help="Record the timings of every route into the performance history database.")
+
+parser.add_argument("--history-db", metavar="FILE",
+                    help="The performance history database to use. Implies --history")
+
+parser.add_argument("--store", action="store_true",
+                    help="Store the results of every route in the result database, with the listitems normalized "
+                    "into tables that can be analyzed with 'addondev query'.")
+
+parser.add_argument("--store-db", metavar="FILE",
+                    help="The result database to use. Implies --store")
+
+parser.add_argument("--timeout", metavar="SECONDS", type=float,
+                    help="Kill the add-on process and fail the route if it takes longer than SECONDS.")
+
+parser.add_argument("--cpu-timeout", metavar="SECONDS", type=float,
+                    help="Kill the add-on process and fail the route if it uses more than SECONDS of cpu time.")
+
+parser.add_argument("--memory-limit", metavar="MB", type=float,
+                    help="Limit the address space of the add-on process to MB, allocations over the limit will fail.")
+
+parser.add_argument("--precompile", action="store_true",
+                    help="Byte-compile the add-on and all cached add-ons, in parallel, before executing.")
+
+parser.add_argument("--startup-stats", action="store_true",
+                    help="Display the start-up time of addondev and the first add-on process, broken down by phase.")
 
 
 def main():
+    # Dispatch to the requested sub command
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        return commands[sys.argv[1]](sys.argv[2:])
+
     # Parse the cli arguments
+    parse_start = time.time()
     args = parser.parse_args(sys.argv[1:])
+    configure_start = time.time()
+
+    # Reused routes are never executed, so they would be silently missing from any per route instrumentation
+    if args.changed_only or args.route_state:
+        instrumented = (("--coverage", args.coverage), ("--history", args.history or args.history_db),
+                        ("--store", args.store or args.store_db), ("--profile", args.profile or args.profile_dir),
+                        ("--memory", args.memory or args.memory_budget), ("--import-profile", args.import_profile),
+                        ("--network", args.network), ("--record", args.record))
+        conflicts = [flag for flag, value in instrumented if value]
+        if conflicts:
+            parser.error("--changed-only can't be combined with {}, as reused routes are not executed".format(
+                ", ".join(conflicts)))
+
+    # Time the start-up phases, the phases of the add-on process are taken from the trace events
+    if args.startup_stats:
+        from addondev import startup
+        startup.enabled = True
+        startup.mark("import addondev", _import_start, _import_end)
+        startup.mark("parse arguments", parse_start, configure_start)
+        tracing.enabled = True
 
     # Enable debug logging if logging flag was given
     if args.debug:
@@ -48,25 +185,593 @@ def main():
     # Convert any preselection into a list of selections
     preselect = list(map(int, args.preselect.split(","))) if args.preselect else None
 
-    # Set the repo to use for dependency resolving
-    Repo.repo = args.repo
+    # Set the repo to use for dependency resolving, local repos must survive the change of working directory
+    Repo.repo = os.path.abspath(args.repo) if os.path.isdir(args.repo) else args.repo
+
+    # Enable tracing of execution phases
+    if args.trace:
+        tracing.enabled = True
+        tracing.process_name("addondev")
+
+    # Enable cpu profiling of the add-on
+    if args.profile or args.profile_dir:
+        from addondev import profiling
+        profiling.enabled = True
+
+    # Enable memory accounting of the add-on
+    if args.memory or args.memory_budget:
+        from addondev import memory
+        memory.enabled = True
+        if args.memory_budget:
+            memory.budget = int(args.memory_budget * 1024 * 1024)
 
-    # Execute the addon in interactive mode
     plugin_path = os.path.realpath(decode_arg(args.addonpath))
-    arguments = [plugin_path, preselect]
-    if args.content_type:
-        arguments.append(args.content_type)
+    content_type = args.content_type if args.content_type else "video"
 
     # Check if plugin actually exists
-    if os.path.exists(safe_path(plugin_path)):
-        interactive(*arguments, compact_mode=args.compact, no_crop=args.no_crop)
+    if not os.path.exists(safe_path(plugin_path)):
+        # Check if we are already in the requested plugin directory if pluginpath was a plugin id
+        if args.addonpath.startswith("plugin.") and os.path.basename(os.getcwd()) == args.addonpath:
+            plugin_path = ensure_unicode(os.getcwd(), sys.getfilesystemencoding())
+        else:
+            raise RuntimeError("unable to find requested add-on: {}".format(plugin_path.encode("utf8")))
 
-    # Check if we are already in the requested plugin directory if pluginpath was a plugin id
-    elif args.pluginpath.startswith("plugin.") and os.path.basename(os.getcwd()) == args.pluginpath:
-        arguments[0] = ensure_unicode(os.getcwd(), sys.getfilesystemencoding())
-        interactive(*arguments, compact_mode=args.compact, no_crop=args.no_crop)
+    # Enable import time profiling of the add-on
+    if args.import_profile:
+        from addondev import imports
+        imports.enabled = True
+
+    # Enable network accounting of the add-on
+    if args.network:
+        from addondev import network
+        network.enabled = True
+
+    # Record or replay the http traffic of the add-on
+    if args.record or args.replay:
+        from addondev import cassettes
+        cassettes.mode = "record" if args.record else "replay"
+        cassettes.directory = os.path.abspath(args.record or args.replay)
+        cassettes.ignore_params = args.cassette_ignore
+        Repo.offline = cassettes.mode == "replay"
+
+    # Collect line coverage of the add-on
+    if args.coverage:
+        from addondev import linecov
+        linecov.enabled = True
+
+    # Skip all waiting done by the add-on
+    if args.virtual_time:
+        from addondev import vclock
+        vclock.enabled = True
+
+    # Record the timings of every route, phase timings are taken from the trace events
+    if args.history or args.history_db:
+        from addondev import history
+        history.enabled = True
+        history.database = args.history_db or history.default_database()
+        tracing.enabled = True
+
+    # Store the results of every route
+    if args.store or args.store_db:
+        from addondev import resultdb
+        resultdb.enabled = True
+        resultdb.database = args.store_db or resultdb.default_database()
+
+    # Check the artwork and playable links of every listitem
+    if args.check_links:
+        from addondev import links
+        links.slow = args.slow_link
+
+    # Log to kodi.log and capture the log of each route
+    if args.kodi_log or args.capture_log:
+        from addondev import kodilog
+        kodilog.enabled = args.kodi_log
+        if args.capture_log:
+            kodilog.capture_level = getattr(logging, args.capture_log)
+
+    # Resource limits of the add-on process
+    if args.timeout or args.cpu_timeout or args.memory_limit:
+        from addondev import watchdog
+        watchdog.timeout = args.timeout
+        watchdog.cpu_timeout = args.cpu_timeout
+        if args.memory_limit:
+            watchdog.memory_limit = int(args.memory_limit * 1024 * 1024)
+
+    # Byte-compile the add-on and all its possible dependencies
+    if args.precompile:
+        from addondev import imports
+        support.setup_paths()
+        imports.precompile(imports.addon_directories(plugin_path), plugin_path)
+
+    try:
+        if args.batch or args.crawl is not None:
+            from addondev import batch
+            if args.startup_stats:
+                startup.ready(configure_start)
+
+            # Reuse the results of the routes that are unchanged since the last run
+            if args.changed_only or args.route_state:
+                from addondev import selective
+                selective.enabled = True
+                selective.load(args.route_state or selective.default_state_file(os.path.basename(plugin_path)))
+
+            if args.batch:
+                base_url = u"plugin://{}/".format(os.path.basename(plugin_path))
+                urls = batch.load_urls(args.batch, base_url)
+                results = batch.batch(plugin_path, urls, content_type)
+            else:
+                results = batch.crawl(plugin_path, content_type, args.crawl)
+
+            batch.print_report(results)
+            if args.report:
+                batch.save_report(results, args.report)
+            dead = links.check_results(results) if args.check_links else 0
+            return 0 if all(result["succeeded"] for result in results) and not dead else 1
+        else:
+            from addondev.interactive import interactive
+            if args.startup_stats:
+                startup.ready(configure_start)
+
+            # Check the links after each route
+            if args.check_links:
+                links.enabled = True
+
+            # Execute the addon in interactive mode
+            interactive(plugin_path, preselect, content_type, compact_mode=args.compact, no_crop=args.no_crop)
+    finally:
+        if args.startup_stats:
+            startup.print_summary(tracing.events)
+
+        if args.trace:
+            tracing.save(args.trace)
+        else:
+            # Tracing may have been enabled just for the phase timings
+            tracing.collect()
+
+        if args.profile or args.profile_dir:
+            profiling.print_summary()
+            if args.profile_dir:
+                profiling.save(args.profile_dir)
+
+        if args.memory or args.memory_budget:
+            memory.print_summary()
+
+        if args.network:
+            network.print_summary()
+
+        if args.virtual_time:
+            vclock.print_summary()
+
+        if args.coverage:
+            linecov.print_summary()
+
+        if args.changed_only or args.route_state:
+            from addondev import selective
+            if selective.enabled:
+                selective.save()
+                selective.print_summary()
+
+        if args.store or args.store_db:
+            resultdb.flush()
+            resultdb.print_summary()
+
+
+# Parser for the perf-diff command
+perf_diff_parser = ArgumentParser(prog="addondev perf-diff",
+                                  description="Compare the latency and memory of each route between two versions "
+                                  "or two date ranges of an add-on, using the performance history database. "
+                                  "Exits with a non-zero status if any route has regressed.")
+
+perf_diff_parser.add_argument("addonid", help="The id of the add-on to compare.")
+perf_diff_parser.add_argument("--base", metavar="VERSION", help="The add-on version to compare against.")
+perf_diff_parser.add_argument("--head", metavar="VERSION", help="The add-on version to check for regressions.")
+perf_diff_parser.add_argument("--base-since", metavar="DATE", help="Only use base runs from DATE (YYYY-MM-DD).")
+perf_diff_parser.add_argument("--base-until", metavar="DATE", help="Only use base runs before DATE (YYYY-MM-DD).")
+perf_diff_parser.add_argument("--head-since", metavar="DATE", help="Only use head runs from DATE (YYYY-MM-DD).")
+perf_diff_parser.add_argument("--head-until", metavar="DATE", help="Only use head runs before DATE (YYYY-MM-DD).")
+perf_diff_parser.add_argument("--threshold", metavar="PERCENT", type=float, default=10.0,
+                              help="The relative increase that is considered a regression. (10)")
+perf_diff_parser.add_argument("--noise", type=float, default=3.0,
+                              help="The number of median absolute deviations of the base runs "
+                              "that an increase must exceed. (3)")
+perf_diff_parser.add_argument("--min-samples", type=int, default=3,
+                              help="The minimum number of runs needed on both sides to compare a route. (3)")
+perf_diff_parser.add_argument("--db", metavar="FILE", help="The performance history database to use.")
+
+
+def perf_diff(argv):
+    from addondev import history
+    args = perf_diff_parser.parse_args(argv)
+
+    def timestamp(date):
+        return time.mktime(time.strptime(date, "%Y-%m-%d")) if date else None
+
+    base = {"version": args.base, "since": timestamp(args.base_since), "until": timestamp(args.base_until)}
+    head = {"version": args.head, "since": timestamp(args.head_since), "until": timestamp(args.head_until)}
+    if base == head:
+        perf_diff_parser.error("base and head runs are the same, use --base/--head or the date range options")
+
+    conn = history.connect(args.db or history.default_database())
+    results = history.perf_diff(conn, args.addonid, base, head, args.threshold / 100.0, args.noise, args.min_samples)
+    return 1 if history.print_diff(results) else 0
+
+
+# Parser for the watch command
+watch_parser = ArgumentParser(prog="addondev watch",
+                              description="Execute a route of the add-on and execute it again every time the add-on "
+                              "source files, settings.xml or strings.po change, displaying the changes to the listing.")
+
+watch_parser.add_argument("addonpath", help="The path to the addon to execute. Path can be full or relative")
+watch_parser.add_argument("url", nargs="?",
+                          help="The callback url to execute, urls starting with '/' are relative to the add-on. "
+                          "Defaults to the root of the add-on.")
+watch_parser.add_argument("-t", "--content-type", default="video",
+                          help="Type of content that the addon provides. (video)")
+watch_parser.add_argument("-r", "--repo", default="krypton",
+                          help="The official kodi repository to use when downloading dependencies. (krypton)")
+watch_parser.add_argument("-d", "--debug", action="store_true", help="Show debug logging output")
+watch_parser.add_argument("--interval", type=float, default=0.2,
+                          help="The time in seconds between checks for changes. (0.2)")
+watch_parser.add_argument("--debounce", type=float, default=0.1,
+                          help="The time in seconds that files must be unchanged before the route is executed. (0.1)")
+watch_parser.add_argument("--timeout", type=float,
+                          help="Kill the add-on process if a route takes longer than TIMEOUT seconds.")
+
+
+def watch_command(argv):
+    from addondev import watch, watchdog
+    args = watch_parser.parse_args(argv)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    Repo.repo = os.path.abspath(args.repo) if os.path.isdir(args.repo) else args.repo
+    watchdog.timeout = args.timeout
+
+    plugin_path = os.path.realpath(decode_arg(args.addonpath))
+    if not os.path.exists(safe_path(plugin_path)):
+        watch_parser.error("unable to find requested add-on: {}".format(plugin_path))
+
+    base_url = u"plugin://{}/".format(os.path.basename(plugin_path))
+    callback_url = args.url or base_url
+    if callback_url.startswith("/"):
+        callback_url = base_url + callback_url.lstrip("/")
+    watch.watch(plugin_path, callback_url, args.content_type, args.interval, args.debounce)
+    return 0
+
+
+# Parser for the matrix command
+matrix_parser = ArgumentParser(prog="addondev matrix",
+                               description="Execute the same routes under several python interpreters in parallel, "
+                               "displaying the latency under each interpreter and any differences in the results. "
+                               "Exits with a non-zero status if the results differ.")
+
+matrix_parser.add_argument("addonpath", help="The path to the addon to execute. Path can be full or relative")
+matrix_parser.add_argument("-p", "--python", metavar="PYTHON", action="append", required=True,
+                           help="A python interpreter to run under, given at least twice. e.g. -p python2.7 -p python3")
+matrix_parser.add_argument("-b", "--batch", metavar="FILE",
+                           help="Execute every callback url listed in FILE, one per line.")
+matrix_parser.add_argument("--crawl", metavar="DEPTH", type=int,
+                           help="Crawl all folders of the add-on, up to DEPTH levels deep.")
+matrix_parser.add_argument("-t", "--content-type", help="Type of content that the addon provides. (video)")
+matrix_parser.add_argument("-r", "--repo", help="The official kodi repository to use when downloading dependencies.")
+matrix_parser.add_argument("--replay", metavar="DIR",
+                           help="Replay the http traffic from the cassettes within DIR, so every interpreter "
+                           "sees the same responses.")
+matrix_parser.add_argument("--timeout", type=float,
+                           help="Kill the add-on process if a route takes longer than TIMEOUT seconds.")
+
+
+def matrix_command(argv):
+    from addondev import matrix
+    args = matrix_parser.parse_args(argv)
+    if (args.batch is None) == (args.crawl is None):
+        matrix_parser.error("one of --batch or --crawl is required")
+
+    options = []
+    for option, value in (("--batch", args.batch), ("--crawl", args.crawl), ("--content-type", args.content_type),
+                          ("--repo", args.repo), ("--replay", args.replay), ("--timeout", args.timeout)):
+        if value is not None:
+            if option in ("--batch", "--replay"):
+                value = os.path.abspath(value)
+            options.extend([option, str(value)])
+
+    plugin_path = os.path.realpath(decode_arg(args.addonpath))
+    return 1 if matrix.matrix(args.python, plugin_path, options) else 0
+
+
+# Parser for the build command
+build_parser = ArgumentParser(prog="addondev build",
+                              description="Build the release zips of the given add-ons, along with addons.xml and "
+                              "addons.xml.md5. Only add-ons that have changed since the last build are zipped again. "
+                              "The output directory can be used as a repository with 'addondev -r DIR'.")
+
+build_parser.add_argument("addonpaths", nargs="+", metavar="addonpath", help="The paths to the add-ons to build.")
+build_parser.add_argument("-o", "--output", required=True, metavar="DIR",
+                          help="The repository directory to build into.")
+build_parser.add_argument("-j", "--jobs", type=int, help="The number of zips to build at the same time. (cpu count)")
+build_parser.add_argument("--force", action="store_true", help="Build every add-on, even if unchanged.")
+
+
+def build_command(argv):
+    from addondev import build
+    args = build_parser.parse_args(argv)
+    for path in args.addonpaths:
+        if not os.path.exists(os.path.join(path, "addon.xml")):
+            build_parser.error("not an add-on, missing addon.xml: {}".format(path))
+
+    support.setup_paths()
+    start = time.time()
+    results = build.build([decode_arg(path) for path in args.addonpaths], args.output, args.jobs, args.force)
+    build.print_results(results, time.time() - start)
+    return 0
+
+
+# Parser for the search command
+search_parser = ArgumentParser(prog="addondev search",
+                               description="Search the add-ons of a repository. Every term of the query must match. "
+                               "Terms can be limited to a field with FIELD:TERM, using one of the fields id, name, "
+                               "summary, provides, point or requires, and terms ending with '*' match as a prefix. "
+                               "e.g. 'addondev search provides:video youtube' or "
+                               "'addondev search requires:script.module.requests'")
+
+search_parser.add_argument("query", nargs="+", help="The search terms.")
+search_parser.add_argument("-r", "--repo", default="krypton",
+                           help="The kodi repository to search, a kodi version code name, url or local directory. "
+                           "(krypton)")
+search_parser.add_argument("--refresh", action="store_true",
+                           help="Download the repository index again, even if the cached copy is recent.")
+search_parser.add_argument("-l", "--limit", type=int, default=50,
+                           help="The max number of results to display, 0 for all. (50)")
+search_parser.add_argument("-d", "--debug", action="store_true", help="Show debug logging output")
+
+
+def search_command(argv):
+    from addondev import search
+    args = search_parser.parse_args(argv)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    support.setup_paths()
+    Repo.repo = os.path.abspath(args.repo) if os.path.isdir(args.repo) else args.repo
+    Repo.offline = True
+    index, stats = search.open_index(Repo(), 0 if args.refresh else 432000)
+    if stats["changed"] or stats["removed"]:
+        logger.info("Indexed {} changed add-ons, {} removed, in {:.3f}s".format(
+            stats["changed"], stats["removed"], stats["update"]))
+
+    start = time.time()
+    try:
+        results = search.search(index, " ".join(args.query))
+    except ValueError as e:
+        search_parser.error(str(e))
+    search.print_results(results, stats["load"] + time.time() - start, args.limit)
+    return 0 if results else 1
+
+
+# Parser for the sweep command
+sweep_parser = ArgumentParser(prog="addondev sweep",
+                              description="Execute the routes of the add-on under every combination of a matrix of "
+                              "setting values, in parallel. Each combination gets its own profile settings.xml. "
+                              "Displays the latency and failures of each combination and groups identical results. "
+                              "Exits with a non-zero status if any route fails.")
+
+sweep_parser.add_argument("addonpath", help="The path to the addon to execute. Path can be full or relative")
+sweep_parser.add_argument("-s", "--setting", metavar="ID=VALUES", action="append", default=[],
+                          help="A setting and the comma separated values to sweep. Can be given multiple times. "
+                          "e.g. -s quality=720p,1080p -s region=us,uk")
+sweep_parser.add_argument("--matrix", metavar="FILE",
+                          help="A json file mapping setting ids to lists of values, e.g. {\"quality\": [\"720p\"]}")
+sweep_parser.add_argument("-b", "--batch", metavar="FILE",
+                          help="Execute every callback url listed in FILE, one per line. Defaults to the root route.")
+sweep_parser.add_argument("-j", "--jobs", type=int, help="The number of combinations to run at the same time. "
+                          "(cpu count)")
+sweep_parser.add_argument("-t", "--content-type", default="video",
+                          help="Type of content that the addon provides. (video)")
+sweep_parser.add_argument("-r", "--repo", default="krypton",
+                          help="The official kodi repository to use when downloading dependencies. (krypton)")
+sweep_parser.add_argument("-d", "--debug", action="store_true", help="Show debug logging output")
+sweep_parser.add_argument("--timeout", type=float,
+                          help="Kill the add-on process if a route takes longer than TIMEOUT seconds.")
+
+
+def sweep_command(argv):
+    from addondev import sweep, batch, watchdog
+    args = sweep_parser.parse_args(argv)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    Repo.repo = os.path.abspath(args.repo) if os.path.isdir(args.repo) else args.repo
+    watchdog.timeout = args.timeout
+
+    plugin_path = os.path.realpath(decode_arg(args.addonpath))
+    if not os.path.exists(safe_path(os.path.join(plugin_path, u"addon.xml"))):
+        sweep_parser.error("unable to find requested add-on: {}".format(plugin_path))
+
+    try:
+        matrix = sweep.load_matrix(args.matrix) if args.matrix else OrderedDict()
+    except ValueError as e:
+        sweep_parser.error(str(e))
+    for setting in args.setting:
+        setting_id, sep, values = setting.partition("=")
+        if not sep or not setting_id:
+            sweep_parser.error("settings must be given as ID=VALUE1,VALUE2: {}".format(setting))
+        matrix[setting_id] = values.split(",")
+    if not matrix:
+        sweep_parser.error("no settings to sweep, use --setting or --matrix")
+
+    base_url = u"plugin://{}/".format(os.path.basename(plugin_path))
+    urls = batch.load_urls(args.batch, base_url) if args.batch else [base_url]
+
+    support.setup_paths()
+    results = sweep.sweep(plugin_path, urls, args.content_type, matrix, args.jobs)
+    return 1 if sweep.print_results(results) else 0
+
+
+# Parser for the fuzz command
+fuzz_parser = ArgumentParser(prog="addondev fuzz",
+                             description="Fuzz the route parameters of the add-on. Seed urls are mutated and executed "
+                             "by a pool of persistent add-on processes. Crashes are grouped by stack signature and "
+                             "each unique crash is minimized into a reproducible callback url. "
+                             "Exits with a non-zero status if any crash is found.")
+
+fuzz_parser.add_argument("addonpath", help="The path to the addon to execute. Path can be full or relative")
+fuzz_parser.add_argument("-b", "--batch", metavar="FILE", help="Use the callback urls listed in FILE as seeds.")
+fuzz_parser.add_argument("--crawl", metavar="DEPTH", type=int, default=1,
+                         help="Crawl the add-on up to DEPTH levels deep for seed urls, "
+                              "when no batch file is given. (1)")
+fuzz_parser.add_argument("-n", "--runs", type=int, default=1000, help="The number of mutants to execute. (1000)")
+fuzz_parser.add_argument("--duration", metavar="SECONDS", type=float, help="Stop fuzzing after SECONDS.")
+fuzz_parser.add_argument("-j", "--jobs", type=int, default=4,
+                         help="The number of add-on processes to run at the same time. (4)")
+fuzz_parser.add_argument("--timeout", metavar="SECONDS", type=float, default=5.0,
+                         help="Kill the add-on process and count a crash if a run takes longer than SECONDS. (5)")
+fuzz_parser.add_argument("--seed", type=int, help="The seed of the random generator, to repeat a run.")
+fuzz_parser.add_argument("--report", metavar="FILE", help="Save the unique crashes to FILE as json.")
+fuzz_parser.add_argument("-t", "--content-type", default="video",
+                         help="Type of content that the addon provides. (video)")
+fuzz_parser.add_argument("-r", "--repo", default="krypton",
+                         help="The official kodi repository to use when downloading dependencies. (krypton)")
+fuzz_parser.add_argument("-d", "--debug", action="store_true", help="Show debug logging output")
+
+
+def fuzz_command(argv):
+    from addondev import fuzz, batch, watchdog
+    args = fuzz_parser.parse_args(argv)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    Repo.repo = os.path.abspath(args.repo) if os.path.isdir(args.repo) else args.repo
+    watchdog.timeout = args.timeout
+
+    plugin_path = os.path.realpath(decode_arg(args.addonpath))
+    if not os.path.exists(safe_path(os.path.join(plugin_path, u"addon.xml"))):
+        fuzz_parser.error("unable to find requested add-on: {}".format(plugin_path))
+
+    # Seeds are the executed routes along with every plugin url found in their listings
+    base_url = u"plugin://{}/".format(os.path.basename(plugin_path))
+    if args.batch:
+        seeds = batch.load_urls(args.batch, base_url)
+    else:
+        results = batch.crawl(plugin_path, args.content_type, args.crawl)
+        seeds = [result["url"] for result in results]
+        seeds.extend(url for result in results for url, _, _ in result["data"]["listitem"] if url.startswith(base_url))
+    seeds = list(OrderedDict.fromkeys(seeds))
+    logger.info("Fuzzing with {} seed urls".format(len(seeds)))
+
+    fuzzer, elapsed = fuzz.fuzz(plugin_path, seeds, args.content_type, args.jobs, args.runs, args.duration, args.seed)
+    fuzz.print_results(fuzzer, elapsed)
+    if args.report:
+        fuzz.save_report(fuzzer, args.report)
+    return 1 if fuzzer.crashes else 0
+
+
+# Parser for the query command
+query_parser = ArgumentParser(prog="addondev query",
+                              description="Query the route results stored with --store, using one of the ready made "
+                              "queries or any sql query. The tables are runs, routes, items, info, art, properties "
+                              "and strings, with the views route_view, latest_routes, item_view, info_view, "
+                              "art_view and properties_view resolving the string ids into text.")
+
+query_parser.add_argument("query", nargs="?",
+                          help="The name of a ready made query or an sql query. Lists the ready made queries if "
+                          "not given.")
+query_parser.add_argument("params", nargs="*", help="Parameters of the sql query, for each '?' placeholder.")
+query_parser.add_argument("--db", metavar="FILE", help="The result database to use.")
+query_parser.add_argument("--width", type=int, default=60, help="Crop values longer than WIDTH characters. (60)")
+
+
+def query_command(argv):
+    from addondev import resultdb
+    import sqlite3
+    args = query_parser.parse_args(argv)
+    if not args.query:
+        for name, (description, _) in resultdb.queries.items():
+            print("{} {}".format(name.ljust(20), description))
+        return 0
+
+    conn = resultdb.connect(args.db or resultdb.default_database())
+    start = time.time()
+    try:
+        columns, rows = resultdb.query(conn, decode_arg(args.query), [decode_arg(param) for param in args.params])
+    except sqlite3.Error as e:
+        query_parser.error("query failed: {}".format(e))
+    resultdb.print_rows(columns, rows, time.time() - start, args.width)
+    return 0
+
+
+# Parser for the snapshot command
+snapshot_parser = ArgumentParser(prog="addondev snapshot",
+                                 description="Verify the listings of the add-on against the stored snapshots, or "
+                                 "update the snapshots with -u. The result of each route is stored as a compressed "
+                                 "blob named by its content hash, and only routes whose hash changed are compared "
+                                 "item by item. Exits with a non-zero status if any route is new, changed or failed.")
+
+snapshot_parser.add_argument("addonpath", help="The path to the addon to execute. Path can be full or relative")
+snapshot_parser.add_argument("-b", "--batch", metavar="FILE",
+                             help="Execute the callback urls listed in FILE, defaults to the routes in the snapshots.")
+snapshot_parser.add_argument("--crawl", metavar="DEPTH", type=int,
+                             help="Also crawl the folders of the executed routes up to DEPTH levels deep.")
+snapshot_parser.add_argument("--dir", default="snapshots", help="The snapshot directory. (snapshots)")
+snapshot_parser.add_argument("-u", "--update", action="store_true", help="Update the snapshots of the routes.")
+snapshot_parser.add_argument("--prune", action="store_true",
+                             help="Remove the snapshots of routes that were not executed, when updating.")
+snapshot_parser.add_argument("-i", "--ignore", metavar="PATTERN", action="append", default=[],
+                             help="Ignore the fields matching the wildcard PATTERN, e.g. "
+                                  "'listitem.*.item.info.lastplayed'. Saved with the snapshots when updating. "
+                                  "Can be given more than once.")
+snapshot_parser.add_argument("-j", "--jobs", type=int, default=4,
+                             help="The number of add-on processes to run at the same time. (4)")
+snapshot_parser.add_argument("--timeout", metavar="SECONDS", type=float, default=30.0,
+                             help="Kill the add-on process and fail the route if it takes longer than SECONDS. (30)")
+snapshot_parser.add_argument("-t", "--content-type", default="video",
+                             help="Type of content that the addon provides. (video)")
+snapshot_parser.add_argument("-r", "--repo", default="krypton",
+                             help="The official kodi repository to use when downloading dependencies. (krypton)")
+snapshot_parser.add_argument("-d", "--debug", action="store_true", help="Show debug logging output")
+
+
+def snapshot_command(argv):
+    from addondev import snapshots, batch, watchdog
+    args = snapshot_parser.parse_args(argv)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    Repo.repo = os.path.abspath(args.repo) if os.path.isdir(args.repo) else args.repo
+    watchdog.timeout = args.timeout
+
+    plugin_path = os.path.realpath(decode_arg(args.addonpath))
+    if not os.path.exists(safe_path(os.path.join(plugin_path, u"addon.xml"))):
+        snapshot_parser.error("unable to find requested add-on: {}".format(plugin_path))
+
+    store = snapshots.SnapshotStore(os.path.abspath(decode_arg(args.dir)))
+    store.ignore.extend(decode_arg(pattern) for pattern in args.ignore if decode_arg(pattern) not in store.ignore)
+    base_url = u"plugin://{}/".format(os.path.basename(plugin_path))
+    if args.batch:
+        urls = batch.load_urls(args.batch, base_url)
+    elif args.crawl is not None:
+        urls = [base_url]
     else:
-        raise RuntimeError("unable to find requested add-on: {}".format(plugin_path.encode("utf8")))
+        urls = sorted(store.routes)
+    if not urls:
+        snapshot_parser.error("no snapshots found in {}, use --update to create them".format(store.path))
+
+    start = time.time()
+    pool = snapshots.WorkerPool(plugin_path, args.content_type, args.jobs)
+    try:
+        results = snapshots.snapshot(pool, store, list(OrderedDict.fromkeys(urls)), args.update, args.crawl)
+    finally:
+        pool.stop()
+
+    if args.update:
+        if args.prune:
+            executed = set(result["url"] for result in results)
+            for url in [url for url in store.routes if url not in executed]:
+                del store.routes[url]
+        store.save()
+
+    failed = snapshots.print_results(results, args.update)
+    print("{} routes in {:.3f}s".format(len(results), time.time() - start))
+    return 1 if failed else 0
 
 
 def decode_arg(path):
@@ -87,7 +792,13 @@ def decode_arg(path):
         return path
 
 
+# Available sub commands
+commands = {"perf-diff": perf_diff, "watch": watch_command, "matrix": matrix_command, "build": build_command,
+            "search": search_command, "sweep": sweep_command, "fuzz": fuzz_command, "query": query_command,
+            "snapshot": snapshot_command}
+
+
 # This is only here for development
 # Allows this script to be call directly
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+Fuzzing of the route parameters of an add-on.
+
+Seed urls, from a crawl or a batch file, are mutated by changing the selector and the query parameters,
+including the values within hex encoded '_json_' and '_pickle_' payloads. The mutants are executed by a
+pool of persistent add-on processes, which stay warm between runs and are restarted when they die or
+time out. Crashes are grouped by the signature of their stack, and each unique crash is minimized to the
+smallest callback url that still reproduces it.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+from codecs import open as _open
+from copy import deepcopy
+import threading
+import binascii
+import random
+import pickle
+import json
+import time
+import os
+
+try:
+    import urllib.parse as urlparse
+    from urllib.parse import urlencode
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    import urlparse
+    # noinspection PyUnresolvedReferences
+    from urllib import urlencode
+
+# Package imports
+from addondev.worker import Worker
+from addondev import worker as _worker
+
+# The number of innermost add-on frames that make up the stack signature of a crash
+signature_depth = 3
+
+# The max number of runs used to minimize each crash
+minimize_runs = 200
+
+# Values that commonly break parameter parsing
+interesting = [u"", u"0", u"-1", u"1", u"99999999999999999999", u"1.5", u"true", u"false", u"null", u"None",
+               u"[]", u"{}", u"%", u"%%", u"'", u'"', u"\\", u"<a>", u"../..", u"üñï", u"\x00",
+               u" ", u"A" * 1024, u"plugin://", u"-", u"_"]
+
+# The directory of addondev, frames within it are not part of a crash signature
+_package_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class Route(object):
+    """
+    A callback url broken down into its selector and parameters, with payloads decoded.
+
+    :ivar str base: The scheme and add-on id part of the url. e.g. plugin://plugin.video.example
+    :ivar str selector: The path of the url.
+    :ivar list params: List of [key, value, kind], where kind is 'json' or 'pickle' for decoded payloads.
+    """
+
+    def __init__(self, base, selector, params):
+        self.base = base
+        self.selector = selector
+        self.params = params
+
+    @classmethod
+    def parse(cls, url):
+        parts = urlparse.urlsplit(url)
+        params = []
+        for key, value in urlparse.parse_qsl(parts.query, keep_blank_values=True):
+            kind = {"_json_": "json", "_pickle_": "pickle"}.get(key)
+            if kind:
+                try:
+                    data = binascii.unhexlify(value)
+                    value = json.loads(data.decode("utf8")) if kind == "json" else pickle.loads(data)
+                except Exception:
+                    kind = None
+            params.append([key, value, kind])
+        return cls(u"{}://{}".format(parts.scheme, parts.netloc), parts.path or u"/", params)
+
+    def copy(self):
+        return Route(self.base, self.selector, deepcopy(self.params))
+
+    def url(self):
+        query = []
+        for key, value, kind in self.params:
+            if kind == "json":
+                value = binascii.hexlify(json.dumps(value).encode("utf8")).decode("ascii")
+            elif kind == "pickle":
+                value = binascii.hexlify(pickle.dumps(value, 2)).decode("ascii")
+            query.append((key.encode("utf8"), value.encode("utf8") if isinstance(value, type(u"")) else value))
+        return u"{}{}{}".format(self.base, self.selector, u"?" + urlencode(query) if query else u"")
+
+
+def mutate_value(rand, value):
+    """Return a mutated copy of a parameter value, keeping to the structure of json and pickle payloads."""
+    if isinstance(value, dict) and value and rand.random() < 0.8:
+        value = dict(value)
+        key = rand.choice(sorted(value))
+        action = rand.random()
+        if action < 0.2:
+            del value[key]
+        elif action < 0.3:
+            value[rand.choice(interesting)] = rand.choice(interesting)
+        else:
+            value[key] = mutate_value(rand, value[key])
+        return value
+    elif isinstance(value, list) and value and rand.random() < 0.5:
+        value = list(value)
+        index = rand.randrange(len(value))
+        if rand.random() < 0.3:
+            del value[index]
+        else:
+            value[index] = mutate_value(rand, value[index])
+        return value
+
+    action = rand.random()
+    if action < 0.4:
+        return rand.choice(interesting)
+    elif action < 0.5:
+        # Change the type of the value
+        return rand.choice([None, 0, -1, 1.5, True, [], {}, u""])
+    elif action < 0.7 and isinstance(value, type(u"")) and value:
+        # Flip, drop or duplicate a character
+        index = rand.randrange(len(value))
+        char = value[index]
+        return rand.choice([value[:index] + value[index + 1:], value[:index] + char * 2 + value[index + 1:],
+                            value[:index] + u"%c" % (ord(char) ^ 1) + value[index + 1:]])
+    elif action < 0.8 and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return rand.choice([value + 1, value - 1, -value, value * 1000000])
+    elif action < 0.9:
+        return u"{}{}".format(value, rand.choice(interesting))
+    else:
+        return value if not isinstance(value, type(u"")) else value * rand.randint(2, 64)
+
+
+def mutate(rand, seeds):
+    """
+    Return a mutant of a random seed.
+
+    :param random.Random rand: The random generator to use.
+    :param list seeds: List of seed routes.
+    :rtype: Route
+    """
+    route = rand.choice(seeds).copy()
+    for _ in range(rand.choice([1, 1, 1, 2, 3])):
+        action = rand.random()
+        if route.params and action < 0.5:
+            param = rand.choice(route.params)
+            if param[2] and rand.random() < 0.1:
+                # Corrupt the payload encoding itself
+                param[1], param[2] = rand.choice([u"zz", u"0", u"7b"]), None
+            else:
+                param[1] = mutate_value(rand, param[1])
+                if not param[2] and not isinstance(param[1], type(u"")):
+                    param[1] = u"{}".format(param[1])
+        elif route.params and action < 0.6:
+            del route.params[rand.randrange(len(route.params))]
+        elif route.params and action < 0.7:
+            route.params.append(list(rand.choice(route.params)))
+        elif action < 0.8:
+            # Splice the parameters of one seed onto the selector of another
+            route.params = rand.choice(seeds).copy().params
+        elif action < 0.9:
+            route.selector = rand.choice(seeds).selector
+        else:
+            parts = [part for part in route.selector.split(u"/") if part]
+            choice = rand.random()
+            if parts and choice < 0.5:
+                parts.pop()
+            else:
+                parts.append(rand.choice(interesting[:12]))
+            route.selector = u"/" + u"/".join(parts) + (u"/" if route.selector.endswith(u"/") else u"")
+    return route
+
+
+def signature(data, root=None):
+    """
+    Return the signature of a crash, or None if the run did not crash.
+
+    The signature is the exception type along with the innermost add-on frames, so the same bug reached
+    through different urls is only reported once. Library frames are only used when the stack holds no
+    frames of the add-on.
+
+    :param dict data: The results of the run.
+    :param str root: The directory of the add-on.
+    """
+    if "failure" in data:
+        return data["error"]
+    if not data.get("error"):
+        return None
+
+    frames = [frame for frame in data.get("stack", []) if not os.path.abspath(frame[0]).startswith(_package_dir)]
+    if root is not None:
+        root = os.path.join(os.path.realpath(root), "")
+        frames = [frame for frame in frames if os.path.realpath(frame[0]).startswith(root)] or frames
+    location = u" < ".join(u"{}:{}:{}".format(os.path.basename(filename), name, line)
+                           for filename, line, name in reversed(frames[-signature_depth:]))
+    return u"{} at {}".format(data["error"].split(":", 1)[0], location or u"<unknown>")
+
+
+class Fuzzer(object):
+    """
+    Runs mutants through a warm pool of add-on processes.
+
+    :param unicode pluginpath: The path to the plugin to execute.
+    :param list seeds: List of seed urls.
+    :param str content_type: The content type to list, if more than one type is available.
+    :param int workers: The number of add-on processes to run at the same time.
+    :param int seed: The seed of the random generator, so a run can be repeated.
+    """
+
+    def __init__(self, pluginpath, seeds, content_type="video", workers=4, seed=None):
+        self.pluginpath = pluginpath
+        self.content_type = content_type
+        self.seeds = [Route.parse(url) for url in seeds]
+        self.workers = workers
+        self.rand = random.Random(seed)
+        self.crashes = OrderedDict()
+        self.runs = 0
+        self._lock = threading.Lock()
+
+    def _next(self, deadline, max_runs):
+        with self._lock:
+            if (max_runs and self.runs >= max_runs) or (deadline and time.time() >= deadline):
+                return None
+            self.runs += 1
+            return mutate(self.rand, self.seeds)
+
+    def _record(self, route, data):
+        sig = signature(data, self.pluginpath)
+        if sig is None:
+            return
+
+        url = route.url()
+        with self._lock:
+            crash = self.crashes.get(sig)
+            if crash is None:
+                self.crashes[sig] = crash = {"signature": sig, "count": 0, "url": url, "route": route,
+                                             "error": data.get("error") or data.get("failure")}
+            crash["count"] += 1
+
+    def _loop(self, deadline, max_runs):
+        worker = Worker(self.pluginpath, self.content_type)
+        try:
+            while True:
+                route = self._next(deadline, max_runs)
+                if route is None:
+                    break
+                self._record(route, worker.execute(route.url()))
+        finally:
+            worker.stop()
+
+    def run(self, max_runs=1000, duration=None):
+        """
+        Execute mutants until the number of runs or the duration is reached.
+
+        :param int max_runs: The number of mutants to execute, 0 for no limit.
+        :param float duration: The max time in seconds to run for.
+        :returns: The time taken.
+        :rtype: float
+        """
+        start = time.time()
+        deadline = start + duration if duration else None
+        self._pool_map(lambda _: self._loop(deadline, max_runs), range(self.workers))
+        return time.time() - start
+
+    def _pool_map(self, func, items):
+        pool = ThreadPool(self.workers)
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def minimize(self, crash):
+        """
+        Reduce the url of a crash to the smallest url that still reproduces the same signature.
+
+        Parameters and payload keys are dropped, and values are shortened, one at a time.
+
+        :param dict crash: The crash to minimize, the minimized url is stored under 'minimized'.
+        """
+        worker = Worker(self.pluginpath, self.content_type)
+        budget = [minimize_runs]
+
+        def reproduces(candidate):
+            if budget[0] <= 0:
+                return False
+            budget[0] -= 1
+            return signature(worker.execute(candidate.url()), self.pluginpath) == crash["signature"]
+
+        route = crash["route"]
+        try:
+            changed = True
+            while changed and budget[0] > 0:
+                changed = False
+                for candidate in reductions(route):
+                    if reproduces(candidate):
+                        route = candidate
+                        changed = True
+                        break
+        finally:
+            worker.stop()
+
+        crash["minimized"] = route.url()
+        crash["reproduced"] = reproduces_once(self, route, crash["signature"])
+
+    def minimize_all(self):
+        """Minimize every unique crash, in parallel."""
+        self._pool_map(self.minimize, list(self.crashes.values()))
+
+
+def reproduces_once(fuzzer, route, sig):
+    """Check that a url crashes with the given signature in a fresh add-on process."""
+    worker = Worker(fuzzer.pluginpath, fuzzer.content_type)
+    try:
+        return signature(worker.execute(route.url()), fuzzer.pluginpath) == sig
+    finally:
+        worker.stop()
+
+
+def _shorter(value):
+    if isinstance(value, type(u"")) and len(value) > 1:
+        return [value[:len(value) // 2], u""]
+    elif isinstance(value, dict):
+        return [dict((k, v) for k, v in value.items() if k != key) for key in sorted(value)]
+    elif isinstance(value, list) and value:
+        return [value[:len(value) // 2]]
+    return []
+
+
+def reductions(route):
+    """Yield smaller variants of a route, dropping parameters first and then shortening values."""
+    for index in range(len(route.params)):
+        candidate = route.copy()
+        del candidate.params[index]
+        yield candidate
+
+    for index, param in enumerate(route.params):
+        for value in _shorter(param[1]):
+            candidate = route.copy()
+            candidate.params[index][1] = value
+            yield candidate
+
+    parts = [part for part in route.selector.split(u"/") if part]
+    if parts:
+        candidate = route.copy()
+        candidate.selector = u"/" + u"/".join(parts[:-1])
+        yield candidate
+
+
+def fuzz(pluginpath, seeds, content_type="video", workers=4, max_runs=1000, duration=None, seed=None):
+    """
+    Fuzz the add-on and minimize every unique crash.
+
+    :returns: The fuzzer, holding the runs and unique crashes, and the time taken to run the mutants.
+    :rtype: tuple
+    """
+    # The tracebacks of thousands of crashes are of no use, the crashes are reported at the end
+    _worker.print_errors = False
+    fuzzer = Fuzzer(pluginpath, seeds, content_type, workers, seed)
+    elapsed = fuzzer.run(max_runs, duration)
+    fuzzer.minimize_all()
+    return fuzzer, elapsed
+
+
+def print_results(fuzzer, elapsed):
+    """Display the throughput and the unique crashes."""
+    print("")
+    print("{} runs in {:.1f}s, {:.1f} runs/s with {} workers, {} unique crashes".format(
+        fuzzer.runs, elapsed, fuzzer.runs / max(elapsed, 1e-9), fuzzer.workers, len(fuzzer.crashes)))
+
+    for count, crash in enumerate(sorted(fuzzer.crashes.values(), key=lambda item: -item["count"])):
+        print("")
+        print("{}. {} ({} runs)".format(count + 1, crash["signature"], crash["count"]))
+        print("   Error:     {}".format(crash["error"]))
+        print("   Minimized: {}{}".format(crash["minimized"], "" if crash["reproduced"] else " (not reproducible)"))
+
+
+def save_report(fuzzer, filename):
+    """Save the unique crashes as json."""
+    crashes = [dict((key, value) for key, value in crash.items() if key != "route")
+               for crash in fuzzer.crashes.values()]
+    with _open(filename, "w", "utf8") as stream:
+        stream.write(json.dumps({"runs": fuzzer.runs, "crashes": crashes}, indent=2))
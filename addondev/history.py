@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Historical database of route timings, used to detect performance regressions between versions.
+
+Every route execution records its phase timings, item count, payload size and peak memory into a
+local sqlite database, keyed by add-on id, add-on version and callback url.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from xml.etree import ElementTree as ETree
+import pickle
+import json
+import time
+import os
+
+# Package imports
+from addondev.utils import safe_path
+from addondev import tracing, memory, support
+
+# Set to True to record all route executions
+enabled = False
+
+# The path to the sqlite database, defaults to within the mock kodi home directory
+database = None
+
+# Cache of add-on id and version, keyed by add-on path
+_addon_info = {}
+
+# The open database connection
+_connection = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    addon_id TEXT NOT NULL,
+    addon_version TEXT NOT NULL,
+    callback_url TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    succeeded INTEGER NOT NULL,
+    elapsed REAL NOT NULL,
+    items INTEGER NOT NULL,
+    payload INTEGER NOT NULL,
+    peak_rss INTEGER,
+    phases TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_lookup ON runs (addon_id, addon_version, callback_url);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (addon_id, timestamp);
+"""
+
+
+def connect(path=None):
+    """
+    Return a connection to the history database, creating the database if needed.
+
+    :param str path: The path to the database, defaults to the configured database.
+    """
+    global _connection
+    import sqlite3
+    if path is not None:
+        conn = sqlite3.connect(path)
+        conn.executescript(SCHEMA)
+        return conn
+
+    if _connection is None:
+        _connection = sqlite3.connect(database)
+        _connection.executescript(SCHEMA)
+    return _connection
+
+
+def default_database():
+    """Return the default database path within the mock kodi home directory."""
+    if "home" not in support.kodi_paths:
+        support.setup_paths()
+    return os.path.join(support.kodi_paths["home"], u"perf_history.sqlite")
+
+
+def child_timings():
+    """
+    Return the phase timings and peak memory of the add-on process.
+
+    Phase timings are taken from the recorded trace events, so tracing must be enabled.
+
+    :rtype: dict
+    """
+    phases = {}
+    pid = os.getpid()
+    for event in tracing.events:
+        if event["ph"] == "X" and event["pid"] == pid:
+            phases[event["name"]] = phases.get(event["name"], 0.0) + event["dur"] / 1000000.0
+    return {"phases": phases, "peak_rss": memory.peak_rss()}
+
+
+def addon_info(pluginpath):
+    """Return the add-on id and version of the add-on at the given path."""
+    if pluginpath not in _addon_info:
+        xml_node = ETree.parse(safe_path(os.path.join(pluginpath, u"addon.xml"))).getroot()
+        _addon_info[pluginpath] = (xml_node.attrib["id"], xml_node.attrib["version"])
+    return _addon_info[pluginpath]
+
+
+def record(pluginpath, callback_url, data, elapsed):
+    """
+    Save the timings of a route execution to the history database.
+
+    :param unicode pluginpath: The path to the plugin that was executed.
+    :param str callback_url: The callback url that was executed.
+    :param dict data: The results returned from the add-on process.
+    :param float elapsed: The total time taken to execute the route, as seen by the controller.
+    """
+    timings = data.pop("timings", {"phases": {}, "peak_rss": None})
+    addon_id, addon_version = addon_info(pluginpath)
+    conn = connect()
+    with conn:
+        conn.execute("INSERT INTO runs (addon_id, addon_version, callback_url, timestamp, succeeded, elapsed, items, "
+                     "payload, peak_rss, phases) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (addon_id, addon_version, callback_url, time.time(), int(bool(data["succeeded"])), elapsed,
+                      len(data["listitem"]), len(pickle.dumps(data, -1)), timings["peak_rss"],
+                      json.dumps(timings["phases"])))
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2.0
+
+
+def mad(values):
+    """Return the median absolute deviation, scaled to be comparable to the standard deviation."""
+    center = median(values)
+    return median([abs(value - center) for value in values]) * 1.4826
+
+
+def load_samples(conn, addon_id, version=None, since=None, until=None):
+    """
+    Return all successful samples of elapsed time and peak memory, grouped by callback url.
+
+    :param conn: The database connection.
+    :param str addon_id: The add-on id.
+    :param str version: Only include runs of this add-on version.
+    :param float since: Only include runs from this timestamp.
+    :param float until: Only include runs before this timestamp.
+    :returns: Dict of callback url to a tuple of elapsed times and peak memory values.
+    :rtype: dict
+    """
+    query = "SELECT callback_url, elapsed, peak_rss FROM runs WHERE addon_id = ? AND succeeded = 1"
+    params = [addon_id]
+    if version is not None:
+        query += " AND addon_version = ?"
+        params.append(version)
+    if since is not None:
+        query += " AND timestamp >= ?"
+        params.append(since)
+    if until is not None:
+        query += " AND timestamp < ?"
+        params.append(until)
+
+    samples = {}
+    for url, elapsed, peak_rss in conn.execute(query, params):
+        latency, rss = samples.setdefault(url, ([], []))
+        latency.append(elapsed)
+        if peak_rss is not None:
+            rss.append(peak_rss)
+    return samples
+
+
+def is_regression(base, head, threshold, noise, min_samples):
+    """
+    Check if the head samples have regressed compared to the base samples.
+
+    A regression must exceed both the relative threshold and the noise of the base samples.
+
+    :param list base: The base samples.
+    :param list head: The head samples.
+    :param float threshold: The relative increase that is considered a regression. e.g. 0.1 for 10%
+    :param float noise: The number of median absolute deviations that the increase must exceed.
+    :param int min_samples: The minimum number of samples needed on both sides for a result.
+    :returns: A tuple of (base median, head median, regressed), or None if there are not enough samples.
+    """
+    if len(base) < min_samples or len(head) < min_samples:
+        return None
+
+    base_median, head_median = median(base), median(head)
+    increase = head_median - base_median
+    regressed = increase > base_median * threshold and increase > mad(base) * noise
+    return base_median, head_median, regressed
+
+
+def perf_diff(conn, addon_id, base, head, threshold=0.1, noise=3.0, min_samples=3):
+    """
+    Compare the latency and memory of each route between two sets of runs.
+
+    :param conn: The database connection.
+    :param str addon_id: The add-on id.
+    :param dict base: Filter arguments of the base runs, version, since and until.
+    :param dict head: Filter arguments of the head runs, version, since and until.
+    :param float threshold: The relative increase that is considered a regression.
+    :param float noise: The number of median absolute deviations that the increase must exceed.
+    :param int min_samples: The minimum number of samples needed on both sides for a comparison.
+    :returns: List of tuples of (callback url, metric, base median, head median, regressed).
+    :rtype: list
+    """
+    base_samples = load_samples(conn, addon_id, **base)
+    head_samples = load_samples(conn, addon_id, **head)
+
+    results = []
+    for url in sorted(set(base_samples) & set(head_samples)):
+        for index, metric in enumerate(("latency", "memory")):
+            result = is_regression(base_samples[url][index], head_samples[url][index], threshold, noise, min_samples)
+            if result is not None:
+                results.append((url, metric) + result)
+    return results
+
+
+def print_diff(results):
+    """
+    Display the results of a performance comparison.
+
+    :param list results: The results returned from perf_diff.
+    :returns: The number of regressions.
+    :rtype: int
+    """
+    print("{} {} {} {} {} Url".format("Status".ljust(9), "Metric".ljust(7), "Base".rjust(10), "Head".rjust(10),
+                                       "Change".rjust(7)))
+    print("-" * 80)
+    regressions = 0
+    for url, metric, base_median, head_median, regressed in results:
+        regressions += regressed
+        change = (head_median - base_median) / base_median if base_median else 0.0
+        if metric == "latency":
+            base_text, head_text = "{:.3f}s".format(base_median), "{:.3f}s".format(head_median)
+        else:
+            base_text = "{:.1f}MB".format(base_median / 1048576.0)
+            head_text = "{:.1f}MB".format(head_median / 1048576.0)
+        print("{} {} {:>10} {:>10} {:>+7.1%} {}".format("REGRESSED" if regressed else "ok".ljust(9), metric.ljust(7),
+                                                         base_text, head_text, change, url))
+
+    print("-" * 80)
+    print("{} comparisons, {} regressions".format(len(results), regressions))
+    return regressions
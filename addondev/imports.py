@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Import time profiling and bytecode precompilation of add-ons.
+
+The import profiler is a meta path finder that times the lookup and execution of every module
+imported by the add-on, attributing each module to the add-on that owns it.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from contextlib import contextmanager
+from collections import OrderedDict
+import time
+import sys
+import os
+
+# Package imports
+from addondev.utils import ensure_native_str
+from addondev import support, libraries
+
+# Set to True to profile the imports of the add-on
+enabled = False
+
+# The number of slowest modules to display
+top = 15
+
+# High resolution timer, fallback to time.time on python 2
+timer = getattr(time, "perf_counter", time.time)
+
+
+def owner(filename):
+    """
+    Return the id of the add-on that the given file belongs to.
+
+    :param str filename: The path to a module file.
+    :returns: The add-on id, 'addondev' or 'python' if not owned by an add-on.
+    :rtype: str
+    """
+    if not filename:
+        return "python"
+
+    filename = os.path.realpath(ensure_native_str(filename))
+    match, match_len = "python", 0
+    for addon in list(support.avail_addons.values()):
+        path = os.path.realpath(ensure_native_str(addon.path)) if addon.path else ""
+        if path and filename.startswith(path + os.sep) and len(path) > match_len:
+            match, match_len = addon.id, len(path)
+
+    if match_len == 0 and filename.startswith(os.path.dirname(os.path.abspath(__file__)) + os.sep):
+        return "addondev"
+    return match
+
+
+class TimedLoader(object):
+    """Proxy around a module loader that times the execution of the module."""
+
+    def __init__(self, loader, profiler, fullname, find_time, cached, library):
+        self._loader = loader
+        self._profiler = profiler
+        self._fullname = fullname
+        self._find_time = find_time
+        self._cached = cached
+        self._library = library
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec) if hasattr(self._loader, "create_module") else None
+
+    def exec_module(self, module):
+        stack = self._profiler.stack
+        stack.append(0.0)
+        start = timer()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = timer() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+
+            filename = getattr(module, "__file__", None)
+            self._profiler.records[self._fullname] = {
+                "addon": owner(filename), "cached": self._cached, "find": self._find_time, "library": self._library,
+                "self": self._find_time + elapsed - children, "cumulative": self._find_time + elapsed}
+
+
+class ImportProfiler(object):
+    """Meta path finder that wraps the loader of every found module with a timed loader."""
+
+    def __init__(self):
+        self.records = OrderedDict()
+        self.stack = []
+        self._finding = False
+
+    def find_spec(self, fullname, path=None, target=None):
+        # Prevent recursion when the other finders import modules
+        if self._finding:
+            return None
+
+        self._finding = True
+        start = timer()
+        try:
+            spec = finder = None
+            for finder in sys.meta_path:
+                if finder is not self and hasattr(finder, "find_spec"):
+                    spec = finder.find_spec(fullname, path, target)
+                    if spec is not None:
+                        break
+        finally:
+            self._finding = False
+
+        find_time = timer() - start
+        if self.stack:
+            self.stack[-1] += find_time
+
+        if spec is not None and spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            cached = bool(spec.cached and os.path.exists(spec.cached))
+            library = finder is libraries.finder
+            spec.loader = TimedLoader(spec.loader, self, fullname, find_time, cached, library)
+        return spec
+
+
+@contextmanager
+def profile(plugin_data):
+    """
+    Profile all imports within the with block, storing the results in the plugin data under the 'imports' key.
+
+    :param dict plugin_data: The plugin data that gets sent back to the controller.
+    """
+    # Only python 3.4+ supports module specs
+    if not enabled or not hasattr(sys, "implementation"):
+        yield
+        return
+
+    profiler = ImportProfiler()
+    sys.meta_path.insert(0, profiler)
+    try:
+        yield
+    finally:
+        sys.meta_path.remove(profiler)
+        plugin_data["imports"] = list(profiler.records.items())
+
+
+def record(callback_url, records):
+    """
+    Display the import times of a route execution, grouped by owning add-on.
+
+    :param str callback_url: The callback url that was executed.
+    :param list records: List of module name and timings returned from the add-on process.
+    """
+    if not records:
+        return
+
+    per_addon = OrderedDict()
+    for _, data in records:
+        totals = per_addon.setdefault(data["addon"], [0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += 0 if data["cached"] else 1
+        totals[2] += data["self"]
+
+    print("")
+    print("Imports of {} ({} modules, {:.3f}s)".format(
+        callback_url, len(records), sum(data["self"] for _, data in records)))
+    print("{} {} {} Add-on".format("Modules".rjust(8), "No pyc".rjust(7), "Time".rjust(9)))
+    for addon_id, (count, uncached, total) in sorted(per_addon.items(), key=lambda item: item[1][2], reverse=True):
+        print("{:>8} {:>7} {:>8.3f}s {}".format(count, uncached, total, addon_id))
+
+    print("{} {} Slowest modules".format("Self".rjust(9), "Cumul".rjust(9)))
+    for name, data in sorted(records, key=lambda item: item[1]["self"], reverse=True)[:top]:
+        print("{:>8.3f}s {:>8.3f}s {} ({}{})".format(data["self"], data["cumulative"], name, data["addon"],
+                                                     "" if data["cached"] else ", no pyc"))
+
+    # Time spent finding modules, library add-on modules are resolved by the library finder
+    library = [data["find"] for _, data in records if data.get("library")]
+    other = [data["find"] for _, data in records if not data.get("library")]
+    print("Module lookup: {:.3f}ms for {} library modules, {:.3f}ms for {} other modules".format(
+        sum(library) * 1000, len(library), sum(other) * 1000, len(other)))
+
+
+def pycache_prefix():
+    """Return the directory to store bytecode for add-ons that are within a read-only directory."""
+    return os.path.join(support.kodi_paths["temp"], u"pycache")
+
+
+def addon_directories(pluginpath=None):
+    """
+    Return the directories that hold add-on code, the plugin and every cached add-on, which includes
+    the dependencies of the plugin.
+
+    :param str pluginpath: The path to the plugin, if known.
+    :rtype: list
+    """
+    cached = [os.path.dirname(path) for path in support.find_addons(support.kodi_paths["addons"])]
+    return [pluginpath] + cached if pluginpath else cached
+
+
+def configure_pycache(pluginpath=None):
+    """
+    Redirect bytecode caching to the mock kodi temp directory if any of the add-on directories is read-only.
+
+    Bytecode is looked up either within the prefix or next to the source, never both, so the prefix is used
+    for all add-ons or for none. The add-on process, the precompile option and the precompile step after
+    downloading dependencies all decide here, over the directories from addon_directories, so the bytecode
+    written by precompile is the bytecode that gets imported.
+
+    Only supported on python 3.8+, earlier versions will just skip writing bytecode.
+
+    :param str pluginpath: The path to the plugin, if known.
+    :returns: The bytecode prefix, or None if bytecode is stored next to the source.
+    """
+    if hasattr(sys, "pycache_prefix") and sys.pycache_prefix is None:
+        if not all(os.access(path, os.W_OK) for path in addon_directories(pluginpath)):
+            sys.pycache_prefix = ensure_native_str(pycache_prefix())
+    return getattr(sys, "pycache_prefix", None)
+
+
+def _bytecode_path(source):
+    """Return the path to the bytecode of a source file."""
+    try:
+        from importlib.util import cache_from_source
+    except ImportError:
+        return source + "c"
+    else:
+        return cache_from_source(source)
+
+
+def _compile_addon(task):
+    """
+    Byte-compile all modules of an add-on.
+
+    To report what precompiling saves, every module is also compiled from source again and loaded from
+    the bytecode, the cost of a cold and of a warm import, without executing the module.
+
+    :returns: Tuple of the add-on directory, the time taken, the number of modules, the cold and the warm time.
+    """
+    import compileall
+    import marshal
+    path, prefix = task
+
+    # The prefix is not inherited by spawned pool processes
+    if prefix:
+        sys.pycache_prefix = prefix
+
+    start = timer()
+    compileall.compile_dir(path, quiet=1)
+    elapsed = timer() - start
+
+    # The header before the marshaled code object, 16 bytes on python 3.7+
+    header = 16 if sys.version_info >= (3, 7) else 12 if sys.version_info >= (3, 3) else 8
+    modules, cold, warm = 0, 0.0, 0.0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            source = os.path.join(root, filename)
+            cached = _bytecode_path(source) if filename.endswith(".py") else None
+            # Modules that failed to compile have no bytecode
+            if cached and os.path.exists(cached):
+                modules += 1
+                start = timer()
+                with open(source, "rb") as stream:
+                    compile(stream.read(), source, "exec", 0, True)
+                cold += timer() - start
+
+                start = timer()
+                with open(cached, "rb") as stream:
+                    marshal.loads(stream.read()[header:])
+                warm += timer() - start
+
+    return path, elapsed, modules, cold, warm
+
+
+def precompile(paths, pluginpath=None, processes=None):
+    """
+    Byte-compile each add-on directory in parallel, and log the import time of the modules before and after.
+
+    :param list paths: List of add-on directories to compile.
+    :param str pluginpath: The path to the plugin, used to decide where the bytecode is stored.
+    :param int processes: The number of worker processes to use, defaults to the cpu count.
+    :returns: List of tuples of add-on directory, time taken, number of modules, cold and warm import time.
+    :rtype: list
+    """
+    prefix = configure_pycache(pluginpath)
+    tasks = [(ensure_native_str(path), prefix) for path in paths]
+
+    start = timer()
+    if len(tasks) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_compile_addon, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_compile_addon(task) for task in tasks]
+
+    support.logger.info("Byte-compiled {} add-ons in {:.3f}s".format(len(tasks), timer() - start))
+    for path, elapsed, modules, cold, warm in results:
+        support.logger.debug("{}: {} modules, cold import {:.1f}ms, warm import {:.1f}ms".format(
+            os.path.basename(path), modules, cold * 1000, warm * 1000))
+    support.logger.info("Import of {} modules: {:.1f}ms cold, {:.1f}ms with bytecode{}".format(
+        sum(result[2] for result in results), sum(result[3] for result in results) * 1000,
+        sum(result[4] for result in results) * 1000, ", stored in {}".format(prefix) if prefix else ""))
+    return results
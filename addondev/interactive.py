@@ -1,9 +1,12 @@
 # Standard Library Imports
 from __future__ import print_function
+from contextlib import contextmanager
 import multiprocessing
+import traceback
 import binascii
 import pickle
 import json
+import time
 import sys
 import re
 import os
@@ -20,8 +23,8 @@ except ImportError:
     import urlparse
 
 # Package imports
-from addondev.utils import input_raw, ensure_native_str, unicode_type
-from addondev import support
+from addondev.utils import input_raw, ensure_native_str, unicode_type, feature
+from addondev import support, tracing, imports, watchdog
 
 
 def interactive(pluginpath, preselect=None, content_type="video", compact_mode=False, no_crop=False):
@@ -71,10 +74,11 @@ def interactive(pluginpath, preselect=None, content_type="video", compact_mode=F
             items.extend(data["playlist"][1:])
 
         # Display the list of listitems for user to select
-        if compact_mode:
-            selected_item = compact_item_selector(items, callback_url, preselect)
-        else:
-            selected_item = detailed_item_selector(items, preselect, no_crop)
+        with tracing.span("render", items=len(items)):
+            if compact_mode:
+                selected_item = compact_item_selector(items, callback_url, preselect)
+            else:
+                selected_item = detailed_item_selector(items, preselect, no_crop)
 
         if selected_item:
             if parent_stack and selected_item["path"] == parent_stack[-1]:
@@ -93,29 +97,157 @@ def execute_addon(*args):
     :returns: A dictionary of listitems and other related results.
     :rtype: dict
     """
+    start = time.time()
+
     # Pips to handle passing of data from addon process to controler
     pipe_recv, pipe_send = multiprocessing.Pipe(duplex=True)
     process_args = [pipe_send]
     process_args.extend(args)
 
     # Create the new process that will execute the addon
-    p = multiprocessing.Process(target=subprocess, args=process_args)
-    p.start()
+    p = multiprocessing.Process(target=subprocess, args=process_args, kwargs={"limits": watchdog.limits()})
+    with tracing.span("spawn"):
+        p.start()
+
+    # Close our copy of the sending end, so that a dead add-on process is seen as end of file
+    pipe_send.close()
 
     # Wait till we receive data from the addon process
-    while True:
-        data = pipe_recv.recv()
-        if "prompt" in data:
-            input_data = input_raw(data["prompt"])
-            pipe_recv.send(input_data)
-        else:
-            break
+    with tracing.span("wait for results"):
+        data = wait_for_results(pipe_recv, p, start)
+
+    if "failure" in data:
+        pipe_recv.close()
+        record_failure(args[0], args[1], data, start)
+        return data
 
-    p.join()
+    # The add-on process sends its own trace events after the results
+    if tracing.enabled:
+        try:
+            tracing.events.extend(pipe_recv.recv()["trace"])
+        except EOFError:
+            pass
+
+    with tracing.span("join"):
+        p.join()
+    pipe_recv.close()
+
+    process_results(args[0], args[1], data, start)
     return data
 
 
-def subprocess(pipe_send, pluginpath, callback_url, content_type):
+def process_results(pluginpath, callback_url, data, start):
+    """
+    Handle all the instrumentation data that was sent back with the results of a route.
+
+    :param unicode pluginpath: The path to the plugin that was executed.
+    :param str callback_url: The callback url that was executed.
+    :param dict data: The results returned from the add-on process.
+    :param float start: The time the route was started.
+    """
+    # The data is only sent when its feature was enabled, so the feature module is already imported
+
+    # Merge and display the profile of the route
+    if "profile" in data:
+        feature("profiling").record(callback_url, data.pop("profile"))
+
+    # Display memory usage and enforce the memory budget
+    if "memory" in data:
+        feature("memory").record(callback_url, data)
+
+    # Display the import times of the route
+    if "imports" in data:
+        imports.record(callback_url, data.pop("imports"))
+
+    # Display the network traffic of the route
+    if "network" in data:
+        feature("network").record(callback_url, data)
+
+    # Display the simulated and real time of the route
+    if "vclock" in data:
+        feature("vclock").record(callback_url, data.pop("vclock"))
+
+    # Merge the line coverage of the route
+    if "coverage" in data:
+        feature("linecov").record(callback_url, data.pop("coverage"))
+
+    # Check the artwork and playable links of the listing
+    links = feature("links")
+    if links and links.enabled:
+        links.record(callback_url, data)
+
+    # Save the timings of the route to the history database
+    history = feature("history")
+    if history and history.enabled:
+        history.record(pluginpath, callback_url, data, time.time() - start)
+
+    # Store the results of the route in the result database
+    resultdb = feature("resultdb")
+    if resultdb and resultdb.enabled:
+        resultdb.record(pluginpath, callback_url, data, time.time() - start)
+
+
+def record_failure(pluginpath, callback_url, data, start):
+    """
+    Record a route whose add-on process died or timed out before sending back its results.
+
+    There is no instrumentation data to handle, only the history and result databases get the failure.
+
+    :param unicode pluginpath: The path to the plugin that was executed.
+    :param str callback_url: The callback url that was executed.
+    :param dict data: The failure results, from watchdog.failure.
+    :param float start: The time the route was started.
+    """
+    history, resultdb = feature("history"), feature("resultdb")
+    if history and history.enabled:
+        history.record(pluginpath, callback_url, data, time.time() - start)
+    if resultdb and resultdb.enabled:
+        resultdb.record(pluginpath, callback_url, data, time.time() - start)
+
+
+def wait_for_results(pipe_recv, process, start):
+    """
+    Wait for the results of the add-on process, answering any prompts along the way.
+
+    The add-on process is killed if it exceeds the route timeout, or if the wait is interrupted, e.g. by Ctrl+C.
+    With limits set the add-on process is in its own process group, so it never sees the interrupt itself.
+
+    :param pipe_recv: The communication object used for receiving data from the add-on process.
+    :param process: The add-on process.
+    :param float start: The time the route was started.
+    :returns: The results of the add-on, or the failure details if the add-on process died or timed out.
+    :rtype: dict
+    """
+    deadline = start + watchdog.timeout if watchdog.timeout is not None else None
+    try:
+        while True:
+            if deadline is not None and not pipe_recv.poll(max(deadline - time.time(), 0)):
+                watchdog.kill(process)
+                return watchdog.failure("timeout", time.time() - start, process.exitcode)
+
+            try:
+                data = pipe_recv.recv()
+            except EOFError:
+                # The add-on process died before sending any results
+                process.join()
+                return watchdog.failure(watchdog.exit_reason(process.exitcode), time.time() - start, process.exitcode)
+
+            if "prompt" in data:
+                prompt_start = time.time()
+                input_data = input_raw(data["prompt"])
+                pipe_recv.send(input_data)
+
+                # Time spent waiting on the user does not count towards the timeout
+                if deadline is not None:
+                    deadline += time.time() - prompt_start
+            else:
+                return data
+    except BaseException:
+        watchdog.kill(process)
+        raise
+
+
+def subprocess(pipe_send, pluginpath, callback_url, content_type, limits=None):
     """
     Imports and executes the addon.
 
@@ -123,10 +255,56 @@ def subprocess(pipe_send, pluginpath, callback_url, content_type):
     :param unicode pluginpath: The path to the plugin to execute.
     :param str callback_url: The url containing the route path and callback params.
     :param str content_type: The content type to list, if more than one type is available.
+    :param dict limits: The resource limits of the route, from watchdog.limits().
     """
-    addon_data = support.initializer(pluginpath)
+    watchdog.limit_process(limits)
+
+    # Discard any events inherited from the controller
+    tracing.collect()
+    tracing.process_name("add-on: {}".format(callback_url))
+
+    with tracing.span("initializer"):
+        addon_data = support.initializer(pluginpath)
     support.data_pipe = pipe_send
+    imports.configure_pycache(pluginpath)
+    install_log()
+    execute_route(pipe_send, addon_data, callback_url, content_type)
+
+
+def install_log():
+    """Write the add-on log to kodi.log and capture the log of each route, if enabled. Called in the add-on process."""
+    kodilog = feature("kodilog")
+    if kodilog:
+        kodilog.install()
 
+
+@contextmanager
+def _untouched():
+    yield
+
+
+def instrument(name, function, *args):
+    """
+    Return the context manager of an optional feature module that instruments a route.
+
+    :param str name: The name of the feature module.
+    :param str function: The name of the context manager function within the module.
+    :param args: The arguments to the context manager function.
+    :returns: The context manager, or one that does nothing if the feature module was never imported.
+    """
+    module = feature(name)
+    return getattr(module, function)(*args) if module else _untouched()
+
+
+def execute_route(pipe_send, addon_data, callback_url, content_type):
+    """
+    Execute a single route of an already initialized add-on and send back the results.
+
+    :param pipe_send: The communication object used for sending data back to the initiator.
+    :param addon_data: The add-on object of the plugin being executed.
+    :param str callback_url: The url containing the route path and callback params.
+    :param str content_type: The content type to list, if more than one type is available.
+    """
     # Splits callback into it's individual components
     scheme, pluginid, selector, params, _ = urlparse.urlsplit(ensure_native_str(callback_url))
     if params:
@@ -147,12 +325,33 @@ def subprocess(pipe_send, pluginpath, callback_url, content_type):
     # Patch sys.argv to emulate what is expected
     sys.argv = (urlparse.urlunsplit([scheme, pluginid, selector, "", ""]), -1, params)
 
+    plugin_data = support.plugin_data
     try:
-        addon = __import__(addon_data.entry_point)
-        addon.run()
+        with instrument("network", "monitor", plugin_data), instrument("cassettes", "use", callback_url):
+            with instrument("vclock", "use", plugin_data), instrument("kodilog", "capture", plugin_data):
+                with imports.profile(plugin_data), instrument("linecov", "collect", plugin_data):
+                    with tracing.span("import entry_point", "import", module=addon_data.entry_point):
+                        addon = __import__(addon_data.entry_point)
+                    with tracing.span("run"), instrument("profiling", "profile", plugin_data):
+                        with instrument("memory", "measure", plugin_data):
+                            addon.run()
+    except Exception as e:
+        support.plugin_data["error"] = "{}: {}".format(type(e).__name__, e)
+        support.plugin_data["stack"] = [(frame[0], frame[1], frame[2])
+                                        for frame in traceback.extract_tb(sys.exc_info()[2])]
+        raise
     finally:
+        history, selective = feature("history"), feature("selective")
+        if history and history.enabled:
+            support.plugin_data["timings"] = history.child_timings()
+        if selective and selective.enabled:
+            support.plugin_data["inputs"] = selective.loaded_inputs()
+
         # Send back the results from the addon
-        pipe_send.send(support.plugin_data)
+        with tracing.span("send results"):
+            pipe_send.send(support.plugin_data)
+        if tracing.enabled:
+            pipe_send.send({"trace": tracing.collect()})
 
 
 def compact_item_selector(listitems, current, preselect):
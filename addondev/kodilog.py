@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Emulation of kodi.log for the add-on process.
+
+Log records of the add-on are written to kodi.log within the mock kodi temp directory, through a memory
+buffer so that chatty add-ons are not slowed down by a write per line. The log file is rotated by size.
+
+Each route can also keep the records it produced in a fixed size ring buffer, which is sent back to the
+controller with the plugin data under the 'log' key.
+"""
+
+# Standard Library Imports
+from contextlib import contextmanager
+from collections import deque
+import logging
+import os
+
+# Package imports
+from addondev import support
+
+# Set to True to write the add-on log to kodi.log
+enabled = False
+
+# The number of records to buffer before writing to kodi.log, errors are always written straight away
+buffer_size = 512
+
+# The size in bytes at which kodi.log is rotated, and the number of old logs to keep
+max_bytes = 5 * 1024 * 1024
+backups = 3
+
+# The minimum level of records to capture per route, None to disable capturing
+capture_level = None
+
+# The max number of records to capture per route, older records are dropped
+capacity = 1000
+
+# The buffered kodi.log handler
+_handler = None
+
+
+class RingHandler(logging.Handler):
+    """Handler that keeps the most recent records in memory."""
+
+    def __init__(self, level, maxlen):
+        super(RingHandler, self).__init__(level)
+        self.records = deque(maxlen=maxlen)
+        self.dropped = 0
+
+    def emit(self, record):
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append(record)
+
+
+def install():
+    """Start writing the add-on log to kodi.log and capturing records. Called from within the add-on process."""
+    global _handler
+    level = support.logger.level
+
+    # Lower the logger level to reach the capture level, without showing any more records on the console
+    if capture_level is not None and support.logger.level > capture_level:
+        support.handler.setLevel(max(support.handler.level, support.logger.level))
+        support.logger.setLevel(capture_level)
+
+    if not enabled or _handler is not None:
+        return
+
+    from logging.handlers import MemoryHandler, RotatingFileHandler
+    support.makedirs(os.path.dirname(support.kodi_paths["logpath"]))
+    target = RotatingFileHandler(support.kodi_paths["logpath"], maxBytes=max_bytes, backupCount=backups,
+                                 encoding="utf8", delay=True)
+    target.setFormatter(logging.Formatter("%(asctime)s T:%(thread)d %(levelname)7s: %(message)s"))
+    _handler = MemoryHandler(buffer_size, flushLevel=logging.ERROR, target=target)
+    _handler.setLevel(level)
+    support.logger.addHandler(_handler)
+
+    # The full log is in kodi.log, so only show the important records on the console
+    support.handler.setLevel(max(support.handler.level, logging.WARNING))
+
+
+def flush():
+    """Write any buffered records to kodi.log."""
+    if _handler is not None:
+        _handler.flush()
+
+
+@contextmanager
+def capture(plugin_data):
+    """
+    Capture the log records of the with block, storing them in the plugin data under the 'log' key.
+
+    :param dict plugin_data: The plugin data that gets sent back to the controller.
+    """
+    if capture_level is None:
+        try:
+            yield
+        finally:
+            flush()
+        return
+
+    handler = RingHandler(capture_level, capacity)
+    support.logger.addHandler(handler)
+    try:
+        yield
+    finally:
+        support.logger.removeHandler(handler)
+        flush()
+
+        log = [{"created": record.created, "level": record.levelname, "message": record.getMessage()}
+               for record in handler.records]
+        if handler.dropped:
+            log.insert(0, {"created": log[0]["created"], "level": "WARNING",
+                           "message": "{} older records were dropped".format(handler.dropped)})
+        plugin_data["log"] = log
+
+
+def format_log(log, indent=""):
+    """Return the captured log records as lines of text."""
+    return ["{}{:>7}: {}".format(indent, record["level"], record["message"]) for record in log]
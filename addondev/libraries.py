@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Import resolution of the library add-ons, the 'xbmc.python.module' dependencies of the plugin.
+
+Rather than inserting the library directory of every dependency at the front of sys.path, where every
+import has to search each of them in turn, a meta path finder maps the top level modules and packages
+of every library directory to the add-on that owns it. The modules of a library then resolve with a
+single lookup, and modules provided by more than one dependency are reported instead of silently shadowed.
+"""
+
+# Standard Library Imports
+import warnings
+import sys
+import os
+import re
+
+# Package imports
+from addondev.utils import ensure_native_str
+
+try:
+    from importlib.machinery import PathFinder, all_suffixes
+except ImportError:
+    # Python 2
+    import imp
+    PathFinder = None
+
+    def all_suffixes():
+        return [suffix for suffix, _, _ in imp.get_suffixes()]
+
+
+class LibraryFinder(object):
+    """
+    Meta path finder that maps top level module names to the library directory of the owning add-on.
+
+    :ivar dict modules: Dict of module name to a tuple of add-on id and library directory.
+    :ivar list clashes: List of module name, shadowed add-on id and add-on id, for modules with more than one owner.
+    """
+
+    def __init__(self):
+        self.modules = {}
+        self.clashes = []
+        self.paths = []
+
+    def add(self, addon_id, library_path):
+        """
+        Map the top level modules of a library directory to the given add-on.
+
+        Modules that are already provided by another add-on are taken over by this add-on, the same order
+        of precedence as when the library directories were inserted at the front of sys.path.
+
+        :param str addon_id: The id of the add-on that owns the library.
+        :param str library_path: The library directory of the add-on.
+        """
+        if library_path in self.paths:
+            return
+
+        self.paths.append(library_path)
+        for name in top_level_modules(library_path):
+            current = self.modules.get(name)
+            if current is not None and current[0] != addon_id:
+                self.clashes.append((name, current[0], addon_id))
+                warnings.warn("module '{}' is provided by both {} and {}, using {}".format(
+                    name, current[0], addon_id, addon_id))
+            self.modules[name] = (addon_id, library_path)
+
+    def find_spec(self, fullname, path=None, target=None):
+        # Submodules are found through the search path of their parent package
+        if path is None and fullname in self.modules:
+            return PathFinder.find_spec(fullname, [self.modules[fullname][1]], target)
+        return None
+
+    def find_module(self, fullname, path=None):
+        # Python 2
+        if path is None and fullname in self.modules:
+            import pkgutil
+            return pkgutil.ImpImporter(self.modules[fullname][1]).find_module(fullname)
+        return None
+
+
+def top_level_modules(library_path):
+    """
+    Return the names of the top level modules and packages within a library directory.
+
+    Directories without an __init__ file are namespace packages and are left to the path based finder.
+
+    :param str library_path: The library directory.
+    :rtype: set
+    """
+    try:
+        entries = os.listdir(library_path)
+    except OSError:
+        return set()
+
+    # Longest suffix first, so that e.g. '.cpython-311-x86_64-linux-gnu.so' is matched before '.so'
+    suffixes = sorted(set(all_suffixes()), key=len, reverse=True)
+    inits = set("__init__" + suffix for suffix in suffixes)
+    names = set()
+    for entry in entries:
+        path = os.path.join(library_path, entry)
+        if os.path.isdir(path):
+            if inits.intersection(os.listdir(path)):
+                names.add(entry)
+        else:
+            for suffix in suffixes:
+                if entry.endswith(suffix):
+                    names.add(entry[:-len(suffix)])
+                    break
+
+    return set(name for name in names if re.match(r"[A-Za-z_]\w*$", name))
+
+
+# The finder of the library add-ons, installed on first use
+finder = LibraryFinder()
+
+
+def register(addon_id, library_path):
+    """
+    Make the modules of a library add-on importable.
+
+    The library directory is also appended to the end of sys.path, so namespace packages and code that
+    searches sys.path itself still work. Only modules the finder doesn't know reach it there.
+
+    :param str addon_id: The id of the add-on that owns the library.
+    :param str library_path: The library directory of the add-on.
+    """
+    library_path = ensure_native_str(library_path)
+    if finder not in sys.meta_path:
+        # Builtin and frozen modules keep precedence, as they did over sys.path
+        position = sys.meta_path.index(PathFinder) if PathFinder in sys.meta_path else len(sys.meta_path)
+        sys.meta_path.insert(position, finder)
+
+    finder.add(addon_id, library_path)
+    if library_path not in sys.path:
+        sys.path.append(library_path)
+
+
+def reset():
+    """Remove the finder and forget every registered library."""
+    if finder in sys.meta_path:
+        sys.meta_path.remove(finder)
+    for library_path in finder.paths:
+        if library_path in sys.path:
+            sys.path.remove(library_path)
+    finder.__init__()
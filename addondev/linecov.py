@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Line coverage of the add-on, collected within the add-on process and merged by the controller.
+
+The cheapest tracing mechanism of the interpreter is used. On python 3.12+ sys.monitoring is used,
+line events are only enabled for code objects of the add-on and each line is disabled after its
+first hit, so covered code runs at full speed afterwards. Older interpreters fall back to settrace,
+where only the frames of add-on files get a local trace function.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from contextlib import contextmanager
+from codecs import open as _open
+import threading
+import time
+import dis
+import sys
+import os
+
+# Package imports
+from addondev import support
+
+# Set to True to collect line coverage
+enabled = False
+
+# The max number of files to display in the summary, least covered first
+top = 30
+
+# Covered lines of every file, merged from all routes
+files = {}
+
+# The add-on directories that were traced
+roots = set()
+
+# Coverage of each route, as tuples of url, lines hit, new lines and the coverage data
+routes = []
+
+# High resolution timer, fallback to time.time on python 2
+timer = getattr(time, "perf_counter", time.time)
+
+
+class Collector(object):
+    """
+    Base collector, records the lines hit within the given directory.
+
+    Only the time spent within the callbacks is measured, the dispatch cost of the interpreter itself is not
+    included, so the real overhead of tracing is higher.
+
+    :param str root: The directory of the add-on, files outside of it are not traced.
+    """
+    mode = None
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root) + os.sep
+        self.lines = {}
+        self.events = 0
+        self.callback_time = 0.0
+        self._included = {}
+
+    def included(self, filename):
+        """Check if the given code filename belongs to the add-on."""
+        try:
+            return self._included[filename]
+        except KeyError:
+            # Frozen and generated code has names such as '<frozen importlib._bootstrap>'
+            result = not filename.startswith("<") and os.path.realpath(filename).startswith(self.root)
+            self._included[filename] = result
+            return result
+
+    def hit(self, filename, line):
+        try:
+            self.lines[filename].add(line)
+        except KeyError:
+            self.lines[filename] = {line}
+
+
+class MonitoringCollector(Collector):
+    """Collector using sys.monitoring, python 3.12+."""
+    mode = "monitoring"
+
+    def __init__(self, root):
+        super(MonitoringCollector, self).__init__(root)
+        self.tool = None
+        self._codes = []
+
+    def _py_start(self, code, _):
+        start = timer()
+        self.events += 1
+        if self.included(code.co_filename):
+            sys.monitoring.set_local_events(self.tool, code, sys.monitoring.events.LINE)
+            self._codes.append(code)
+        self.callback_time += timer() - start
+        return sys.monitoring.DISABLE
+
+    def _line(self, code, line):
+        start = timer()
+        self.events += 1
+        self.hit(code.co_filename, line)
+        self.callback_time += timer() - start
+        return sys.monitoring.DISABLE
+
+    def start(self):
+        monitoring = sys.monitoring
+        for tool in (monitoring.COVERAGE_ID, 4, 3):
+            if monitoring.get_tool(tool) is None:
+                self.tool = tool
+                break
+        else:
+            raise RuntimeError("no free sys.monitoring tool id")
+
+        monitoring.use_tool_id(self.tool, "addondev")
+        monitoring.register_callback(self.tool, monitoring.events.PY_START, self._py_start)
+        monitoring.register_callback(self.tool, monitoring.events.LINE, self._line)
+        monitoring.set_events(self.tool, monitoring.events.PY_START)
+        monitoring.restart_events()
+
+    def stop(self):
+        monitoring = sys.monitoring
+        monitoring.set_events(self.tool, monitoring.events.NO_EVENTS)
+        for code in self._codes:
+            monitoring.set_local_events(self.tool, code, monitoring.events.NO_EVENTS)
+        monitoring.register_callback(self.tool, monitoring.events.PY_START, None)
+        monitoring.register_callback(self.tool, monitoring.events.LINE, None)
+        monitoring.free_tool_id(self.tool)
+
+
+class TraceCollector(Collector):
+    """Collector using sys.settrace, for interpreters without sys.monitoring."""
+    mode = "settrace"
+
+    def _global(self, frame, event, _):
+        start = timer()
+        self.events += 1
+        tracer = self._local if self.included(frame.f_code.co_filename) else None
+        self.callback_time += timer() - start
+        return tracer
+
+    def _local(self, frame, event, _):
+        if event == "line":
+            start = timer()
+            self.events += 1
+            self.hit(frame.f_code.co_filename, frame.f_lineno)
+            self.callback_time += timer() - start
+        return self._local
+
+    def start(self):
+        threading.settrace(self._global)
+        sys.settrace(self._global)
+
+    def stop(self):
+        sys.settrace(None)
+        threading.settrace(None)
+
+
+def collector(root):
+    """Return the cheapest collector that the interpreter supports."""
+    if hasattr(sys, "monitoring"):
+        return MonitoringCollector(root)
+    else:
+        return TraceCollector(root)
+
+
+@contextmanager
+def collect(plugin_data):
+    """
+    Collect the line coverage of the with block, storing it in the plugin data under the 'coverage' key.
+
+    :param dict plugin_data: The plugin data that gets sent back to the controller.
+    """
+    if not enabled:
+        yield
+        return
+
+    cov = collector(support.avail_addons[support.plugin_id].path)
+    start = timer()
+    cov.start()
+    try:
+        yield
+    finally:
+        cov.stop()
+        plugin_data["coverage"] = {"mode": cov.mode, "root": cov.root, "events": cov.events,
+                                   "callback_time": cov.callback_time, "elapsed": timer() - start,
+                                   "lines": dict((os.path.realpath(filename), sorted(lines))
+                                                 for filename, lines in cov.lines.items())}
+
+
+def executable_lines(filename):
+    """Return the set of line numbers of a source file that hold executable code."""
+    with _open(filename, "r", "utf8") as stream:
+        source = stream.read()
+
+    try:
+        code = compile(source, filename, "exec")
+    except SyntaxError:
+        return set()
+
+    lines = set()
+    pending = [code]
+    while pending:
+        code = pending.pop()
+        lines.update(line for _, line in dis.findlinestarts(code) if line)
+        pending.extend(const for const in code.co_consts if hasattr(const, "co_code"))
+    return lines
+
+
+def format_ranges(lines):
+    """Return the sorted line numbers as a compact string of ranges. e.g. 3-5, 9"""
+    ranges = []
+    for line in sorted(lines):
+        if ranges and ranges[-1][1] == line - 1:
+            ranges[-1][1] = line
+        else:
+            ranges.append([line, line])
+    return ", ".join(str(start) if start == end else "{}-{}".format(start, end) for start, end in ranges)
+
+
+def source_files(root):
+    """Return all python files within the add-on directory."""
+    for path, dirs, filenames in os.walk(root):
+        dirs[:] = [name for name in dirs if name != "__pycache__" and not name.startswith(".")]
+        for filename in filenames:
+            if filename.endswith(".py"):
+                yield os.path.join(path, filename)
+
+
+def record(callback_url, data):
+    """
+    Merge the line coverage of a route execution into the totals.
+
+    :param str callback_url: The callback url that was executed.
+    :param dict data: The coverage data returned from the add-on process.
+    """
+    roots.add(data["root"])
+    hits = new = 0
+    for filename, lines in data["lines"].items():
+        covered = files.setdefault(filename, set())
+        hits += len(lines)
+        new += len(set(lines) - covered)
+        covered.update(lines)
+    routes.append((callback_url, hits, new, data))
+
+
+def print_summary():
+    """Display the merged line coverage of every add-on file, along with the callback time of each route."""
+    if not routes:
+        return
+
+    print("")
+    print("{} {} {} {} Url".format("Lines".rjust(6), "New".rjust(6), "Events".rjust(8), "Callback time".rjust(15)))
+    print("-" * 70)
+    for url, hits, new, data in routes:
+        print("{:>6} {:>6} {:>8} {:>8.3f}s {:>4.0f}% {}".format(
+            hits, new, data["events"], data["callback_time"],
+            data["callback_time"] * 100 / max(data["elapsed"], 1e-9), url))
+
+    # Compare against the executable lines of every source file of the add-on, including files never imported
+    results = []
+    for filename in sorted(set(files).union(*[source_files(root) for root in roots])):
+        if os.path.exists(filename):
+            statements = executable_lines(filename)
+            missing = statements - files.get(filename, set())
+            results.append((filename, len(statements), missing))
+
+    results.sort(key=lambda item: (len(item[2]) / float(max(item[1], 1)), item[0]), reverse=True)
+    root = os.path.commonprefix([filename for filename, _, _ in results])
+    root = root[:root.rfind(os.sep) + 1]
+
+    print("")
+    print("{} {} {} File".format("Stmts".rjust(6), "Miss".rjust(6), "Cover".rjust(6)))
+    print("-" * 70)
+    for filename, statements, missing in results[:top]:
+        cover = 100.0 * (statements - len(missing)) / statements if statements else 100.0
+        print("{:>6} {:>6} {:>5.0f}% {}".format(statements, len(missing), cover, filename[len(root):]))
+        if missing:
+            print("{}Missing: {}".format(" " * 22, format_ranges(missing)))
+
+    statements = sum(result[1] for result in results)
+    missing = sum(len(result[2]) for result in results)
+    callback_time = sum(data["callback_time"] for _, _, _, data in routes)
+    elapsed = sum(data["elapsed"] for _, _, _, data in routes)
+    print("-" * 70)
+    print("{:>6} {:>6} {:>5.0f}% Total, using {}, {:.3f}s in callbacks of {:.3f}s traced ({:.1f}%)".format(
+        statements, missing, 100.0 * (statements - missing) / statements if statements else 100.0,
+        routes[-1][3]["mode"], callback_time, elapsed, callback_time * 100 / max(elapsed, 1e-9)))
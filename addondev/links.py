@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Validation of the urls found within listitems, the artwork and the path of playable items.
+
+All unique urls are checked concurrently using a pool of threads that share a single http session,
+with a limit on the number of concurrent requests per host. Each url is first checked with a HEAD
+request, falling back to a GET of the first byte for servers that do not handle HEAD requests.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from collections import OrderedDict
+import threading
+import time
+import re
+
+try:
+    import urllib.parse as urlparse
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    import urlparse
+
+# Set to True to check the links of each route after it's executed
+enabled = False
+
+# The number of urls to check at the same time
+workers = 16
+
+# The max number of concurrent requests per host
+per_host = 4
+
+# The time in seconds to wait for a response
+timeout = 10.0
+
+# Links that take longer than this many seconds are reported as slow
+slow = 2.0
+
+# Results of every url that has been checked, keyed by url
+_cache = {}
+
+# Semaphores limiting the concurrent requests per host
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+# The shared http session
+_session = None
+
+
+def session():
+    """Return the shared http session, with a connection pool large enough for all workers."""
+    global _session
+    if _session is None:
+        # Requests is slow to import, so only import it once links are checked
+        import requests
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
+
+
+def host_limit(url):
+    """Return the semaphore that limits the concurrent requests to the host of the url."""
+    host = urlparse.urlsplit(url).netloc
+    with _hosts_lock:
+        if host not in _hosts:
+            _hosts[host] = threading.BoundedSemaphore(per_host)
+        return _hosts[host]
+
+
+def extract_links(listitems):
+    """
+    Return all http links of the given listitems.
+
+    :param list listitems: List of listitem tuples of url, listitem data and isfolder.
+    :returns: List of tuples of listitem label, field name and url.
+    :rtype: list
+    """
+    links = []
+    for _, item, _ in listitems:
+        label = re.sub(r"\[[^\]]+?\]", "", item.get("label", "")).strip()
+        for name, url in sorted(item.get("art", {}).items()):
+            links.append((label, "art.{}".format(name), url))
+        links.append((label, "path", item.get("path", "")))
+    return [link for link in links if link[2] and link[2].startswith(("http://", "https://"))]
+
+
+def check_url(url):
+    """
+    Check that the given url is reachable.
+
+    :param str url: The url to check.
+    :returns: Dict of the http status, the time taken and the error if the link is dead.
+    :rtype: dict
+    """
+    status = error = None
+    elapsed = 0.0
+    try:
+        with host_limit(url):
+            # Only time the requests, not the wait for a free slot of the host
+            start = time.time()
+            try:
+                resp = session().head(url, allow_redirects=True, timeout=timeout)
+                status = resp.status_code
+
+                # Many servers reject or mishandle HEAD requests, so confirm with a GET of the first byte
+                if status >= 400:
+                    resp = session().get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=timeout)
+                    status = resp.status_code
+                    resp.close()
+            finally:
+                elapsed = time.time() - start
+
+    # Any error is a dead link, e.g. a malformed url raises a ValueError or UnicodeError rather than a
+    # RequestException, and must not abort the checks of all the other urls
+    except Exception as e:
+        error = type(e).__name__
+
+    if error is None and status >= 400:
+        error = "HTTP {}".format(status)
+    return {"status": status, "elapsed": elapsed, "error": error}
+
+
+def check(urls):
+    """
+    Check all the given urls concurrently, skipping any urls that have already been checked.
+
+    :param urls: Iterable of urls to check.
+    :returns: Dict of url to check result.
+    :rtype: dict
+    """
+    urls = list(OrderedDict.fromkeys(urls))
+    pending = [url for url in urls if url not in _cache]
+    if pending:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(workers, len(pending)))
+        try:
+            for url, result in zip(pending, pool.map(check_url, pending)):
+                _cache[url] = result
+        finally:
+            pool.close()
+            pool.join()
+
+    return dict((url, _cache[url]) for url in urls)
+
+
+def validate(listitems):
+    """
+    Check all the links of the given listitems.
+
+    :param list listitems: List of listitem tuples of url, listitem data and isfolder.
+    :returns: List of problems as tuples of kind, listitem label, field name, url and check result.
+    :rtype: list
+    """
+    links = extract_links(listitems)
+    results = check(url for _, _, url in links)
+
+    problems = []
+    for label, field, url in links:
+        result = results[url]
+        if result["error"]:
+            problems.append(("DEAD", label, field, url, result))
+        elif result["elapsed"] > slow:
+            problems.append(("SLOW", label, field, url, result))
+    return problems
+
+
+def print_problems(title, links, problems):
+    """Display the dead and slow links of a set of listitems."""
+    dead = len([problem for problem in problems if problem[0] == "DEAD"])
+    print("")
+    print("{}: {} links, {} dead, {} slow".format(title, links, dead, len(problems) - dead))
+
+    for kind, label, field, url, result in problems:
+        print("  {} {} {:>7.3f}s {} {} {}".format(kind, str(result["error"] or result["status"]).ljust(16),
+                                                  result["elapsed"], label, field, url))
+
+
+def record(callback_url, data):
+    """
+    Check and display the dead and slow links of a route execution.
+
+    :param str callback_url: The callback url that was executed.
+    :param dict data: The results returned from the add-on process.
+    """
+    start = time.time()
+    problems = validate(data["listitem"])
+    print_problems("Links of {} checked in {:.3f}s".format(callback_url, time.time() - start),
+                   len(extract_links(data["listitem"])), problems)
+
+
+def check_results(results):
+    """
+    Check the links of every route of a batch or crawl report, all at once.
+
+    :param list results: List of route results.
+    :returns: The number of dead links.
+    :rtype: int
+    """
+    start = time.time()
+    check(url for result in results for _, _, url in extract_links(result["data"]["listitem"]))
+    elapsed = time.time() - start
+
+    dead = 0
+    for result in results:
+        links = extract_links(result["data"]["listitem"])
+        problems = validate(result["data"]["listitem"])
+        dead += len([problem for problem in problems if problem[0] == "DEAD"])
+        if problems:
+            print_problems("Links of {}".format(result["url"]), len(links), problems)
+
+    print("")
+    print("{} unique links checked in {:.3f}s, {} dead links found".format(len(_cache), elapsed, dead))
+    return dead
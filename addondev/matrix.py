@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Matrix runner, executes the same routes under several python interpreters and compares the results.
+
+Every interpreter runs addondev in batch or crawl mode within its own process, all at the same time,
+saving a json report of normalized results. The reports are then compared route by route.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+import subprocess
+import tempfile
+import shutil
+import json
+import time
+import os
+
+# The maximum number of differences to display per route
+max_differences = 10
+
+# Placeholder for values that are missing from one of the results
+MISSING = "<missing>"
+
+
+def run_interpreter(python, pluginpath, options, report):
+    """
+    Run addondev under the given interpreter, saving the results to report.
+
+    The interpreter imports addondev from this source tree, so it only needs the dependencies installed.
+
+    :param str python: The python interpreter to use.
+    :param unicode pluginpath: The path to the plugin to execute.
+    :param list options: Extra command line options for addondev, these must select batch or crawl mode.
+    :param str report: The path to save the json report to.
+    :returns: A dict of the interpreter, the loaded report or None on failure, the output and the time taken.
+    :rtype: dict
+    """
+    env = os.environ.copy()
+    source_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(path for path in (source_root, env.get("PYTHONPATH")) if path)
+
+    command = [python, "-m", "addondev.cli", pluginpath, "--report", report] + options
+    start = time.time()
+    try:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+    except OSError as e:
+        return {"python": python, "report": None, "output": str(e), "elapsed": 0.0}
+
+    output = proc.communicate()[0].decode("utf8", "replace")
+    elapsed = time.time() - start
+
+    data = None
+    if os.path.exists(report):
+        with open(report) as stream:
+            data = json.load(stream)
+    return {"python": python, "report": data, "output": output, "elapsed": elapsed}
+
+
+def run_matrix(pythons, pluginpath, options):
+    """
+    Run addondev under every interpreter in parallel.
+
+    :param list pythons: The python interpreters to use.
+    :param unicode pluginpath: The path to the plugin to execute.
+    :param list options: Extra command line options for addondev.
+    :returns: List of interpreter runs, in the order the interpreters were given.
+    :rtype: list
+    """
+    workdir = tempfile.mkdtemp(prefix="addondev-matrix-")
+    pool = ThreadPool(len(pythons))
+    try:
+        jobs = [pool.apply_async(run_interpreter, (python, pluginpath, options,
+                                                   os.path.join(workdir, "{}.json".format(count))))
+                for count, python in enumerate(pythons)]
+        return [job.get() for job in jobs]
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def flatten(value, prefix=""):
+    """Flatten nested results into a dict of path to value, e.g. {'listitem[0][1].label': 'Videos'}"""
+    items = OrderedDict()
+    if isinstance(value, dict):
+        for key in sorted(value):
+            items.update(flatten(value[key], "{}.{}".format(prefix, key) if prefix else key))
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            items.update(flatten(item, "{}[{}]".format(prefix, index)))
+        if not value:
+            items[prefix] = value
+    else:
+        items[prefix] = value
+    return items
+
+
+def compare(runs):
+    """
+    Compare the results of each route between the interpreters. Timings and captured logs are ignored.
+
+    :param list runs: List of interpreter runs.
+    :returns: List of tuples of route url and a list of differences, each a tuple of path and a list of values.
+    :rtype: list
+    """
+    reports = [dict((route["url"], route) for route in run["report"]["routes"]) for run in runs]
+    urls = OrderedDict.fromkeys(url for run in runs for url in (route["url"] for route in run["report"]["routes"]))
+
+    results = []
+    for url in urls:
+        flat = []
+        for routes in reports:
+            route = dict(routes[url]) if url in routes else {"executed": False}
+            route.pop("elapsed", None)
+            route.pop("log", None)
+            flat.append(flatten(route))
+
+        differences = []
+        for path in OrderedDict.fromkeys(path for values in flat for path in values):
+            values = [values.get(path, MISSING) for values in flat]
+            if len(set(json.dumps(value, sort_keys=True) for value in values)) > 1:
+                differences.append((path, values))
+        if differences:
+            results.append((url, differences))
+    return results
+
+
+def label(run):
+    """Return a short label of the interpreter of a run."""
+    report = run["report"]
+    if report:
+        return "{} {}".format(report["implementation"], report["python"])
+    return os.path.basename(run["python"])
+
+
+def print_latency(runs):
+    """Display the latency of each route under each interpreter."""
+    labels = [label(run) for run in runs]
+    width = max(12, *[len(name) for name in labels])
+    timings = [dict((route["url"], route) for route in run["report"]["routes"]) for run in runs]
+    urls = OrderedDict.fromkeys(url for routes in timings for url in routes)
+
+    print("")
+    print("{} Url".format(" ".join(name.rjust(width) for name in labels)))
+    print("-" * ((width + 1) * len(labels) + 40))
+    for url in urls:
+        cells = []
+        for routes in timings:
+            route = routes.get(url)
+            if route is None:
+                cells.append("-".rjust(width))
+            else:
+                text = "{:.3f}s".format(route["elapsed"])
+                cells.append((text if route["succeeded"] else "FAIL " + text).rjust(width))
+        print("{} {}".format(" ".join(cells), url))
+
+    print("-" * ((width + 1) * len(labels) + 40))
+    totals = ["{:.3f}s".format(sum(route["elapsed"] for route in routes.values())).rjust(width) for routes in timings]
+    print("{} Total".format(" ".join(totals)))
+
+
+def print_differences(runs, differences):
+    """Display the behavioral differences of each route between the interpreters."""
+    labels = [label(run) for run in runs]
+    print("")
+    if not differences:
+        print("No behavioral differences between {}".format(", ".join(labels)))
+        return
+
+    print("Behavioral differences between {}".format(", ".join(labels)))
+    for url, diffs in differences:
+        print("")
+        print(url)
+        for path, values in diffs[:max_differences]:
+            print("  {}".format(path or "result"))
+            for name, value in zip(labels, values):
+                print("    {}: {}".format(name.ljust(14), json.dumps(value, sort_keys=True)))
+        if len(diffs) > max_differences:
+            print("  ... and {} more differences".format(len(diffs) - max_differences))
+
+
+def matrix(pythons, pluginpath, options):
+    """
+    Run the routes under every interpreter and display the latency and behavioral differences.
+
+    :param list pythons: The python interpreters to use.
+    :param unicode pluginpath: The path to the plugin to execute.
+    :param list options: Extra command line options for addondev, these must select batch or crawl mode.
+    :returns: The number of routes that differ, plus the number of interpreters that failed to run.
+    :rtype: int
+    """
+    runs = run_matrix(pythons, pluginpath, options)
+
+    failed = [run for run in runs if run["report"] is None]
+    for run in failed:
+        print("Failed to run {}:".format(run["python"]))
+        print(run["output"].rstrip())
+
+    runs = [run for run in runs if run["report"] is not None]
+    if not runs:
+        return len(failed)
+
+    print_latency(runs)
+    differences = compare(runs)
+    print_differences(runs, differences)
+    return len(differences) + len(failed)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Per route memory accounting of add-on execution.
+
+Records the peak resident memory of the add-on process, the top allocation sites of 'addon.run()'
+and the serialized size of the plugin data that is sent back to the controller.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from contextlib import contextmanager
+import pickle
+import sys
+
+try:
+    import tracemalloc
+except ImportError:
+    # tracemalloc is only available on python 3.4+
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    # resource is unavailable on windows
+    resource = None
+
+# Package imports
+from addondev.utils import format_size
+
+# Set to True to enable memory accounting
+enabled = False
+
+# The max peak resident memory in bytes, a route will fail if exceeded
+budget = None
+
+# The number of top allocation sites to record
+top = 10
+
+# Memory results of all executed routes
+routes = []
+
+
+def peak_rss():
+    """
+    Return the peak resident memory of the current process in bytes.
+
+    :returns: The peak memory or None if not supported.
+    :rtype: int
+    """
+    if resource is None:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports in kilobytes while mac reports in bytes
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def payload_size(plugin_data):
+    """
+    Calculate the serialized size of the plugin data.
+
+    :param dict plugin_data: The plugin data that gets sent back to the controller.
+    :returns: A tuple of total size and a dict of total size per listitem field.
+    :rtype: tuple
+    """
+    fields = {}
+    for listitem in plugin_data["listitem"]:
+        url, item = listitem[0], listitem[1]
+        fields["url"] = fields.get("url", 0) + len(pickle.dumps(url, -1))
+        for key, value in item.items():
+            fields[key] = fields.get(key, 0) + len(pickle.dumps(value, -1))
+
+    return len(pickle.dumps(plugin_data, -1)), fields
+
+
+@contextmanager
+def measure(plugin_data):
+    """
+    Measure the memory usage of the with block, storing the results in the plugin data under the 'memory' key.
+
+    :param dict plugin_data: The plugin data that gets sent back to the controller.
+    """
+    if not enabled:
+        yield
+        return
+
+    before = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+
+    try:
+        yield
+    finally:
+        allocators = []
+        traced_peak = None
+        if tracemalloc is not None:
+            after = tracemalloc.take_snapshot()
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            # Exclude the allocations made by tracemalloc itself
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            after = after.filter_traces(filters)
+            before = before.filter_traces(filters)
+
+            for stat in after.compare_to(before, "lineno")[:top]:
+                frame = stat.traceback[0]
+                allocators.append(("{}:{}".format(frame.filename, frame.lineno), stat.size_diff, stat.count_diff))
+
+        total, fields = payload_size(plugin_data)
+        plugin_data["memory"] = {"peak_rss": peak_rss(), "traced_peak": traced_peak, "allocators": allocators,
+                                 "payload": total, "fields": fields}
+
+
+def record(callback_url, data):
+    """
+    Display the memory usage of a route execution, failing the route if over budget.
+
+    :param str callback_url: The callback url that was executed.
+    :param dict data: The results returned from the add-on process.
+    """
+    stats = data["memory"]
+    rss = stats["peak_rss"]
+    routes.append((callback_url, rss, stats["payload"]))
+
+    print("")
+    print("Memory of {}".format(callback_url))
+    print("Peak RSS: {}, Traced peak: {}, Payload: {}".format(
+        format_size(rss) if rss is not None else "n/a",
+        format_size(stats["traced_peak"]) if stats["traced_peak"] is not None else "n/a",
+        format_size(stats["payload"])))
+
+    if stats["allocators"]:
+        print("Top allocation sites:")
+        for location, size, count in stats["allocators"]:
+            print("  {:>10} {:>7} {}".format(format_size(size), "{:+}".format(count), location))
+
+    if stats["fields"]:
+        print("Payload per listitem field:")
+        for key, size in sorted(stats["fields"].items(), key=lambda item: item[1], reverse=True):
+            print("  {:>10} {}".format(format_size(size), key))
+
+    if budget is not None and rss is not None and rss > budget:
+        data["succeeded"] = False
+        data["error"] = "memory budget exceeded: {} > {}".format(format_size(rss), format_size(budget))
+        print(data["error"])
+
+
+def print_summary():
+    """Display the peak memory of each route, most expensive first."""
+    if not routes:
+        return
+
+    print("")
+    print("{} {} Url".format("Peak RSS".rjust(10), "Payload".rjust(10)))
+    print("-" * 60)
+    for url, rss, payload in sorted(routes, key=lambda item: item[1] or 0, reverse=True):
+        print("{:>10} {:>10} {}".format(format_size(rss) if rss is not None else "n/a", format_size(payload), url))
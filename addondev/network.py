@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+Per route accounting of the network traffic made by the add-on.
+
+Instrumentation is done at the http.client level, which covers urllib and requests,
+plus the connect time and bytes in and out of any raw socket connections.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from contextlib import contextmanager
+from collections import OrderedDict
+import threading
+import weakref
+import socket
+import time
+import re
+
+try:
+    import urllib.parse as urlparse
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    import urlparse
+
+# Package imports
+from addondev.utils import format_size
+
+# Set to True to enable network accounting
+enabled = False
+
+# Network results of all executed routes
+routes = []
+
+# High resolution timer, fallback to time.time on python 2
+timer = getattr(time, "perf_counter", time.time)
+
+# The request that is currently waiting for a response, per thread
+_local = threading.local()
+
+# Request and connection records of the current route
+_requests = []
+_connections = []
+
+# The connection records of the raw sockets of the current route. The sockets of http.client connections
+# are removed once they are seen sending a request, as their traffic is counted by the request records
+_sockets = weakref.WeakKeyDictionary()
+
+# The original methods that get patched
+_originals = {}
+
+
+def http_client():
+    """Return the http.client module, imported on first use as it's slow to import."""
+    try:
+        import http.client as httplib
+    except ImportError:
+        # noinspection PyUnresolvedReferences
+        import httplib
+    return httplib
+
+
+def full_url(conn, url):
+    """Return the absolute url of a request."""
+    if url.startswith("/"):
+        scheme = "https" if isinstance(conn, getattr(http_client(), "HTTPSConnection", ())) else "http"
+        default_port = 443 if scheme == "https" else 80
+        host = conn.host if conn.port in (None, default_port) else "{}:{}".format(conn.host, conn.port)
+        return "{}://{}{}".format(scheme, host, url)
+    return url
+
+
+def _putrequest(self, method, url, *args, **kwargs):
+    fresh = getattr(self, "_addondev_fresh", False)
+    self._addondev_fresh = False
+    self._addondev_record = record = {"method": method, "url": full_url(self, url), "start": timer(),
+                                      "reused": self.sock is not None and not fresh, "sent": 0, "received": 0,
+                                      "status": None, "ttfb": None, "total": None}
+    _requests.append(record)
+    try:
+        return _originals["putrequest"](self, method, url, *args, **kwargs)
+    finally:
+        _claim(self)
+
+
+def _connect(self):
+    record = getattr(self, "_addondev_record", None)
+    if record is not None and record["ttfb"] is None:
+        # Connection was opened as part of the current request
+        record["reused"] = False
+    else:
+        self._addondev_fresh = True
+    return _originals["connect"](self)
+
+
+def _send(self, data):
+    record = getattr(self, "_addondev_record", None)
+    if record is not None and isinstance(data, (bytes, bytearray)):
+        record["sent"] += len(data)
+    try:
+        return _originals["send"](self, data)
+    finally:
+        # The connection may have been opened by this send
+        _claim(self)
+
+
+def _claim(conn):
+    """
+    Remove the socket of an http.client connection from the raw socket records.
+
+    The socket is found by the connection rather than by hooking connect, as subclasses such as
+    the connections of urllib3 open the socket without calling HTTPConnection.connect.
+    Any bytes it was counted for before it was seen are dropped, they are counted by the request record.
+    """
+    try:
+        record = _sockets.pop(conn.sock, None)
+    except TypeError:
+        # Not a socket, e.g. None before the connection is opened
+        return
+    if record is not None:
+        record["sent"] = record["received"] = 0
+
+
+def _getresponse(self, *args, **kwargs):
+    record = getattr(self, "_addondev_record", None)
+    _local.record = record
+    try:
+        response = _originals["getresponse"](self, *args, **kwargs)
+    finally:
+        _local.record = None
+
+    if record is not None:
+        record["ttfb"] = timer() - record["start"]
+        record["status"] = response.status
+    return response
+
+
+def _response_init(self, *args, **kwargs):
+    _originals["response_init"](self, *args, **kwargs)
+    record = getattr(_local, "record", None)
+    if record is not None:
+        self.fp = CountingReader(self.fp, record)
+
+
+def _socket_connect(self, address):
+    start = timer()
+    try:
+        return _originals["socket_connect"](self, address)
+    finally:
+        record = {"address": str(address), "elapsed": timer() - start, "sent": 0, "received": 0}
+        _connections.append(record)
+        _sockets[self] = record
+
+
+def _count(sock, key, size):
+    record = _sockets.get(sock)
+    if record is not None:
+        record[key] += size
+
+
+def _socket_send(self, data, *args):
+    size = _originals["socket_send"](self, data, *args)
+    _count(self, "sent", size)
+    return size
+
+
+def _socket_sendall(self, data, *args):
+    result = _originals["socket_sendall"](self, data, *args)
+    _count(self, "sent", len(data))
+    return result
+
+
+def _socket_recv(self, *args):
+    data = _originals["socket_recv"](self, *args)
+    _count(self, "received", len(data))
+    return data
+
+
+def _socket_recv_into(self, buffer, *args):
+    size = _originals["socket_recv_into"](self, buffer, *args)
+    _count(self, "received", size)
+    return size
+
+
+class CountingReader(object):
+    """Proxy around a response file object that counts the received bytes."""
+
+    def __init__(self, fp, record):
+        self._fp = fp
+        self._record = record
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+    def _count(self, data):
+        self._record["received"] += len(data)
+        return data
+
+    def read(self, *args):
+        return self._count(self._fp.read(*args))
+
+    def read1(self, *args):
+        return self._count(self._fp.read1(*args))
+
+    def readline(self, *args):
+        return self._count(self._fp.readline(*args))
+
+    def readinto(self, buffer):
+        size = self._fp.readinto(buffer)
+        self._record["received"] += size or 0
+        return size
+
+    def close(self):
+        if self._record["total"] is None:
+            self._record["total"] = timer() - self._record["start"]
+        self._fp.close()
+
+
+def install():
+    """
+    Patch http.client and socket to record all network traffic.
+
+    On python 2 the socket objects bind send and recv per instance, so only sendall is counted for raw sockets.
+    Sockets that are wrapped with ssl after connecting are counted by their connect time only.
+    """
+    if _originals:
+        return
+
+    httplib = http_client()
+    conn = httplib.HTTPConnection
+    _originals.update(putrequest=conn.putrequest, connect=conn.connect, send=conn.send,
+                      getresponse=conn.getresponse, response_init=httplib.HTTPResponse.__init__,
+                      socket_connect=socket.socket.connect, socket_send=socket.socket.send,
+                      socket_sendall=socket.socket.sendall, socket_recv=socket.socket.recv,
+                      socket_recv_into=socket.socket.recv_into)
+
+    conn.putrequest = _putrequest
+    conn.connect = _connect
+    conn.send = _send
+    conn.getresponse = _getresponse
+    httplib.HTTPResponse.__init__ = _response_init
+    socket.socket.connect = _socket_connect
+    socket.socket.send = _socket_send
+    socket.socket.sendall = _socket_sendall
+    socket.socket.recv = _socket_recv
+    socket.socket.recv_into = _socket_recv_into
+
+
+def uninstall():
+    """Restore the original http.client and socket methods."""
+    if not _originals:
+        return
+
+    httplib = http_client()
+    conn = httplib.HTTPConnection
+    conn.putrequest = _originals.pop("putrequest")
+    conn.connect = _originals.pop("connect")
+    conn.send = _originals.pop("send")
+    conn.getresponse = _originals.pop("getresponse")
+    httplib.HTTPResponse.__init__ = _originals.pop("response_init")
+    socket.socket.connect = _originals.pop("socket_connect")
+    socket.socket.send = _originals.pop("socket_send")
+    socket.socket.sendall = _originals.pop("socket_sendall")
+    socket.socket.recv = _originals.pop("socket_recv")
+    socket.socket.recv_into = _originals.pop("socket_recv_into")
+
+
+@contextmanager
+def monitor(plugin_data):
+    """
+    Record all network traffic within the with block, storing the results in the plugin data under the 'network' key.
+
+    :param dict plugin_data: The plugin data that gets sent back to the controller.
+    """
+    if not enabled:
+        yield
+        return
+
+    del _requests[:]
+    del _connections[:]
+    _sockets.clear()
+    install()
+    try:
+        yield
+    finally:
+        uninstall()
+        for record in _requests:
+            # Responses that were never closed are timed up to the end of the route
+            if record["total"] is None:
+                record["total"] = timer() - record["start"]
+            del record["start"]
+
+        _sockets.clear()
+        plugin_data["network"] = {"requests": _requests[:], "connections": _connections[:]}
+
+
+def url_pattern(url):
+    """Return the url with all numeric path segments and query values replaced, used to spot N+1 requests."""
+    parts = urlparse.urlsplit(url)
+    path = re.sub(r"/\d+(?=/|$)", "/{n}", parts.path)
+    query = "&".join(sorted("{}=*".format(key) for key, _ in urlparse.parse_qsl(parts.query)))
+    return "{}://{}{}{}".format(parts.scheme, parts.netloc, path, "?" + query if query else "")
+
+
+def summarize(network):
+    """
+    Return the totals of the network data of a route.
+
+    :param dict network: The network data returned from the add-on process.
+    :rtype: dict
+    """
+    requests = network["requests"]
+    records = requests + network["connections"]
+    return {"requests": len(requests), "connections": len(network["connections"]),
+            "sent": sum(record["sent"] for record in records),
+            "received": sum(record["received"] for record in records),
+            "time": sum(record["total"] for record in requests),
+            "reused": len([record for record in requests if record["reused"]])}
+
+
+def record(callback_url, data):
+    """
+    Display the network traffic of a route execution.
+
+    :param str callback_url: The callback url that was executed.
+    :param dict data: The results returned from the add-on process.
+    """
+    network = data["network"]
+    totals = summarize(network)
+    routes.append((callback_url, totals))
+
+    print("")
+    print("Network of {}: {} requests, {} sockets, {} out, {} in, {:.3f}s, {} reused".format(
+        callback_url, totals["requests"], totals["connections"], format_size(totals["sent"]),
+        format_size(totals["received"]), totals["time"], totals["reused"]))
+
+    for req in network["requests"]:
+        print("  {} {:>9} {:>8.3f}s {:>8.3f}s {} {} {}".format(
+            req["status"] or "---", format_size(req["received"]), req["ttfb"] or 0, req["total"],
+            "reused" if req["reused"] else "new   ", req["method"], req["url"]))
+
+    # Raw socket traffic, outside of http.client
+    for conn in network["connections"]:
+        if conn["sent"] or conn["received"]:
+            print("  --- {:>9} {:>8.3f}s {:>9} socket {}".format(
+                format_size(conn["received"]), conn["elapsed"], format_size(conn["sent"]), conn["address"]))
+
+    # Warn about repeated requests to the same endpoint
+    patterns = OrderedDict()
+    for req in network["requests"]:
+        pattern = url_pattern(req["url"])
+        patterns[pattern] = patterns.get(pattern, 0) + 1
+
+    for pattern, count in patterns.items():
+        if count > 2:
+            print("  Possible N+1 pattern: {} requests to {}".format(count, pattern))
+
+
+def print_summary():
+    """Display the network totals of each route, slowest first."""
+    if not routes:
+        return
+
+    print("")
+    print("{} {} {} {} {} Url".format("Requests".rjust(8), "Reused".rjust(6), "Sent".rjust(9),
+                                       "Received".rjust(9), "Time".rjust(9)))
+    print("-" * 60)
+    for url, totals in sorted(routes, key=lambda item: item[1]["time"], reverse=True):
+        print("{:>8} {:>6} {:>9} {:>9} {:>8.3f}s {}".format(
+            totals["requests"], totals["reused"], format_size(totals["sent"]), format_size(totals["received"]),
+            totals["time"], url))
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Per route cpu profiling of add-on execution.
+
+The add-on process profiles the call to 'addon.run()' and ships the raw stats back over the pipe
+with the plugin data. The controller then merges the stats of every execution of the same route.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from collections import OrderedDict
+from contextlib import contextmanager
+import time
+import re
+import os
+
+try:
+    import urllib.parse as urlparse
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    import urlparse
+
+# Set to True to profile the add-on
+enabled = False
+
+# The number of hot functions to display per route
+top = 15
+
+# Merged stats per route
+routes = OrderedDict()
+
+# Fallback to time.clock on python 2
+process_time = getattr(time, "process_time", None) or time.clock
+
+# Bound at import, so that the wall time stays real when the add-on runs on the virtual clock
+wall_time = time.time
+
+
+class StatsData(object):
+    """Wrapper to allow pstats to load stats that were created in another process."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class RouteProfile(object):
+    """
+    Profile data of all executions of a route.
+
+    :ivar str route: The route selector path.
+    :ivar int executions: The number of times the route was executed.
+    :ivar float wall: The total wall time spent within 'run()'.
+    :ivar float cpu: The total cpu time spent within 'run()'.
+    :ivar stats: The merged pstats.Stats object.
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.executions = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.stats = None
+
+    def add(self, data):
+        """Merge the profile data from a single execution."""
+        import pstats
+        stats = pstats.Stats(StatsData(data["stats"]))
+        if self.stats is None:
+            self.stats = stats
+        else:
+            self.stats.add(stats)
+
+        self.executions += 1
+        self.wall += data["wall"]
+        self.cpu += data["cpu"]
+        return stats
+
+    @property
+    def cpu_ratio(self):
+        """The fraction of wall time that was spent on the cpu."""
+        return self.cpu / self.wall if self.wall else 0.0
+
+
+@contextmanager
+def profile(plugin_data):
+    """
+    Profile the with block, storing the results in the plugin data under the 'profile' key.
+
+    :param dict plugin_data: The plugin data that gets sent back to the controller.
+    """
+    if not enabled:
+        yield
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    start_wall = wall_time()
+    start_cpu = process_time()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.create_stats()
+        plugin_data["profile"] = {"stats": profiler.stats, "wall": wall_time() - start_wall,
+                                  "cpu": process_time() - start_cpu}
+
+
+def route_key(callback_url):
+    """Return the route selector of a callback url, params are excluded so that routes merge."""
+    return urlparse.urlsplit(callback_url).path or "/"
+
+
+def record(callback_url, data):
+    """
+    Merge the profile data of a route execution and display the hot functions.
+
+    :param str callback_url: The callback url that was executed.
+    :param dict data: The profile data returned from the add-on process.
+    """
+    key = route_key(callback_url)
+    if key not in routes:
+        routes[key] = RouteProfile(key)
+
+    stats = routes[key].add(data)
+    print("")
+    print("Profile of {} ({:.3f}s wall, {:.3f}s cpu)".format(callback_url, data["wall"], data["cpu"]))
+    stats.sort_stats("cumulative").print_stats(top)
+
+
+def print_summary():
+    """Display the cpu usage of each route, most expensive first."""
+    if not routes:
+        return
+
+    route_len = max(len(key) for key in routes)
+    print("")
+    print("{} {} {} {} {} Route".format("Runs".rjust(5), "Wall".rjust(9), "Cpu".rjust(9), "Cpu%".rjust(5),
+                                         "Calls".rjust(9)))
+    print("-" * (route_len + 44))
+    for prof in sorted(routes.values(), key=lambda item: item.cpu, reverse=True):
+        print("{:>5} {:>8.3f}s {:>8.3f}s {:>5.0%} {:>9} {}".format(
+            prof.executions, prof.wall, prof.cpu, prof.cpu_ratio, prof.stats.total_calls, prof.route))
+
+
+def save(output_dir):
+    """
+    Save the merged stats of each route as a .pstats file.
+
+    These files can be loaded by pstats, snakeviz or converted to flame graphs using flameprof.
+
+    :param str output_dir: The directory to save the stats files to.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    for key, prof in routes.items():
+        name = re.sub(r"[^\w.-]+", "_", key).strip("_") or "root"
+        prof.stats.dump_stats(os.path.join(output_dir, "{}.pstats".format(name)))
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Pytest plugin for testing kodi add-ons.
+
+The mock kodi environment is initialized once per test session, or once per worker when running under
+pytest-xdist. Between tests the mock state is restored in place from a snapshot, which is much cheaper
+than initializing the environment again.
+
+Fixtures:
+    kodi_env   Session scoped, initializes the environment and returns the add-on object.
+    kodi_state Session scoped, the snapshot of the mock state that is restored after each test.
+    kodi_addon Returns the add-on object, restoring all mock state after the test.
+
+The add-on to test is set with the ``--addon-path`` option or the ``addondev_path`` ini setting,
+and defaults to the rootdir of the test session. The repository that dependencies are downloaded from
+is set with ``--kodi-repo`` or ``addondev_repo``, and ``--kodi-offline`` or ``addondev_offline``
+skips the check for add-on updates.
+"""
+
+# Standard Library Imports
+from collections import deque
+from copy import deepcopy
+import shutil
+import sys
+import os
+
+# Package imports
+import pytest
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("addondev", "kodi add-on testing")
+    group.addoption("--addon-path", dest="addondev_path", metavar="PATH",
+                    help="The path to the add-on under test. (rootdir)")
+    group.addoption("--kodi-repo", dest="addondev_repo", metavar="REPO",
+                    help="The official kodi repository to use when downloading dependencies, or the url or local "
+                    "path of a repository. (krypton)")
+    group.addoption("--kodi-offline", dest="addondev_offline", action="store_true",
+                    help="Skip the periodic check for add-on updates, e.g. when running without network access.")
+    parser.addini("addondev_path", "The path to the add-on under test, relative to the rootdir.")
+    parser.addini("addondev_repo", "The kodi repository to use when downloading dependencies, a local path is "
+                  "relative to the rootdir.")
+    parser.addini("addondev_offline", "Skip the periodic check for add-on updates.", type="bool", default=False)
+
+
+def addon_path(config):
+    """Return the path of the add-on under test."""
+    path = config.getoption("addondev_path") or config.getini("addondev_path")
+    if path:
+        return os.path.realpath(os.path.join(str(config.rootdir), path))
+    return os.path.realpath(str(config.rootdir))
+
+
+def repo(config):
+    """Return the repository to download dependencies from, or None to use the default."""
+    name = config.getoption("addondev_repo") or config.getini("addondev_repo")
+    if name:
+        path = os.path.join(str(config.rootdir), name)
+        return os.path.realpath(path) if os.path.isdir(path) else name
+    return None
+
+
+def worker_id(config):
+    """Return the id of the pytest-xdist worker, or 'master' when not running under xdist."""
+    workerinput = getattr(config, "workerinput", None) or getattr(config, "slaveinput", None)
+    return workerinput["workerid"] if workerinput else "master"
+
+
+def snapshot(obj):
+    """
+    Return a copy of a structure of dicts, lists and deques, that can later be restored in place with restore.
+
+    Dict subclasses are copied as plain dicts, so that no side effects, like saving settings to disk, are triggered.
+    Deques keep their max length.
+    """
+    if isinstance(obj, dict):
+        return dict((key, snapshot(value)) for key, value in obj.items())
+    elif isinstance(obj, list):
+        return [snapshot(value) for value in obj]
+    elif isinstance(obj, deque):
+        return deque((snapshot(value) for value in obj), obj.maxlen)
+    else:
+        return deepcopy(obj)
+
+
+def restore(target, saved):
+    """
+    Restore the target back to the saved snapshot, in place.
+
+    Nested dicts, lists and deques are also restored in place, so references held by the add-on or the mocks stay valid.
+    """
+    if isinstance(target, dict):
+        for key in list(target):
+            if key not in saved:
+                dict.__delitem__(target, key)
+
+        for key, value in saved.items():
+            current = target.get(key)
+            if isinstance(value, (dict, list, deque)) and isinstance(current, type(value)):
+                restore(current, value)
+            else:
+                dict.__setitem__(target, key, snapshot(value))
+    elif isinstance(target, list):
+        target[:] = [snapshot(value) for value in saved]
+    else:
+        target.clear()
+        target.extend(snapshot(value) for value in saved)
+
+
+class MockState(object):
+    """
+    Snapshot of all the mutable state of the mock kodi environment.
+
+    :param addon: The add-on object of the add-on under test.
+    """
+
+    def __init__(self, addon):
+        from addondev import support
+        import xbmcaddon
+        import xbmcgui
+        import xbmc
+
+        self.targets = [support.plugin_data, support.data_log, xbmcaddon.mock_data, xbmcgui.Dialog.mock_data,
+                        xbmc.Keyboard.mock_data, addon.settings]
+        self.saved = [snapshot(target) for target in self.targets]
+
+    def restore(self):
+        for target, saved in zip(self.targets, self.saved):
+            restore(target, saved)
+
+
+@pytest.fixture(scope="session")
+def kodi_env(request, tmpdir_factory):
+    """
+    Initialize the mock kodi environment for the add-on under test, once per session and xdist worker.
+
+    Each worker gets its own copy of the add-on profile directory, so that settings saved by one worker
+    are not seen by another.
+
+    :returns: The add-on object of the add-on under test.
+    """
+    from addondev import support, libraries
+
+    plugin_path = addon_path(request.config)
+    if not os.path.exists(os.path.join(plugin_path, "addon.xml")):
+        pytest.fail("no kodi add-on found at '{}', set --addon-path or addondev_path".format(plugin_path))
+
+    org_cwd, org_argv, org_path = os.getcwd(), sys.argv, sys.path[:]
+    org_repo, org_offline = support.Repo.repo, support.Repo.offline
+    support.Repo.repo = repo(request.config) or support.Repo.repo
+    if request.config.getoption("addondev_offline") or request.config.getini("addondev_offline"):
+        support.Repo.offline = True
+    # The initializer stops xdist workers from downloading the same dependencies at the same time
+    addon = support.initializer(plugin_path)
+
+    # Move every add-on profile into a per worker directory, carrying over any saved settings
+    data_dir = str(tmpdir_factory.mktemp("addon_data-{}".format(worker_id(request.config))))
+    for dep in support.avail_addons.values():
+        profile = os.path.join(data_dir, dep.id)
+        if os.path.exists(dep.profile):
+            shutil.copytree(dep.profile, profile)
+        dep.profile = profile
+    addon.preload()
+
+    yield addon
+
+    os.chdir(org_cwd)
+    sys.argv = org_argv
+    sys.path[:] = org_path
+    support.Repo.repo, support.Repo.offline = org_repo, org_offline
+    libraries.reset()
+
+
+@pytest.fixture(scope="session")
+def kodi_state(kodi_env):
+    """The snapshot of the mock state, taken right after the environment was initialized."""
+    return MockState(kodi_env)
+
+
+@pytest.fixture
+def kodi_addon(kodi_env, kodi_state):
+    """
+    The add-on object of the add-on under test.
+
+    All mock state, plugin data, logged notifications, mocked dialog and keyboard input and the add-on
+    settings, are restored to their initial state after the test.
+    """
+    try:
+        yield kodi_env
+    finally:
+        kodi_state.restore()
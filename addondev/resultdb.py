@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent store of route results, so listings can be analyzed across runs with plain sql.
+
+Every executed route is stored in a local sqlite database, with its listitems normalized into indexed
+tables of items, info labels, artwork and properties. All text, urls, keys and values, is stored once
+in the strings table and referenced by id. The info labels, artwork and properties of an item are each
+stored once per distinct set of values, so the sets shared by many items, or by the same item on every
+run, only take up the space of an integer.
+
+Routes are buffered and written in bulk, a single transaction for each batch of routes. The views
+route_view, item_view, info_view, art_view and properties_view resolve the ids back into text, and
+latest_routes holds the most recent execution of each route.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from collections import OrderedDict
+import platform
+import hashlib
+import numbers
+import json
+import time
+import os
+
+# Package imports
+from addondev.utils import unicode_type
+from addondev import history, support
+
+# Set to True to store the results of every route
+enabled = False
+
+# The path to the sqlite database, defaults to within the mock kodi home directory
+database = None
+
+# The number of routes to buffer before they are written to the database
+batch_size = 200
+
+# Routes waiting to be written, as tuples of pluginpath, the route fields and the listitem fields
+_pending = []
+
+# The id of the run of this process, created with the first write
+_run_id = None
+
+# The open database connection
+_connection = None
+
+# The number of routes and items that were stored
+stored = {"routes": 0, "items": 0}
+
+# Types that sqlite stores as is
+_plain_types = frozenset((unicode_type, int, float, bool))
+
+# The listitem tables, each named after the listitem key that holds its values
+value_tables = ("info", "art", "properties")
+
+# Cache of string ids, keyed by value
+_strings = {}
+
+# Cache of the value set ids of each listitem table, keyed by the sorted key and value pairs
+_sets = dict((table, {}) for table in value_tables)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS strings (
+    id INTEGER PRIMARY KEY,
+    value UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    addon_id TEXT NOT NULL,
+    addon_version TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    python TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS routes (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    url_id INTEGER NOT NULL REFERENCES strings (id),
+    timestamp REAL NOT NULL,
+    succeeded INTEGER NOT NULL,
+    elapsed REAL NOT NULL,
+    items INTEGER NOT NULL,
+    error_id INTEGER REFERENCES strings (id),
+    resolved_id INTEGER REFERENCES strings (id),
+    contenttype_id INTEGER REFERENCES strings (id),
+    category_id INTEGER REFERENCES strings (id)
+);
+CREATE INDEX IF NOT EXISTS routes_url ON routes (url_id, id);
+CREATE INDEX IF NOT EXISTS routes_run ON routes (run_id);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    route_id INTEGER NOT NULL REFERENCES routes (id),
+    position INTEGER NOT NULL,
+    label_id INTEGER REFERENCES strings (id),
+    label2_id INTEGER REFERENCES strings (id),
+    path_id INTEGER REFERENCES strings (id),
+    isfolder INTEGER NOT NULL,
+    playable INTEGER NOT NULL,
+    info_id INTEGER REFERENCES info_sets (id),
+    art_id INTEGER REFERENCES art_sets (id),
+    properties_id INTEGER REFERENCES properties_sets (id)
+);
+CREATE INDEX IF NOT EXISTS items_route ON items (route_id);
+CREATE INDEX IF NOT EXISTS items_path ON items (path_id);
+"""
+
+VALUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {0}_sets (
+    id INTEGER PRIMARY KEY,
+    digest BLOB UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS {0} (
+    set_id INTEGER NOT NULL REFERENCES {0}_sets (id),
+    key_id INTEGER NOT NULL REFERENCES strings (id),
+    value_id INTEGER NOT NULL REFERENCES strings (id),
+    PRIMARY KEY (set_id, key_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS {0}_lookup ON {0} (key_id, value_id);
+CREATE VIEW IF NOT EXISTS {0}_view AS
+    SELECT items.id AS item_id, key.value AS key, value.value AS value FROM items
+    JOIN {0} ON {0}.set_id = items.{0}_id
+    JOIN strings AS key ON key.id = {0}.key_id
+    JOIN strings AS value ON value.id = {0}.value_id;
+"""
+
+VIEWS = """
+CREATE VIEW IF NOT EXISTS route_view AS
+    SELECT routes.id, routes.run_id, runs.addon_id, runs.addon_version, routes.timestamp, routes.url_id,
+           url.value AS url, routes.succeeded, routes.elapsed, routes.items, error.value AS error,
+           resolved.value AS resolved, contenttype.value AS contenttype, category.value AS category
+    FROM routes
+    JOIN runs ON runs.id = routes.run_id
+    JOIN strings AS url ON url.id = routes.url_id
+    LEFT JOIN strings AS error ON error.id = routes.error_id
+    LEFT JOIN strings AS resolved ON resolved.id = routes.resolved_id
+    LEFT JOIN strings AS contenttype ON contenttype.id = routes.contenttype_id
+    LEFT JOIN strings AS category ON category.id = routes.category_id;
+CREATE VIEW IF NOT EXISTS latest_routes AS
+    SELECT * FROM route_view WHERE id IN (SELECT max(id) FROM routes GROUP BY url_id);
+CREATE VIEW IF NOT EXISTS item_view AS
+    SELECT items.id, items.route_id, items.position, label.value AS label, label2.value AS label2,
+           path.value AS path, items.isfolder, items.playable
+    FROM items
+    LEFT JOIN strings AS label ON label.id = items.label_id
+    LEFT JOIN strings AS label2 ON label2.id = items.label2_id
+    LEFT JOIN strings AS path ON path.id = items.path_id;
+"""
+
+# Ready made queries, as tuples of description and sql
+queries = OrderedDict([
+    ("playable-no-thumb", ("Playable items without a thumbnail, from the latest execution of each route",
+                           "SELECT route.url AS route, item.position, item.label, item.path "
+                           "FROM latest_routes AS route JOIN item_view AS item ON item.route_id = route.id "
+                           "WHERE item.playable = 1 AND NOT EXISTS (SELECT 1 FROM art_view AS art "
+                           "WHERE art.item_id = item.id AND art.key = 'thumb' AND art.value != '') "
+                           "ORDER BY route.url, item.position")),
+    ("dropped", ("Routes with fewer items than their previous execution",
+                 "SELECT route.url, previous.items AS previous, route.items AS latest, "
+                 "route.items - previous.items AS change, datetime(previous.timestamp, 'unixepoch', 'localtime') "
+                 "AS since FROM latest_routes AS route JOIN routes AS previous ON previous.id = "
+                 "(SELECT max(id) FROM routes WHERE url_id = route.url_id AND id < route.id) "
+                 "WHERE route.items < previous.items ORDER BY change, route.url")),
+    ("failed", ("Routes that failed on their latest execution",
+                "SELECT url, error, datetime(timestamp, 'unixepoch', 'localtime') AS executed "
+                "FROM latest_routes WHERE succeeded = 0 ORDER BY url")),
+    ("missing-plot", ("Items without a plot, from the latest execution of each route",
+                      "SELECT route.url AS route, item.position, item.label FROM latest_routes AS route "
+                      "JOIN item_view AS item ON item.route_id = route.id WHERE item.isfolder = 0 "
+                      "AND NOT EXISTS (SELECT 1 FROM info_view AS info WHERE info.item_id = item.id "
+                      "AND info.key = 'plot' AND info.value != '') ORDER BY route.url, item.position")),
+])
+
+
+def connect(path=None):
+    """
+    Return a connection to the result database, creating the database if needed.
+
+    :param str path: The path to the database, defaults to the configured database.
+    """
+    global _connection
+    import sqlite3
+    if path is None and _connection is not None:
+        return _connection
+
+    # Transactions are handled explicitly
+    conn = sqlite3.connect(path or database, isolation_level=None)
+    conn.executescript(SCHEMA + "".join(VALUE_SCHEMA.format(table) for table in value_tables) + VIEWS)
+    if path is None:
+        _connection = conn
+    return conn
+
+
+def default_database():
+    """Return the default database path within the mock kodi home directory."""
+    if "home" not in support.kodi_paths:
+        support.setup_paths()
+    return os.path.join(support.kodi_paths["home"], u"route_results.sqlite")
+
+
+def record(pluginpath, callback_url, data, elapsed):
+    """
+    Queue the results of a route execution to be stored, writing the queue once it's full.
+
+    Only the stored fields are taken from the listitems, converted into values that sqlite can store,
+    with the values of each listitem table as sorted key and value pairs.
+
+    :param unicode pluginpath: The path to the plugin that was executed.
+    :param str callback_url: The callback url that was executed.
+    :param dict data: The results returned from the add-on process.
+    :param float elapsed: The total time taken to execute the route, as seen by the controller.
+    """
+    resolved = data.get("resolved")
+    if isinstance(resolved, dict):
+        resolved = resolved.get("path")
+
+    items = []
+    for url, item, isfolder in data["listitem"]:
+        properties = item.get("properties") or {}
+        values = tuple(tuple(sorted((_value(key), _value(value)) for key, value in (item.get(table) or {}).items()))
+                       for table in value_tables)
+        items.append((_value(url), _value(item.get("label")), _value(item.get("label2")), int(bool(isfolder)),
+                      int(properties.get("isplayable") == "true"), values))
+
+    route = (_value(callback_url), _value(data.get("error")), _value(resolved), _value(data.get("contenttype")),
+             _value(data.get("category")), int(bool(data["succeeded"])), elapsed, time.time())
+    _pending.append((pluginpath, route, items))
+    if len(_pending) >= batch_size:
+        flush()
+
+
+def _value(value):
+    """Return a value in a form that sqlite can store, containers are stored as json."""
+    if value is None or type(value) in _plain_types or isinstance(value, (unicode_type, numbers.Number)):
+        return value
+    elif isinstance(value, bytes):
+        return value.decode("utf8", "replace")
+    elif isinstance(value, (list, tuple, dict)):
+        from addondev.batch import normalize
+        return json.dumps(normalize(value), sort_keys=True)
+    else:
+        return repr(value)
+
+
+def string_ids(conn, values):
+    """
+    Return the ids of the given values, adding any values that are not yet stored.
+
+    :param conn: The database connection, within a transaction.
+    :param set values: The values to look up, None is skipped.
+    :returns: Dict of value to id.
+    :rtype: dict
+    """
+    values.discard(None)
+    missing = list(values.difference(_strings))
+    for start in range(0, len(missing), 500):
+        chunk = missing[start:start + 500]
+        _strings.update(conn.execute("SELECT value, id FROM strings WHERE value IN ({})".format(
+            ", ".join("?" * len(chunk))), chunk))
+
+    new_id = _next_id(conn, "strings")
+    rows = []
+    for value in missing:
+        if value not in _strings:
+            _strings[value] = new_id
+            rows.append((new_id, value))
+            new_id += 1
+    conn.executemany("INSERT INTO strings (id, value) VALUES (?, ?)", rows)
+    return _strings
+
+
+def set_ids(conn, table, value_sets, ids):
+    """
+    Add the value sets of a listitem table that are not yet stored, caching the id of every set.
+
+    Sets are identified by the digest of their key and value string ids, the empty set has no id.
+
+    :param conn: The database connection, within a transaction.
+    :param str table: The name of the listitem table.
+    :param set value_sets: The sets of sorted key and value pairs.
+    :param dict ids: Dict of value to string id, holding every key and value of the sets.
+    """
+    import sqlite3
+    cache = _sets[table]
+    cache[()] = None
+    digests = {}
+    for pairs in value_sets.difference(cache):
+        digest = hashlib.sha1(json.dumps([(ids[key], ids[value]) for key, value in pairs]).encode("ascii"))
+        digests[digest.digest()] = pairs
+
+    missing = list(digests)
+    for start in range(0, len(missing), 500):
+        chunk = missing[start:start + 500]
+        for digest, set_id in conn.execute("SELECT digest, id FROM {}_sets WHERE digest IN ({})".format(
+                table, ", ".join("?" * len(chunk))), [sqlite3.Binary(digest) for digest in chunk]):
+            cache[digests.pop(bytes(digest))] = set_id
+
+    set_rows, value_rows = [], []
+    set_id = _next_id(conn, "{}_sets".format(table))
+    for digest, pairs in digests.items():
+        cache[pairs] = set_id
+        set_rows.append((set_id, sqlite3.Binary(digest)))
+        value_rows.extend((set_id, ids[key], ids[value]) for key, value in pairs)
+        set_id += 1
+    conn.executemany("INSERT INTO {}_sets VALUES (?, ?)".format(table), set_rows)
+    conn.executemany("INSERT INTO {} VALUES (?, ?, ?)".format(table), value_rows)
+
+
+def _next_id(conn, table):
+    return (conn.execute("SELECT max(id) FROM {}".format(table)).fetchone()[0] or 0) + 1
+
+
+def flush():
+    """Write all queued routes to the database, in a single transaction."""
+    if not _pending:
+        return
+
+    try:
+        routes, items = _write(connect())
+    except Exception:
+        # The ids of strings and sets added within the failed transaction are no longer valid
+        _strings.clear()
+        for cache in _sets.values():
+            cache.clear()
+        raise
+
+    stored["routes"] += routes
+    stored["items"] += items
+    del _pending[:]
+
+
+def _write(conn):
+    global _run_id
+    # The write lock is taken up front, as the rows are inserted with ids that follow the current max id
+    conn.execute("BEGIN IMMEDIATE")
+    new_run = _run_id is None
+    try:
+        if new_run:
+            addon_id, addon_version = history.addon_info(_pending[0][0])
+            _run_id = conn.execute("INSERT INTO runs (addon_id, addon_version, timestamp, python) VALUES (?, ?, ?, ?)",
+                                   (addon_id, addon_version, time.time(),
+                                    u"{} {}".format(platform.python_implementation(),
+                                                    platform.python_version()))).lastrowid
+
+        # Every string of the queued routes is looked up first, so the rows can be inserted in bulk
+        texts = set()
+        for _, route, items in _pending:
+            texts.update(route[:5])
+            for item in items:
+                texts.update(item[:3])
+                for table, pairs in zip(value_tables, item[5]):
+                    if pairs not in _sets[table]:
+                        texts.update(value for pair in pairs for value in pair)
+        ids = string_ids(conn, texts)
+        ids[None] = None
+
+        for index, table in enumerate(value_tables):
+            set_ids(conn, table, set(item[5][index] for _, _, items in _pending for item in items), ids)
+
+        route_rows, item_rows = [], []
+        route_id = _next_id(conn, "routes")
+        item_id = _next_id(conn, "items")
+        for _, route, items in _pending:
+            url, error, resolved, contenttype, category, succeeded, elapsed, timestamp = route
+            route_rows.append((route_id, _run_id, ids[url], timestamp, succeeded, elapsed, len(items), ids[error],
+                               ids[resolved], ids[contenttype], ids[category]))
+            for position, (path, label, label2, isfolder, playable, values) in enumerate(items):
+                item_rows.append((item_id, route_id, position, ids[label], ids[label2], ids[path], isfolder, playable,
+                                  _sets["info"][values[0]], _sets["art"][values[1]], _sets["properties"][values[2]]))
+                item_id += 1
+            route_id += 1
+
+        conn.executemany("INSERT INTO routes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", route_rows)
+        conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", item_rows)
+    except Exception:
+        conn.execute("ROLLBACK")
+        if new_run:
+            _run_id = None
+        raise
+
+    conn.execute("COMMIT")
+    return len(route_rows), len(item_rows)
+
+
+def print_summary():
+    """Display the number of stored routes and the size of the database."""
+    print("")
+    print("{} routes with {} items stored in {} ({:.1f}MB)".format(
+        stored["routes"], stored["items"], database, os.path.getsize(database) / 1048576.0))
+
+
+def query(conn, sql, params=()):
+    """
+    Execute a query against the result database.
+
+    :param conn: The database connection.
+    :param str sql: The query or the name of a ready made query.
+    :param params: The parameters of the query.
+    :returns: The column names and the rows.
+    :rtype: tuple
+    """
+    sql = queries[sql][1] if sql in queries else sql
+    cursor = conn.execute(sql, params)
+    columns = [column[0] for column in cursor.description or ()]
+    return columns, cursor.fetchall()
+
+
+def print_rows(columns, rows, elapsed, width=60):
+    """Display the rows of a query as a table, with long values cropped to width."""
+    def text(value):
+        value = u"" if value is None else value if isinstance(value, unicode_type) else u"{}".format(value)
+        return value if len(value) <= width else value[:width - 3] + u"..."
+
+    table = [[text(value) for value in row] for row in rows]
+    sizes = [max([len(column)] + [len(row[index]) for row in table]) for index, column in enumerate(columns)]
+    if columns:
+        print(u" ".join(column.ljust(size) for column, size in zip(columns, sizes)).rstrip())
+        print("-" * (sum(sizes) + len(sizes) - 1))
+        for row in table:
+            print(u" ".join(value.ljust(size) for value, size in zip(row, sizes)).rstrip())
+        print("-" * (sum(sizes) + len(sizes) - 1))
+    print("{} rows in {:.1f}ms".format(len(rows), elapsed * 1000))
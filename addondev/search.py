@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Search of the repository catalog, using an inverted index over the cached repository addons.xml.
+
+The index is kept next to the cached addons.xml and maps the terms of each field to the ids of the
+add-ons that contain them. It's only updated when addons.xml changes, and then only the add-ons whose
+entry has changed are indexed again.
+
+Queries are made up of terms that must all match. A term can be limited to a field with 'field:term',
+and terms ending with '*' match as a prefix. e.g. 'youtube provides:video', 'requires:script.module.requests'
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from xml.etree import ElementTree as ETree
+from codecs import open as _open
+import hashlib
+import json
+import time
+import os
+import re
+
+# Package imports
+from addondev.utils import safe_path, ensure_unicode
+
+# The names of the index file and the index state file within the repository cache directory
+INDEX_FILE = u"search-index.json"
+STATE_FILE = u"search-state.json"
+
+# Changes to the index layout must bump the version, so old indexes are rebuilt
+INDEX_VERSION = 1
+
+# Fields that can be searched, free text terms search the text fields with the given weight
+fields = ("id", "name", "summary", "provides", "point", "requires")
+text_fields = {"id": 3, "name": 2, "summary": 1}
+
+
+def tokenize(text):
+    """Split text into lowercase search terms, ignoring kodi formatting tags."""
+    text = re.sub(r"\[/?[A-Z]+[^\]]*\]", " ", text or u"")
+    return re.findall(r"\w+", text.lower(), re.UNICODE)
+
+
+def _metadata(node, name):
+    """Return the english text of a metadata element of an add-on."""
+    texts = [(elem.get("lang", "en").lower(), elem.text) for elem in
+             node.findall("./extension[@point='xbmc.addon.metadata']/{}".format(name))]
+    for lang, text in texts:
+        if lang.startswith("en"):
+            return text or u""
+    return (texts[0][1] or u"") if texts else u""
+
+
+def extract(node):
+    """
+    Return the searchable data of an add-on.
+
+    :param node: The addon element from addons.xml.
+    :returns: Dict of the add-on details and the terms of each field.
+    :rtype: dict
+    """
+    addon_id = node.attrib["id"]
+    provides = []
+    for elem in node.findall("./extension/provides"):
+        provides.extend((elem.text or "").split())
+
+    points = [elem.get("point") for elem in node.findall("extension") if elem.get("point")]
+    requires = [elem.get("addon") for elem in node.findall("requires/import") if elem.get("addon")]
+    details = {"id": addon_id, "name": node.get("name", u""), "version": node.get("version", u""),
+               "summary": _metadata(node, "summary"), "provides": provides}
+
+    terms = {"id": [addon_id.lower()] + addon_id.lower().split("."),
+             "name": tokenize(details["name"]),
+             "summary": tokenize(details["summary"]),
+             "provides": [value.lower() for value in provides],
+             "point": [point.lower() for point in points] + [point.lower().split(".")[-1] for point in points],
+             "requires": [value.lower() for value in requires]}
+    return {"details": details, "terms": dict((name, sorted(set(values))) for name, values in terms.items())}
+
+
+def file_hash(path):
+    with open(path, "rb") as stream:
+        return hashlib.sha1(stream.read()).hexdigest()
+
+
+def _load(path):
+    if os.path.exists(path):
+        with _open(path, "r", "utf8") as stream:
+            data = json.load(stream)
+        if data.get("version") == INDEX_VERSION:
+            return data
+    return None
+
+
+def _save(path, data):
+    with _open(path, "w", "utf8") as stream:
+        stream.write(json.dumps(data, separators=(",", ":")))
+
+
+def empty_index():
+    return {"version": INDEX_VERSION, "docs": [], "terms": dict((name, {}) for name in fields)}
+
+
+def empty_state():
+    return {"version": INDEX_VERSION, "source": None, "addons": {}}
+
+
+def _remove_postings(index, entry):
+    index["docs"][entry["doc"]] = None
+    for name, values in entry["terms"].items():
+        postings = index["terms"][name]
+        for value in values:
+            postings[value].remove(entry["doc"])
+            if not postings[value]:
+                del postings[value]
+
+
+def update_index(index, state, raw_xml):
+    """
+    Bring the index up to date with the given addons.xml, only indexing the add-ons that have changed.
+
+    :param dict index: The index to update in place.
+    :param dict state: The indexed state of each add-on, updated in place.
+    :param bytes raw_xml: The content of addons.xml.
+    :returns: The number of add-ons that were indexed again and the number removed.
+    :rtype: tuple
+    """
+    seen = set()
+    changed = 0
+    for node in ETree.fromstring(raw_xml).iterfind("addon"):
+        addon_id = node.attrib["id"]
+        seen.add(addon_id)
+        digest = hashlib.sha1(ETree.tostring(node)).hexdigest()
+        entry = state["addons"].get(addon_id)
+        if entry is not None and entry["hash"] == digest:
+            continue
+
+        # The document number of a changed add-on is reused, so the postings of other add-ons stay valid
+        data = extract(node)
+        if entry is None:
+            entry = {"doc": len(index["docs"])}
+            index["docs"].append(None)
+        else:
+            _remove_postings(index, entry)
+
+        entry.update(hash=digest, terms=data["terms"])
+        state["addons"][addon_id] = entry
+        index["docs"][entry["doc"]] = data["details"]
+        for name, values in data["terms"].items():
+            postings = index["terms"][name]
+            for value in values:
+                postings.setdefault(value, []).append(entry["doc"])
+        changed += 1
+
+    removed = [addon_id for addon_id in state["addons"] if addon_id not in seen]
+    for addon_id in removed:
+        _remove_postings(index, state["addons"].pop(addon_id))
+    return changed, len(removed)
+
+
+def open_index(repo, max_age=432000):
+    """
+    Return the search index of the repository, updating it if addons.xml has changed.
+
+    The index only holds what's needed to answer queries. The hash and terms of each add-on,
+    which are needed to update the index, are kept in a separate state file.
+
+    :param support.Repo repo: The repository to search.
+    :param int max_age: The max age in seconds of the cached addons.xml, 0 to always download.
+    :returns: The index and a dict of stats about the update.
+    :rtype: tuple
+    """
+    xml_path = safe_path(repo.fetch_index(max_age))
+    cache_dir = safe_path(repo.cache_dir)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    index_path = os.path.join(cache_dir, safe_path(INDEX_FILE))
+    state_path = os.path.join(cache_dir, safe_path(STATE_FILE))
+    stats = {"load": 0.0, "changed": 0, "removed": 0, "update": 0.0}
+
+    # The add-ons are only indexed again when the size, modification time and then the hash of addons.xml change
+    stat = os.stat(xml_path)
+    source = {"mtime": stat.st_mtime, "size": stat.st_size}
+    start = time.time()
+    index = _load(index_path)
+    if index is not None and index.get("source") == source:
+        stats["load"] = time.time() - start
+        return index, stats
+
+    state = _load(state_path) if index is not None else None
+    if state is None:
+        index, state = empty_index(), empty_state()
+
+    digest = file_hash(xml_path)
+    if state["source"] != digest:
+        start = time.time()
+        with open(xml_path, "rb") as stream:
+            stats["changed"], stats["removed"] = update_index(index, state, stream.read())
+        stats["update"] = time.time() - start
+        state["source"] = digest
+        _save(state_path, state)
+
+    index["source"] = source
+    _save(index_path, index)
+    return index, stats
+
+
+def match(index, field, value):
+    """Return the document numbers where the field contains the term, or matches the prefix ending with '*'."""
+    postings = index["terms"][field]
+    if value.endswith("*"):
+        prefix = value[:-1]
+        return set(doc for term, docs in postings.items() if term.startswith(prefix) for doc in docs)
+    return set(postings.get(value, ()))
+
+
+def search(index, query):
+    """
+    Search the index.
+
+    :param dict index: The search index.
+    :param str query: The search query.
+    :returns: The matching add-on details, best matches first.
+    :rtype: list
+    :raises ValueError: If the query uses an unknown field.
+    """
+    results = None
+    scores = {}
+    for term in ensure_unicode(query).split():
+        field, _, value = term.rpartition(":")
+        if field and field not in fields:
+            raise ValueError("unknown search field '{}', use one of: {}".format(field, ", ".join(fields)))
+
+        value = value.lower()
+        if field:
+            docs = match(index, field, value)
+        else:
+            # Free text terms match any text field, ranked by the fields that matched
+            docs = None
+            words = tokenize(value.rstrip("*"))
+            for count, word in enumerate(words):
+                # Only the last word of a prefix term is a prefix, e.g. 'script.module.req*'
+                if count == len(words) - 1 and value.endswith("*"):
+                    word += "*"
+
+                found = set()
+                for name, weight in text_fields.items():
+                    for doc in match(index, name, word):
+                        scores[doc] = scores.get(doc, 0) + weight
+                        found.add(doc)
+                docs = found if docs is None else docs & found
+
+            # Exact add-on ids come first
+            for doc in match(index, "id", value):
+                if index["docs"][doc]["id"].lower() == value:
+                    scores[doc] = scores.get(doc, 0) + 100
+            docs = docs or set()
+
+        results = docs if results is None else results & docs
+
+    docs = sorted(results or (), key=lambda doc: (-scores.get(doc, 0), index["docs"][doc]["id"]))
+    return [index["docs"][doc] for doc in docs]
+
+
+def print_results(results, elapsed, limit=None):
+    """Display the search results."""
+    shown = results[:limit] if limit else results
+    if shown:
+        id_len = max(len(details["id"]) for details in shown)
+        print("{} {} {} Summary".format("Id".ljust(id_len), "Version".ljust(10), "Provides".ljust(14)))
+        print("-" * (id_len + 60))
+        for details in shown:
+            summary = re.sub(r"\s+", " ", re.sub(r"\[/?[A-Z]+[^\]]*\]", "", details["summary"] or details["name"]))
+            print(u"{} {} {} {}".format(details["id"].ljust(id_len), details["version"].ljust(10),
+                                        " ".join(details["provides"]).ljust(14), summary[:60]))
+        print("-" * (id_len + 60))
+
+    more = " ({} shown)".format(len(shown)) if len(shown) < len(results) else ""
+    print("{} add-ons found{} in {:.1f}ms".format(len(results), more, elapsed * 1000))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Change-aware re-testing, only routes whose inputs have changed are executed again.
+
+The add-on process records the inputs of each route, the source files of every add-on module that
+was imported along with the addon.xml, settings.xml and strings.po files that were loaded. The
+controller stores the content hash of every input with the results of the route in a state file.
+On the next run, the stored results are reused for every route whose inputs are all unchanged.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from codecs import open as _open
+import platform
+import hashlib
+import json
+import time
+import sys
+import os
+
+# Package imports
+from addondev.utils import ensure_unicode
+from addondev import support
+
+# Set to True to reuse the results of unchanged routes
+enabled = False
+
+# The path of the state file
+state_file = None
+
+# The stored state, with the inputs and results of each route
+_state = None
+
+# Content hashes of input files, keyed by path and validated by modification time and size
+_hashes = {}
+
+# The routes that were reused, as tuples of url and the time saved
+skipped = []
+
+# The number of routes that were executed
+executed = 0
+
+
+def default_state_file(plugin_id):
+    """Return the default state file of an add-on, within the mock kodi home directory."""
+    if "home" not in support.kodi_paths:
+        support.setup_paths()
+    return os.path.join(support.kodi_paths["home"], u"route_state", u"{}.json".format(plugin_id))
+
+
+def _module_file(module):
+    filename = getattr(module, "__file__", None)
+    if filename:
+        filename = ensure_unicode(filename, sys.getfilesystemencoding())
+        return filename[:-1] if filename.endswith((".pyc", ".pyo")) else filename
+
+
+def loaded_inputs():
+    """
+    Return the add-on files that were loaded by the add-on process. Called from within the add-on process.
+
+    :returns: Sorted list of file paths.
+    :rtype: list
+    """
+    addons = [addon for addon in support.avail_addons.values() if addon.path]
+    roots = tuple(os.path.realpath(addon.path) + os.sep for addon in addons)
+
+    files = set()
+    for module in list(sys.modules.values()):
+        filename = _module_file(module)
+        if filename and os.path.realpath(filename).startswith(roots):
+            files.add(os.path.realpath(filename))
+
+    # Settings and strings are loaded for the plugin and all of its dependencies
+    for addon in addons:
+        loaded = [addon.__dict__[name] for name in ("settings", "strings") if name in addon.__dict__]
+        if loaded:
+            files.add(os.path.realpath(os.path.join(addon.path, u"addon.xml")))
+            files.update(ensure_unicode(path) for data in loaded for path in data.files)
+    return sorted(files)
+
+
+def input_hash(path):
+    """Return the content hash of an input file, or None if the file does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    key = (path, stat.st_mtime, stat.st_size)
+    if key not in _hashes:
+        with open(path, "rb") as stream:
+            _hashes[key] = hashlib.sha1(stream.read()).hexdigest()
+    return _hashes[key]
+
+
+def environment():
+    """Return the details of the environment that the stored results depend on."""
+    return {"python": platform.python_version(), "implementation": platform.python_implementation()}
+
+
+def load(path):
+    """
+    Load the state file, any state from another python version is discarded.
+
+    :param str path: The path to the state file.
+    """
+    global _state, state_file
+    state_file = path
+    _state = {"environment": environment(), "routes": {}}
+    if os.path.exists(path):
+        with _open(path, "r", "utf8") as stream:
+            state = json.load(stream)
+        if state.get("environment") == _state["environment"]:
+            _state = state
+
+
+def save():
+    """Save the state file."""
+    directory = os.path.dirname(state_file)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with _open(state_file, "w", "utf8") as stream:
+        stream.write(json.dumps(_state, sort_keys=True))
+
+
+def _key(callback_url, content_type):
+    return u"{} {}".format(content_type, callback_url)
+
+
+def lookup(callback_url, content_type):
+    """
+    Return the stored result of a route if none of its inputs have changed.
+
+    :param str callback_url: The callback url of the route.
+    :param str content_type: The content type of the route.
+    :returns: The stored route result, or None if the route needs to be executed.
+    :rtype: dict
+    """
+    start = time.time()
+    entry = _state["routes"].get(_key(callback_url, content_type))
+    if entry is None or any(input_hash(path) != digest for path, digest in entry["inputs"].items()):
+        return None
+
+    result = dict(entry["result"], reused=True)
+    elapsed = time.time() - start
+    skipped.append((callback_url, result["elapsed"] - elapsed))
+    result["elapsed"] = elapsed
+    return result
+
+
+def store(callback_url, content_type, result):
+    """
+    Store the result of an executed route along with the hashes of its inputs.
+
+    Failed routes are never stored, so that they are always executed again.
+
+    :param str callback_url: The callback url of the route.
+    :param str content_type: The content type of the route.
+    :param dict result: The normalized route result.
+    """
+    global executed
+    executed += 1
+    key = _key(callback_url, content_type)
+    inputs = result["data"].get("inputs")
+    if result["succeeded"] and inputs:
+        _state["routes"][key] = {"inputs": dict((path, input_hash(path)) for path in inputs), "result": result}
+    else:
+        _state["routes"].pop(key, None)
+
+
+def print_summary():
+    """Display the number of routes that were reused and the time saved."""
+    saved = sum(elapsed for _, elapsed in skipped)
+    print("")
+    print("{} routes executed, {} unchanged routes skipped, {:.3f}s saved".format(executed, len(skipped), saved))
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+Golden listing snapshots, to catch unintended changes to the listings of an add-on.
+
+The result of each route is canonicalized before it's stored. Hex encoded '_json_' and '_pickle_'
+url parameters are decoded, so the payloads compare by value rather than by encoding. Volatile fields
+are dropped by ignore patterns. The canonical result is stored as a compressed blob named by its
+content hash, so routes with identical results share a blob and unchanged routes don't touch the disk.
+
+Verification compares the hash of each route with the stored hash first. The stored blob is only
+loaded, and a structural per listitem diff made, when the hashes differ. Routes are executed by a
+pool of persistent add-on processes, so snapshots are updated and verified in parallel.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from multiprocessing.pool import ThreadPool
+from codecs import open as _open
+import threading
+import difflib
+import fnmatch
+import hashlib
+import json
+import zlib
+import re
+import os
+
+# Package imports
+from addondev.worker import Worker
+from addondev.batch import normalize
+from addondev.fuzz import Route
+from addondev.utils import safe_path, ensure_unicode
+
+# The name of the index file within the snapshot directory
+INDEX_FILE = u"index.json"
+
+# The directory within the snapshot directory that holds the compressed results
+BLOB_DIR = u"blobs"
+
+# Changes to the canonical form must bump the version, as every stored hash changes
+SNAPSHOT_VERSION = 1
+
+# The plugin data that makes up the result of a route, timings and logs are ignored
+result_keys = ("succeeded", "error", "listitem", "resolved", "playlist", "contenttype", "category", "sortmethods")
+
+# The maximum number of differences to display per route
+max_differences = 10
+
+# Hex encoded payloads within context menu commands
+_payload = re.compile(r"(_(?:pickle|json)_)=([0-9a-f]+)", re.IGNORECASE)
+
+
+def decode_url(url):
+    """
+    Return a url broken down into the url and its parameters, with '_json_' and '_pickle_' payloads decoded.
+
+    Urls without parameters are returned unchanged.
+    """
+    if not isinstance(url, type(u"")) or "?" not in url or "://" not in url:
+        return url
+
+    route = Route.parse(url)
+    params = {}
+    for key, value, _ in route.params:
+        params.setdefault(key, []).append(normalize(value))
+    return {"url": route.base + route.selector,
+            "params": dict((key, values[0] if len(values) == 1 else values) for key, values in params.items())}
+
+
+def _decode_payload(match):
+    url = decode_url(u"plugin://-/?{}={}".format(match.group(1), match.group(2)))
+    return u"{}={}".format(match.group(1), json.dumps(url["params"][match.group(1)], sort_keys=True))
+
+
+def canonical_item(url, item, isfolder):
+    """Return the canonical form of a listitem, with all urls decoded."""
+    item = dict(item)
+    if "path" in item:
+        item["path"] = decode_url(item["path"])
+    if "context" in item:
+        item["context"] = [[name, _payload.sub(_decode_payload, command)] for name, command in item["context"]]
+    return {"url": decode_url(url), "isfolder": bool(isfolder), "item": item}
+
+
+def ignore_pattern(patterns):
+    """
+    Return a regex that matches the dotted path of every field to ignore, or None if nothing is ignored.
+
+    :param list patterns: Wildcard patterns of the fields to ignore. e.g. 'listitem.*.item.info.lastplayed'
+    """
+    if not patterns:
+        return None
+    return re.compile(u"|".join(u"(?:{})".format(fnmatch.translate(pattern)) for pattern in patterns))
+
+
+def field_path(path, key):
+    """
+    Return the dotted path of a field, e.g. 'listitem.0.item.label'.
+
+    The same paths are matched by the ignore patterns and shown in the differences,
+    so a reported path can be used as an ignore pattern as is.
+    """
+    return u"{}.{}".format(path, key) if path else u"{}".format(key)
+
+
+def prune(value, pattern, path=u""):
+    """Return a copy of a canonical result without the fields whose dotted path matches the ignore pattern."""
+    if isinstance(value, dict):
+        items = ((key, field_path(path, key)) for key in value)
+        return dict((key, prune(value[key], pattern, sub_path)) for key, sub_path in items
+                    if not pattern.match(sub_path))
+    elif isinstance(value, list):
+        items = ((item, field_path(path, index)) for index, item in enumerate(value))
+        return [prune(item, pattern, sub_path) for item, sub_path in items if not pattern.match(sub_path)]
+    return value
+
+
+def flatten(value, path=u""):
+    """Flatten a canonical result into a dict of dotted path to value."""
+    items = {}
+    if isinstance(value, dict) and value:
+        for key in value:
+            items.update(flatten(value[key], field_path(path, key)))
+    elif isinstance(value, list) and value:
+        for index, item in enumerate(value):
+            items.update(flatten(item, field_path(path, index)))
+    else:
+        items[path] = value
+    return items
+
+
+def canonicalize(data, pattern=None):
+    """
+    Return the canonical form of the result of a route.
+
+    :param dict data: The results returned from the add-on process.
+    :param pattern: The regex of the fields to ignore, from ignore_pattern.
+    :rtype: dict
+    """
+    result = dict((key, normalize(data.get(key))) for key in result_keys)
+    result["listitem"] = [canonical_item(*item) for item in result["listitem"]]
+    if isinstance(result["resolved"], dict) and "path" in result["resolved"]:
+        result["resolved"]["path"] = decode_url(result["resolved"]["path"])
+    return prune(result, pattern) if pattern else result
+
+
+def encode(result):
+    """Return the serialized canonical result and its content hash."""
+    raw = json.dumps(result, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf8")
+    return raw, hashlib.sha1(raw).hexdigest()
+
+
+class SnapshotStore(object):
+    """
+    Directory of snapshots, an index of the hash of each route and the compressed blob of each hash.
+
+    :param str path: The path to the snapshot directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.routes = {}
+        self.ignore = []
+        index_path = safe_path(os.path.join(path, INDEX_FILE))
+        if os.path.exists(index_path):
+            with _open(index_path, "r", "utf8") as stream:
+                index = json.load(stream)
+            if index.get("version") == SNAPSHOT_VERSION:
+                self.routes = index["routes"]
+                self.ignore = index["ignore"]
+
+    def makedirs(self):
+        blob_dir = safe_path(os.path.join(self.path, BLOB_DIR))
+        if not os.path.exists(blob_dir):
+            os.makedirs(blob_dir)
+
+    def blob_path(self, digest, suffix=u""):
+        return safe_path(os.path.join(self.path, BLOB_DIR, u"{}.json.z{}".format(digest, suffix)))
+
+    def load(self, digest):
+        """Return the canonical result stored under the given hash."""
+        with open(self.blob_path(digest), "rb") as stream:
+            return json.loads(zlib.decompress(stream.read()).decode("utf8"))
+
+    def store(self, raw, digest):
+        """Store a serialized canonical result under its hash, if not already stored."""
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            # Written under a unique name and then renamed, so concurrent writers never see a partial blob
+            temp = self.blob_path(digest, u".{}".format(threading.current_thread().ident))
+            with open(temp, "wb") as stream:
+                stream.write(zlib.compress(raw, 9))
+            os.rename(temp, path)
+
+    def save(self):
+        """Save the index and remove every blob that is no longer referenced."""
+        with _open(safe_path(os.path.join(self.path, INDEX_FILE)), "w", "utf8") as stream:
+            stream.write(json.dumps({"version": SNAPSHOT_VERSION, "ignore": self.ignore, "routes": self.routes},
+                                    indent=1, sort_keys=True))
+
+        referenced = set(u"{}.json.z".format(entry["hash"]) for entry in self.routes.values())
+        blob_dir = safe_path(os.path.join(self.path, BLOB_DIR))
+        for filename in os.listdir(blob_dir):
+            if ensure_unicode(filename) not in referenced:
+                os.remove(os.path.join(blob_dir, filename))
+
+
+def _compare(old, new, prefix):
+    old_flat, new_flat = flatten(old, prefix), flatten(new, prefix)
+    return [(path, old_flat.get(path), new_flat.get(path)) for path in sorted(set(old_flat) | set(new_flat))
+            if old_flat.get(path) != new_flat.get(path)]
+
+
+def diff(old, new):
+    """
+    Return the structural differences between two canonical results.
+
+    Listitems are matched up by their url, so inserted and removed items only show up once,
+    and the fields of matching items are compared one by one.
+
+    :returns: List of tuples of path, old value and new value.
+    :rtype: list
+    """
+    differences = []
+    for key in sorted(set(old) | set(new)):
+        if key != "listitem":
+            differences.extend(_compare(old.get(key), new.get(key), key))
+
+    old_items, new_items = old.get("listitem", []), new.get("listitem", [])
+    keys = [[json.dumps(item["url"], sort_keys=True) for item in items] for items in (old_items, new_items)]
+    matcher = difflib.SequenceMatcher(None, keys[0], keys[1], autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal" or (tag == "replace" and old_end - old_start == new_end - new_start):
+            # Matching urls, or items that were changed in place
+            for old_index, new_index in zip(range(old_start, old_end), range(new_start, new_end)):
+                differences.extend(_compare(old_items[old_index], new_items[new_index],
+                                            field_path(u"listitem", new_index)))
+        else:
+            for index in range(old_start, old_end):
+                differences.append((u"{} (removed)".format(field_path(u"listitem", index)),
+                                    old_items[index]["item"].get("label"), None))
+            for index in range(new_start, new_end):
+                differences.append((u"{} (added)".format(field_path(u"listitem", index)), None,
+                                    new_items[index]["item"].get("label")))
+    return differences
+
+
+class WorkerPool(object):
+    """
+    Executes routes in parallel, each thread of the pool with its own persistent add-on process.
+
+    :param unicode pluginpath: The path to the plugin to execute.
+    :param str content_type: The content type to list, if more than one type is available.
+    :param int jobs: The number of add-on processes to run at the same time.
+    """
+
+    def __init__(self, pluginpath, content_type="video", jobs=4):
+        self.pluginpath = pluginpath
+        self.content_type = content_type
+        self.workers = []
+        self._pool = ThreadPool(jobs)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _run(self, args):
+        func, url = args
+        worker = getattr(self._local, "worker", None)
+        if worker is None:
+            self._local.worker = worker = Worker(self.pluginpath, self.content_type)
+            with self._lock:
+                self.workers.append(worker)
+        return func(url, worker.execute(url))
+
+    def map(self, func, urls):
+        """
+        Execute every url, calling func with the url and the results of the route within the pool thread.
+
+        :returns: List of the return values of func, in the order of the urls.
+        :rtype: list
+        """
+        return self._pool.map(self._run, [(func, url) for url in urls], chunksize=1)
+
+    def stop(self):
+        self._pool.close()
+        self._pool.join()
+        for worker in self.workers:
+            worker.stop()
+
+
+def snapshot(pool, store, urls, update=False, crawl=None):
+    """
+    Execute the routes, comparing the result of each route against its snapshot, or updating the snapshot.
+
+    :param WorkerPool pool: The pool of add-on processes.
+    :param SnapshotStore store: The snapshot store.
+    :param list urls: List of callback urls to execute, the start of the crawl when crawling.
+    :param bool update: Store the results as the new snapshots instead of verifying them.
+    :param int crawl: Crawl the folders of the add-on up to this many levels deep.
+    :returns: List of route results, each a dict of url, status, items, hash and differences.
+    :rtype: list
+    """
+    pattern = ignore_pattern(store.ignore)
+    if update:
+        store.makedirs()
+
+    def check(url, data):
+        result = {"url": url, "status": "ok", "differences": [], "folders": []}
+        if "failure" in data or data.get("error"):
+            # A route that raised or died is never stored as the expected result
+            result.update(status="error", items=0, hash=None, error=data["error"])
+            return result
+
+        canonical = canonicalize(data, pattern)
+        raw, digest = encode(canonical)
+        result.update(items=len(canonical.get("listitem", ())), hash=digest,
+                      folders=[item[0] for item in data["listitem"] if item[2]])
+        entry = store.routes.get(url)
+        if update:
+            store.store(raw, digest)
+            result["status"] = "added" if entry is None else "unchanged" if entry["hash"] == digest else "updated"
+        elif entry is None:
+            result["status"] = "new"
+        elif entry["hash"] != digest:
+            # The ignore patterns may have changed since the snapshot was stored
+            stored = store.load(entry["hash"])
+            stored = prune(stored, pattern) if pattern else stored
+            if encode(stored)[1] != digest:
+                result.update(status="changed", differences=diff(stored, canonical))
+        return result
+
+    results = []
+    visited = set(urls)
+    depth = 0
+    while urls:
+        level = pool.map(check, urls)
+        results.extend(level)
+
+        # Queue up the sub folders of the add-on for the next level of the crawl
+        urls = []
+        if crawl is not None and depth < crawl:
+            base_url = u"plugin://{}/".format(os.path.basename(pool.pluginpath))
+            for result in level:
+                for url in result["folders"]:
+                    if url.startswith(base_url) and url not in visited:
+                        visited.add(url)
+                        urls.append(url)
+        depth += 1
+
+    if update:
+        for result in results:
+            if result["hash"] is not None:
+                store.routes[result["url"]] = {"hash": result["hash"], "items": result["items"]}
+    return results
+
+
+def print_results(results, update=False):
+    """
+    Display the status of each route, along with the differences of the routes that changed.
+
+    :param list results: List of route results.
+    :param bool update: True if the snapshots were updated.
+    :returns: The number of routes that failed verification.
+    :rtype: int
+    """
+    url_len = max(len(result["url"]) for result in results) if results else 0
+    print("")
+    print("{} {} {} Url".format("Status".ljust(9), "Items".rjust(6), "Hash".ljust(12)))
+    print("-" * (url_len + 30))
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+        print("{} {:>6} {} {}".format(result["status"].ljust(9), result["items"], (result["hash"] or "")[:12].ljust(12),
+                                      result["url"]))
+        if result["status"] == "error":
+            print("{}{}".format(" " * 30, result["error"]))
+    print("-" * (url_len + 30))
+    print(", ".join("{} {}".format(count, status) for status, count in sorted(counts.items())))
+
+    for result in results:
+        if result["differences"]:
+            print("")
+            print(result["url"])
+            for path, old, new in result["differences"][:max_differences]:
+                print("  {}".format(path))
+                print("    - {}".format(json.dumps(old, sort_keys=True)))
+                print("    + {}".format(json.dumps(new, sort_keys=True)))
+            if len(result["differences"]) > max_differences:
+                print("  ... and {} more differences".format(len(result["differences"]) - max_differences))
+
+    if update:
+        return counts.get("error", 0)
+    return sum(count for status, count in counts.items() if status != "ok")
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Start-up accounting of the cli, from addondev being imported to the add-on code being run.
+
+The controller phases are timed directly by the cli. The phases of the first add-on process
+are taken from the trace events, so tracing is enabled along with the start-up stats.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+import time
+import sys
+
+# Set to True to display the start-up breakdown
+enabled = False
+
+# The start-up time in seconds that is expected, the total is flagged when over budget
+budget = 0.5
+
+# Modules that are slow to import, and should only be imported once the feature that needs them is used
+heavy_modules = ("requests", "http.client", "httplib", "sqlite3", "cProfile", "pstats", "zipfile", "shutil",
+                 "xml.dom.minidom", "logging.handlers", "compileall", "difflib", "multiprocessing")
+
+# The phases of the first route to display, along with the indent level of each phase
+route_phases = (("spawn", 0), ("initializer", 0), ("setup_paths", 1), ("load addon", 1), ("find_addons", 1),
+                ("process_dependencies", 1), ("import entry_point", 0))
+
+# The controller phases as tuples of name, start and end time in seconds
+phases = []
+
+# The heavy modules that were imported by the controller before the first route
+loaded = []
+
+
+def mark(name, start, end=None):
+    """
+    Record a phase of the controller start-up.
+
+    :param str name: The name of the phase.
+    :param float start: The start time of the phase.
+    :param float end: The end time of the phase, defaults to now.
+    """
+    phases.append((name, start, time.time() if end is None else end))
+
+
+def ready(start):
+    """
+    Mark the controller as ready to execute the first route.
+
+    :param float start: The end time of the previous phase.
+    """
+    mark("configure", start)
+    loaded[:] = [name for name in heavy_modules if name in sys.modules]
+
+
+def first_route(events):
+    """
+    Return the phases of the first route from the trace events.
+
+    :param list events: The recorded trace events.
+    :returns: Dict of phase name to trace event.
+    :rtype: dict
+    """
+    events = sorted((event for event in events if event.get("ph") == "X"), key=lambda event: event["ts"])
+    spans = {}
+    for event in events:
+        if event["name"] == "run":
+            spans["run"] = event
+            break
+        spans.setdefault(event["name"], event)
+    return spans
+
+
+def print_summary(events):
+    """
+    Display the start-up breakdown.
+
+    :param list events: The recorded trace events.
+    """
+    if not phases:
+        return
+
+    print("")
+    print("Start-up")
+    print("-" * 50)
+    for name, start, end in phases:
+        print("{} {:>9.1f}ms".format(name.ljust(34), (end - start) * 1000))
+
+    spans = first_route(events)
+    for name, level in route_phases:
+        if name in spans:
+            print("{} {:>9.1f}ms".format(("  " * level + name).ljust(34), spans[name]["dur"] / 1000))
+
+    print("-" * 50)
+    if "run" in spans:
+        total = spans["run"]["ts"] / 1000000 - phases[0][1]
+        print("{} {:>9.1f}ms{}".format("Total until the add-on runs".ljust(34), total * 1000,
+                                       "  OVER BUDGET ({:.0f}ms)".format(budget * 1000) if total > budget else ""))
+    else:
+        total = phases[-1][2] - phases[0][1]
+        print("{} {:>9.1f}ms".format("Total until ready".ljust(34), total * 1000))
+
+    print("Heavy modules imported before the first route: {}".format(", ".join(loaded) or "none"))
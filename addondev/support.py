@@ -4,22 +4,25 @@ from __future__ import print_function
 # Standard Library Imports
 from xml.etree import ElementTree as ETree
 from collections import Mapping, OrderedDict
+from contextlib import contextmanager
 from codecs import open as _open
-from xml.dom import minidom
 import warnings
 import logging
-import zipfile
-import shutil
+import errno
 import time
 import sys
 import os
 import re
 
-# Third party imports
-import appdirs
+try:
+    import fcntl
+except ImportError:
+    # fcntl is unavailable on windows
+    fcntl = None
 
 # Package Imports
-from addondev.utils import CacheProperty, ensure_unicode, ensure_native_str, safe_path, unicode_type
+from addondev.utils import CacheProperty, BoundedList, ensure_unicode, ensure_native_str, safe_path, unicode_type
+from addondev import tracing, libraries
 
 # Base logger
 logger = logging.getLogger("cli")
@@ -35,6 +38,12 @@ avail_addons = dict()
 data_pipe = None
 plugin_id = ""
 
+# File within the mock kodi home directory, marking that all the directories have been created
+BOOTSTRAP_MARKER = u".bootstrap"
+
+# File within the mock kodi home directory, locked while the cached addons are resolved and downloaded
+ADDONS_LOCK = u".addons.lock"
+
 # Data store for addon. Use in xbmcplugin and xbmcgui
 plugin_data = {"succeeded": False, "updatelisting": False, "resolved": None, "contenttype": None,  "category": None,
                "sortmethods": [], "playlist": [], "listitem": []}
@@ -57,7 +66,8 @@ supported_media = {"video": ".m4v|.3g2|.3gp|.nsv|.tp|.ts|.ty|.strm|.pls|.rm|.rmv
                    "picture": ".png|.jpg|.jpeg|.bmp|.gif|.ico|.tif|.tiff|.tga|.pcx|.cbz|.zip|.cbr|.rar|.rss|.webp"
                               "|.jp2|.apng"}
 
-data_log = {"notifications": []}
+# Notifications shown by the add-on, only the most recent are kept
+data_log = {"notifications": BoundedList(1000)}
 
 
 def initializer(plugin_path):
@@ -67,29 +77,56 @@ def initializer(plugin_path):
     :param plugin_path: The path to the plugin that will be executed.
     """
     global plugin_id
-    system_dir, addon_dir = setup_paths()
+    with tracing.span("setup_paths"):
+        system_dir, addon_dir = setup_paths()
+
     plugin_id = os.path.basename(plugin_path)
     sys.argv = ["plugin://{}".format(plugin_id), -1, ""]
 
     # First available addon with be the starting plugin
-    avail_addons[plugin_id] = addon = Addon.from_file(os.path.join(plugin_path, u"addon.xml"))
-    sys.path.insert(0, plugin_path)
-    os.chdir(plugin_path)
-    addon.preload()
-
-    # Preload all existing addons
-    for plugin_file in find_addons(system_dir, addon_dir):
-        req_addon = Addon.from_file(plugin_file)
-        avail_addons[req_addon.id] = req_addon
-
-    # Populate mock environment of required addons
-    dependencies = addon.requires
-    dependencies.append(Dependency("resource.language.en_gb", "2.0.0", False))
-    process_dependencies(dependencies)
+    with tracing.span("load addon", addon=plugin_id):
+        avail_addons[plugin_id] = addon = Addon.from_file(os.path.join(plugin_path, u"addon.xml"))
+        sys.path.insert(0, plugin_path)
+        os.chdir(plugin_path)
+        addon.preload()
+
+    # Add-on processes that start at the same time, e.g. a worker pool, share the cached addons.
+    # Only one at a time may look for and download the dependencies, else one sees the half extracted
+    # addons of another, or both replace the same addon.
+    with file_lock(os.path.join(kodi_paths["home"], ADDONS_LOCK)):
+        # Preload all existing addons
+        with tracing.span("find_addons"):
+            for plugin_file in find_addons(system_dir, addon_dir):
+                req_addon = Addon.from_file(plugin_file)
+                avail_addons[req_addon.id] = req_addon
+
+        # Populate mock environment of required addons
+        dependencies = addon.requires
+        dependencies.append(Dependency("resource.language.en_gb", "2.0.0", False))
+        with tracing.span("process_dependencies"):
+            process_dependencies(dependencies)
     return addon
 
 
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on the given file within the with block, across processes."""
+    if fcntl is None:
+        yield
+        return
+
+    with open(safe_path(path), "a") as stream:
+        fcntl.flock(stream.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(stream.fileno(), fcntl.LOCK_UN)
+
+
 def setup_paths():
+    # Third party imports
+    import appdirs
+
     # Location of support files
     system_dir = os.path.join(ensure_unicode(os.path.dirname(__file__), sys.getfilesystemencoding()), u"data")
     kodi_paths["support"] = system_dir
@@ -108,11 +145,20 @@ def setup_paths():
     kodi_paths["musicplaylists"] = os.path.join(playlists, u"music")
     kodi_paths["videoplaylists"] = os.path.join(playlists, u"video")
 
-    # Ensure that all directories exists
-    for path in kodi_paths.values():
-        path = safe_path(path)
-        if not os.path.exists(path):
-            os.makedirs(path)
+    # Ensure that all directories exists, logpath is a file and is only set on a previous call.
+    # The marker file lists the directories that were created, so later runs skip the checks entirely.
+    # A directory removed since, e.g. to clear the cached addons, is created again where it's used, see makedirs.
+    directories = sorted(path for name, path in kodi_paths.items() if name not in ("logpath", "support"))
+    marker = safe_path(os.path.join(home, BOOTSTRAP_MARKER))
+    layout = u"\n".join(directories)
+    if not _bootstrapped(marker, layout):
+        for path in directories:
+            path = safe_path(path)
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+        with _open(marker, "w", "utf8") as stream:
+            stream.write(layout)
 
     # Rest of kodi's special paths
     kodi_paths["logpath"] = os.path.join(temp_dir, u"kodi.log")
@@ -130,6 +176,27 @@ def setup_paths():
     return system_dir, addon_dir
 
 
+def _bootstrapped(marker, layout):
+    """Check if the mock kodi directories were already created with the given layout."""
+    try:
+        with _open(marker, "r", "utf8") as stream:
+            return stream.read() == layout
+    except (IOError, OSError):
+        return False
+
+
+def makedirs(path):
+    """
+    Create a directory of the mock kodi home if it's missing.
+
+    The bootstrap marker is trusted, so a directory that was removed after the bootstrap
+    is only created again when something is written to it.
+    """
+    path = safe_path(path)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
 def find_addons(*dirs):
     """
     Search given directory for addons.
@@ -141,7 +208,15 @@ def find_addons(*dirs):
     filename = safe_path("addon.xml")
     for path in dirs:
         path = safe_path(path)
-        for item in os.listdir(path):
+        try:
+            items = os.listdir(path)
+        except OSError as e:
+            # The addon directory was removed after the bootstrap, so there are no addons
+            if e.errno == errno.ENOENT:
+                continue
+            raise
+
+        for item in items:
             plugin_file = os.path.join(path, item, filename)
             if os.path.exists(plugin_file):
                 yield ensure_unicode(plugin_file)
@@ -191,15 +266,26 @@ class Repo(object):
     # Kodi version code names for repository linking
     repo = "krypton"
 
+    # Set to True to skip the periodic check for addon updates, e.g. when running without network access
+    offline = False
+
     def __init__(self):
-        self.repo_url = "http://mirrors.kodi.tv/addons/{}/{}".format(self.repo, "{}")
+        # The repo can be a kodi version code name, the url of a repository or a local repository directory
+        self.local_dir = None
+        if os.path.isdir(self.repo):
+            self.local_dir = self.repo
+            self.repo_url = os.path.join(self.repo, "{}")
+        elif "://" in self.repo:
+            self.repo_url = self.repo.rstrip("/") + "/{}"
+        else:
+            self.repo_url = "http://mirrors.kodi.tv/addons/{}/{}".format(self.repo, "{}")
         self._package_dir = kodi_paths["packages"]
         self._addon_dir = kodi_paths["addons"]
         self.db = {}
 
         # Check if an update is scheduled
         self.update_file = safe_path(os.path.join(kodi_paths["temp"], u"update_check"))
-        if self.update_required():
+        if not self.offline and self.update_required():
             self.update()
 
     @CacheProperty
@@ -217,14 +303,52 @@ class Repo(object):
             return update
         else:
             # Create missing check file and force update
+            makedirs(os.path.dirname(self.update_file))
             _open(self.update_file, "w").close()
             return True
 
+    @property
+    def cache_dir(self):
+        """The directory used to cache the index of the repository."""
+        return os.path.join(kodi_paths["temp"], u"repos", re.sub(r"[^\w.-]+", "_", ensure_unicode(self.repo)))
+
+    def fetch_index(self, max_age=0):
+        """
+        Return the path to a local copy of the repository addons.xml, downloading it if required.
+
+        :param int max_age: The max age in seconds of the cached copy, 0 to always download.
+        :returns: The path to addons.xml.
+        """
+        url = self.repo_url.format("addons.xml")
+        if self.local_dir:
+            return url
+
+        path = os.path.join(self.cache_dir, u"addons.xml")
+        spath = safe_path(path)
+        if max_age and os.path.exists(spath) and time.time() - os.stat(spath).st_mtime < max_age:
+            return path
+
+        logger.info("Communicating with kodi's official repository: Please wait.")
+        with tracing.span("fetch addons.xml", "network", url=url):
+            raw_xml = self._session.get(url).content
+
+        # Replace the cached copy in one step, so a failed download never leaves a partial file behind
+        if not os.path.exists(safe_path(self.cache_dir)):
+            os.makedirs(safe_path(self.cache_dir))
+        tmp = safe_path(path + u".tmp")
+        with _open(tmp, "wb") as stream:
+            stream.write(raw_xml)
+        if not hasattr(os, "replace") and os.path.exists(spath):
+            # Python 2 has no atomic replace
+            os.remove(spath)
+        getattr(os, "replace", os.rename)(tmp, spath)
+        return path
+
     def populate(self):
         """Search for all available addons."""
-        logger.info("Communicating with kodi's official repository: Please wait.")
-        url = self.repo_url.format("addons.xml")
-        raw_xml = self._session.get(url).content
+        with _open(safe_path(self.fetch_index()), "rb") as stream:
+            raw_xml = stream.read()
+
         addon_xml = ETree.fromstring(raw_xml)
         for node in addon_xml.iterfind("addon"):
             addonid = node.attrib["id"]
@@ -253,6 +377,7 @@ class Repo(object):
             self.populate()
 
         # Process required addons befor downloading
+        downloaded = []
         for req_dep in required:
             if req_dep.id in self.db:
                 addon = self.db[req_dep.id]
@@ -269,11 +394,20 @@ class Repo(object):
 
                 # Now we download the addon
                 self.download(addon)
+                downloaded.append(addon.path)
 
             # Raise error only if addon is not actually required(optional)
             elif req_dep.optional is False:
                 raise KeyError("unable to find required dependency: '{}'".format(req_dep.id))
 
+        # Byte-compile the new addons so the first import don't have to,
+        # the bytecode location is decided over the plugin and all cached addons, as the add-on process does
+        if downloaded:
+            from addondev.imports import precompile
+            plugin = avail_addons.get(plugin_id)
+            with tracing.span("precompile", addons=len(downloaded)):
+                precompile(downloaded, plugin.path if plugin else None)
+
     def download(self, addon):
         """
         Download any requred addon
@@ -288,26 +422,35 @@ class Repo(object):
         # This will prevent an error if the addon was manually removed by user
         if os.path.exists(tmp):
             os.remove(tmp)
+        else:
+            makedirs(self._package_dir)
 
         # Request the addon zipfile from server
         url_part = "{0}/{1}".format(addon.id, filename)
         url = self.repo_url.format(url_part)
-        resp = self._session.get(url)
+        with tracing.span("download", "network", url=url):
+            if self.local_dir:
+                import shutil
+                shutil.copyfile(url, tmp)
+            else:
+                resp = self._session.get(url)
 
-        # Read and save contents of zipfile to package directory
-        with _open(tmp, "wb") as stream:
-            for chunk in resp.iter_content(decode_unicode=False):
-                stream.write(chunk)
+                # Read and save contents of zipfile to package directory
+                with _open(tmp, "wb") as stream:
+                    for chunk in resp.iter_content(decode_unicode=False):
+                        stream.write(chunk)
+                resp.close()
 
         # Remove the old plugin directory if exists
         # This is needed when updating addons
         udst = os.path.join(self._addon_dir, addon.id)
         sdst = safe_path(udst)
         if os.path.exists(sdst):
+            import shutil
             shutil.rmtree(sdst)
 
-        resp.close()
-        self.extract_zip(tmp)
+        with tracing.span("extract_zip", filename=filename):
+            self.extract_zip(tmp)
 
         addon.path = udst
         addon.preload()
@@ -315,6 +458,7 @@ class Repo(object):
 
     def extract_zip(self, src):
         """Extract all content of zipfile to addon directoy."""
+        import zipfile
         zipobj = zipfile.ZipFile(src)
         zipobj.extractall(self._addon_dir)
 
@@ -348,12 +492,10 @@ class Addon(object):
 
     def preload(self):
         """Preload addon data e.g. strings, settings."""
-        # Append addon library path to sys.path if addon is a module.
+        # Register the addon library path with the library finder if addon is a module.
         data = self._xml.find("./extension[@point='xbmc.python.module']")
         if data is not None:
-            library_path = ensure_native_str(os.path.join(self.path, os.path.normpath(data.attrib["library"])))
-            if library_path not in sys.path:
-                sys.path.insert(0, library_path)
+            libraries.register(self.id, os.path.join(self.path, os.path.normpath(data.attrib["library"])))
 
         # Preload strings & settings
         self.__dict__["settings"] = self._settings()
@@ -497,6 +639,7 @@ class Addon(object):
 class Strings(Mapping):
     def __init__(self, plugin_path):
         self._strings = {}
+        self.files = []
 
         # Locate and extract stirngs data
         self._search_strings(os.path.join(plugin_path, "resources"))
@@ -523,6 +666,7 @@ class Strings(Mapping):
 
     def _extractor(self, strings_path):
         """Extract the strings from the strings.po file"""
+        self.files.append(strings_path)
         with _open(strings_path, "r", "utf-8") as stream:
             file_data = stream.read()
 
@@ -544,15 +688,18 @@ class Strings(Mapping):
 class Settings(dict):
     def __init__(self, plugin_path, plugin_profile):
         super(Settings, self).__init__()
+        self.files = []
 
         # Populate settings from the addon source settings file
         settings_path = safe_path(os.path.join(plugin_path, "resources", "settings.xml"))
         if os.path.exists(settings_path):
+            self.files.append(settings_path)
             xmldata = ETree.parse(settings_path).getroot()
             self._extractor(xmldata)
 
-        # Populate settings from the addon saved profile settings file
+        # Populate settings from the addon saved profile settings file, which may be created later on
         self._settings_path = settings_path = safe_path(os.path.join(plugin_profile, "settings.xml"))
+        self.files.append(settings_path)
         if os.path.exists(settings_path):
             xmldata = ETree.parse(settings_path).getroot()
             self._extractor(xmldata)
@@ -585,6 +732,7 @@ class Settings(dict):
         if not os.path.exists(settings_dir):
             os.makedirs(settings_dir)
 
+        from xml.dom import minidom
         raw_xml = minidom.parseString(ETree.tostring(tree)).toprettyxml(indent=" "*4, encoding="utf8")
         with _open(self._settings_path, "wb") as stream:
             stream.write(raw_xml)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Settings sweep, executes the same routes under every combination of a matrix of setting values.
+
+Each combination runs in its own persistent add-on process with its own profile directory, holding
+a settings.xml with the values of the combination, so no state on disk is shared between them.
+The combinations run in parallel. Combinations and routes that produce identical results are
+grouped together, so only the settings that make a difference stand out.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+from codecs import open as _open
+import itertools
+import tempfile
+import hashlib
+import shutil
+import json
+import time
+import os
+
+# Package imports
+from addondev.worker import Worker
+from addondev.batch import normalize
+from addondev.utils import safe_path
+from addondev import support
+
+# The plugin data that makes up the result of a route, timings and logs are ignored
+result_keys = ("succeeded", "error", "listitem", "resolved", "playlist", "contenttype", "category", "sortmethods")
+
+
+def load_matrix(filename):
+    """
+    Load a settings matrix from a json file, mapping setting ids to a list of values.
+
+    :param str filename: The path to the json file.
+    :rtype: OrderedDict
+    """
+    with _open(filename, "r", "utf8") as stream:
+        matrix = json.load(stream, object_pairs_hook=OrderedDict)
+
+    for setting_id, values in matrix.items():
+        if not isinstance(values, list) or not values:
+            raise ValueError("setting '{}' must have a list of values".format(setting_id))
+        matrix[setting_id] = [json.dumps(value) if isinstance(value, bool) else u"{}".format(value)
+                              for value in values]
+    return matrix
+
+
+def combinations(matrix):
+    """
+    Return every combination of the setting values.
+
+    :param dict matrix: Dict of setting id to list of values.
+    :returns: List of dicts of setting id to value.
+    :rtype: list
+    """
+    ids = list(matrix)
+    return [OrderedDict(zip(ids, values)) for values in itertools.product(*[matrix[key] for key in ids])]
+
+
+def label(combination):
+    return u" ".join(u"{}={}".format(key, value) for key, value in combination.items())
+
+
+def make_profile(pluginpath, profile, combination):
+    """
+    Create the profile directory of a combination, with a settings.xml holding the values of the combination.
+
+    Any settings saved in the shared profile of the add-on are carried over, unless overridden.
+
+    :param unicode pluginpath: The path to the plugin.
+    :param unicode profile: The profile directory to create.
+    :param dict combination: Dict of setting id to value.
+    """
+    shared = os.path.join(support.kodi_paths["data"], os.path.basename(pluginpath), u"settings.xml")
+    os.makedirs(safe_path(profile))
+    if os.path.exists(safe_path(shared)):
+        shutil.copyfile(safe_path(shared), safe_path(os.path.join(profile, u"settings.xml")))
+
+    settings = support.Settings(pluginpath, profile)
+    for setting_id, value in combination.items():
+        # Settings are saved to disk every time a value is set
+        settings[setting_id] = value
+
+
+def result_hash(data):
+    """Return a hash of the result of a route, so identical results can be found."""
+    result = dict((key, normalize(data.get(key))) for key in result_keys)
+    return hashlib.sha1(json.dumps(result, sort_keys=True).encode("utf8")).hexdigest()
+
+
+def run_combination(pluginpath, urls, content_type, profile, combination):
+    """
+    Execute every route in a persistent add-on process, using the given settings.
+
+    :returns: Dict of the combination and the list of route results.
+    :rtype: dict
+    """
+    make_profile(pluginpath, profile, combination)
+    worker = Worker(pluginpath, content_type, profile)
+    routes = []
+    try:
+        for url in urls:
+            start = time.time()
+            data = worker.execute(url)
+            elapsed = time.time() - start
+            routes.append({"url": url, "succeeded": bool(data.get("succeeded")), "elapsed": elapsed,
+                           "items": len(data.get("listitem", ())), "error": data.get("error"),
+                           "hash": result_hash(data)})
+    finally:
+        worker.stop()
+
+    digest = hashlib.sha1(u" ".join(route["hash"] for route in routes).encode("utf8")).hexdigest()
+    return {"combination": combination, "routes": routes, "hash": digest}
+
+
+def sweep(pluginpath, urls, content_type, matrix, processes=None):
+    """
+    Execute the routes under every combination of the settings matrix, in parallel.
+
+    :param unicode pluginpath: The path to the plugin to execute.
+    :param list urls: List of callback urls to execute.
+    :param str content_type: The content type to list, if more than one type is available.
+    :param dict matrix: Dict of setting id to list of values.
+    :param int processes: The number of combinations to run at the same time, defaults to the cpu count.
+    :returns: List of combination results, in the order of the combinations.
+    :rtype: list
+    """
+    import multiprocessing
+    combos = combinations(matrix)
+    workdir = tempfile.mkdtemp(prefix="addondev-sweep-")
+    pool = ThreadPool(min(processes or multiprocessing.cpu_count(), len(combos)))
+    try:
+        jobs = [pool.apply_async(run_combination, (pluginpath, urls, content_type,
+                                                   os.path.join(workdir, str(count)), combination))
+                for count, combination in enumerate(combos)]
+        return [job.get() for job in jobs]
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_results(results):
+    """
+    Display the latency and failures of each combination, along with the groups of identical results.
+
+    :param list results: List of combination results.
+    :returns: The number of failed routes.
+    :rtype: int
+    """
+    # Identical results get the same group letter
+    groups = OrderedDict()
+    for result in results:
+        groups.setdefault(result["hash"], []).append(result)
+    letters = dict((digest, chr(ord("A") + count % 26)) for count, digest in enumerate(groups))
+
+    label_len = max(len(label(result["combination"])) for result in results)
+    print("")
+    print("{} {} {} {} {} Result".format("Combination".ljust(label_len), "Routes".rjust(6), "Failed".rjust(6),
+                                         "Median".rjust(8), "Max".rjust(8)))
+    print("-" * (label_len + 40))
+    failed = 0
+    for result in results:
+        timings = sorted(route["elapsed"] for route in result["routes"])
+        failures = [route for route in result["routes"] if not route["succeeded"]]
+        failed += len(failures)
+        print("{} {:>6} {:>6} {:>7.3f}s {:>7.3f}s {}".format(
+            label(result["combination"]).ljust(label_len), len(timings), len(failures),
+            timings[len(timings) // 2] if timings else 0.0, timings[-1] if timings else 0.0, letters[result["hash"]]))
+        for route in failures:
+            print("{}{} {}".format(" " * 4, route["url"], route["error"] or ""))
+    print("-" * (label_len + 40))
+    print("{} combinations, {} distinct results, {} failed routes".format(len(results), len(groups), failed))
+
+    # Show the routes that change with the settings, and which combinations share each result
+    if len(groups) > 1:
+        print("")
+        print("Routes that differ between combinations:")
+        for index, url in enumerate(route["url"] for route in results[0]["routes"]):
+            variants = OrderedDict()
+            for result in results:
+                variants.setdefault(result["routes"][index]["hash"], []).append(label(result["combination"]))
+            if len(variants) > 1:
+                print("  {} ({} distinct results)".format(url, len(variants)))
+                for count, labels in enumerate(variants.values()):
+                    print("    {}: {}".format(count + 1, ", ".join(labels)))
+    return failed
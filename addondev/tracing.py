@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Phase tracing using the chrome trace event format.
+
+Both the controller and the add-on process record spans against the same wall clock,
+so that both sides of the pipe line up on a single timeline when the output file
+is loaded into chrome://tracing or https://ui.perfetto.dev.
+"""
+
+# Standard Library Imports
+import threading
+import json
+import time
+import os
+
+# Set to True to start recording spans
+enabled = False
+
+# List of all recorded trace events
+events = []
+
+# Bound at import, so that the trace keeps real time when the add-on runs on the virtual clock
+_wall_time = time.time
+
+
+def clock():
+    """
+    Return the current timestamp in microseconds.
+
+    Wall clock time is used as it's the only clock guaranteed to be shared between processes.
+    """
+    return _wall_time() * 1000000
+
+
+class NullSpan(object):
+    """Reusable do nothing span, returned when tracing is disabled."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class Span(object):
+    """
+    Context manager that records a complete event covering the duration of the with block.
+
+    :param str name: The name of the phase.
+    :param str cat: The category of the phase.
+    :param dict args: Extra data to attach to the event.
+    """
+    __slots__ = ["name", "cat", "args", "start"]
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, exc_type, *_):
+        end = clock()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+
+        events.append({"name": self.name, "cat": self.cat, "ph": "X", "ts": self.start, "dur": end - self.start,
+                       "pid": os.getpid(), "tid": threading.current_thread().ident, "args": self.args})
+        return False
+
+
+_null_span = NullSpan()
+
+
+def span(name, cat="addondev", **kwargs):
+    """
+    Return a context manager that will trace the with block as the given phase.
+
+    :param str name: The name of the phase.
+    :param str cat: The category of the phase. e.g. network, import
+    :param kwargs: Extra data to attach to the event.
+    """
+    if enabled:
+        return Span(name, cat, kwargs)
+    else:
+        return _null_span
+
+
+def process_name(name):
+    """
+    Label the current process within the trace viewer.
+
+    :param str name: The name to give the current process.
+    """
+    if enabled:
+        events.append({"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": name}})
+
+
+def collect():
+    """
+    Return and clear all recorded events.
+
+    :rtype: list
+    """
+    data = events[:]
+    del events[:]
+    return data
+
+
+def save(filename):
+    """
+    Save all recorded events to file in the chrome trace format.
+
+    :param str filename: The path of the output file.
+    """
+    with open(filename, "w") as stream:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, stream)
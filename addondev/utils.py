@@ -43,6 +43,37 @@ class CacheProperty(object):
             return self
 
 
+class BoundedList(list):
+    """
+    List that only keeps the most recent items that are appended.
+
+    Old items are dropped in place, so it stays a plain list to its users and any references to it stay valid.
+
+    :param int maxlen: The max number of items to keep.
+    """
+
+    def __init__(self, maxlen, *args):
+        super(BoundedList, self).__init__(*args)
+        self.maxlen = maxlen
+
+    def append(self, item):
+        super(BoundedList, self).append(item)
+        if len(self) > self.maxlen:
+            del self[:len(self) - self.maxlen]
+
+
+def feature(name):
+    """
+    Return an optional feature module of addondev, or None if it was never imported.
+
+    Feature modules are only imported when their option is given, so a module that was
+    never imported is not enabled, and is not imported just to find that out.
+
+    :param str name: The name of the module, e.g. 'profiling'.
+    """
+    return sys.modules.get("addondev.{}".format(name))
+
+
 def safe_path(path, encoding="utf8"):
     """
     Convert path into a encoding that best suits the platform os.
@@ -131,3 +162,18 @@ def hash_password(password):
     :rtype: str
     """
     return hashlib.md5(password).hexdigest()
+
+
+def format_size(size):
+    """
+    Return the given number of bytes as a human readable string.
+
+    :param int size: The number of bytes.
+    :returns: The size with a unit suffix. e.g. 1.4 MB
+    :rtype: str
+    """
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return "{:.1f} {}".format(size, unit) if unit != "B" else "{} B".format(size)
+        size /= 1024.0
+    return "{:.1f} GB".format(size)
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Virtual clock for the add-on process.
+
+Sleeps and monitor waits advance a simulated clock instantly instead of blocking. time.time, the
+monotonic clocks and the datetime helpers all report the simulated time, so the add-on sees time
+pass consistently. The clock is shared by all threads of the add-on.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from contextlib import contextmanager
+import datetime
+import time
+
+# Set to True to run the add-on on the virtual clock
+enabled = False
+
+# Simulated and real time of each route
+routes = []
+
+# The original functions that get patched
+_originals = {}
+
+# The real clocks, bound at import so that the virtual clock keeps working after it's uninstalled
+_real_time = time.time
+_real_monotonic = getattr(time, "monotonic", time.time)
+_real_perf_counter = getattr(time, "perf_counter", time.time)
+
+
+class Clock(object):
+    """Simulated clock, that runs at real time plus all the time that was skipped."""
+
+    def __init__(self):
+        self.skipped = 0.0
+        self.sleeps = 0
+
+    def sleep(self, seconds):
+        if seconds < 0:
+            raise ValueError("sleep length must be non-negative")
+        self.skipped += seconds
+        self.sleeps += 1
+
+
+# The clock of the current route
+clock = Clock()
+
+
+def _time():
+    return _real_time() + clock.skipped
+
+
+def _monotonic():
+    return _real_monotonic() + clock.skipped
+
+
+def _perf_counter():
+    return _real_perf_counter() + clock.skipped
+
+
+def _sleep(seconds):
+    clock.sleep(seconds)
+
+
+class _VirtualType(type):
+    """Metaclass that lets real date and datetime objects pass isinstance checks against the virtual classes."""
+
+    def __instancecheck__(cls, obj):
+        return isinstance(obj, cls.real)
+
+
+def _reduce(self):
+    # Pickle as the real class, as the virtual class is not importable
+    return self.real, self.real.__reduce__(self)[1]
+
+
+def _reduce_ex(self, protocol):
+    return self.real, self.real.__reduce_ex__(self, protocol)[1]
+
+
+def _today(cls):
+    return cls.fromtimestamp(_time())
+
+
+def _now(cls, tz=None):
+    return cls.fromtimestamp(_time(), tz)
+
+
+def _utcnow(cls):
+    return cls.utcfromtimestamp(_time())
+
+
+VirtualDate = _VirtualType("date", (datetime.date,), {
+    "__module__": "datetime", "real": datetime.date, "__reduce__": _reduce, "__reduce_ex__": _reduce_ex,
+    "today": classmethod(_today)})
+
+VirtualDatetime = _VirtualType("datetime", (datetime.datetime,), {
+    "__module__": "datetime", "real": datetime.datetime, "__reduce__": _reduce, "__reduce_ex__": _reduce_ex,
+    "today": classmethod(_today), "now": classmethod(_now), "utcnow": classmethod(_utcnow)})
+
+
+def _xbmc_sleep(milliseconds):
+    clock.sleep(milliseconds / 1000.0)
+
+
+def _wait_for_abort(_, timeout=None):
+    # Abort is never requested within the mock environment
+    if timeout:
+        clock.sleep(timeout)
+    return False
+
+
+def install():
+    """Patch the time, datetime and kodi wait functions to use the virtual clock."""
+    if _originals:
+        return
+
+    _originals.update(time=time.time, sleep=time.sleep, date=datetime.date, datetime=datetime.datetime)
+    time.time = _time
+    time.sleep = _sleep
+    datetime.date = VirtualDate
+    datetime.datetime = VirtualDatetime
+
+    for name, func in (("monotonic", _monotonic), ("perf_counter", _perf_counter)):
+        if hasattr(time, name):
+            _originals[name] = getattr(time, name)
+            setattr(time, name, func)
+
+    try:
+        import xbmc
+    except ImportError:
+        pass
+    else:
+        _originals.update(xbmc_sleep=xbmc.sleep, wait_for_abort=xbmc.Monitor.waitForAbort)
+        xbmc.sleep = _xbmc_sleep
+        xbmc.Monitor.waitForAbort = _wait_for_abort
+
+
+def uninstall():
+    """Restore the original time, datetime and kodi wait functions."""
+    if not _originals:
+        return
+
+    time.time = _originals.pop("time")
+    time.sleep = _originals.pop("sleep")
+    datetime.date = _originals.pop("date")
+    datetime.datetime = _originals.pop("datetime")
+    for name in ("monotonic", "perf_counter"):
+        if name in _originals:
+            setattr(time, name, _originals.pop(name))
+
+    if "xbmc_sleep" in _originals:
+        import xbmc
+        xbmc.sleep = _originals.pop("xbmc_sleep")
+        xbmc.Monitor.waitForAbort = _originals.pop("wait_for_abort")
+
+
+@contextmanager
+def use(plugin_data):
+    """
+    Run the with block on the virtual clock, storing the time spent under the 'vclock' key of the plugin data.
+
+    :param dict plugin_data: The plugin data that gets sent back to the controller.
+    """
+    global clock
+    if not enabled:
+        yield
+        return
+
+    clock = Clock()
+    install()
+    start = _real_time()
+    try:
+        yield
+    finally:
+        real = _real_time() - start
+        uninstall()
+        plugin_data["vclock"] = {"real": real, "simulated": real + clock.skipped, "sleeps": clock.sleeps}
+
+        # Objects kept by the add-on, such as the virtual datetime class, are back on real time
+        clock = Clock()
+
+
+def record(callback_url, data):
+    """
+    Display the simulated and real time of a route execution.
+
+    :param str callback_url: The callback url that was executed.
+    :param dict data: The virtual clock data returned from the add-on process.
+    """
+    routes.append((callback_url, data))
+    print("")
+    print("Virtual time of {}: {:.3f}s simulated, {:.3f}s real, {} sleeps skipped".format(
+        callback_url, data["simulated"], data["real"], data["sleeps"]))
+
+
+def print_summary():
+    """Display the simulated and real time of each route, most time skipped first."""
+    if not routes:
+        return
+
+    print("")
+    print("{} {} {} Url".format("Simulated".rjust(10), "Real".rjust(9), "Sleeps".rjust(6)))
+    print("-" * 60)
+    for url, data in sorted(routes, key=lambda item: item[1]["simulated"] - item[1]["real"], reverse=True):
+        print("{:>9.3f}s {:>8.3f}s {:>6} {}".format(data["simulated"], data["real"], data["sleeps"], url))
+
+    simulated = sum(data["simulated"] for _, data in routes)
+    real = sum(data["real"] for _, data in routes)
+    print("-" * 60)
+    print("{:>9.3f}s {:>8.3f}s Total, {:.3f}s of waiting skipped".format(simulated, real, simulated - real))
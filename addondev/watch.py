@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Watch mode, re-executes a route of the add-on whenever its source files change.
+
+Changes are detected by polling the modification times of the add-on files, which works on every
+platform without extra dependencies. Routes are executed within a persistent worker, so only the
+changed modules need to be imported again.
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+import difflib
+import time
+import os
+import re
+
+# Package imports
+from addondev.worker import Worker
+from addondev import support
+
+
+def watched_file(filename):
+    """Return True if changes to the given file should trigger a new run."""
+    return filename.endswith(".py") or filename in ("settings.xml", "strings.po")
+
+
+def snapshot(pluginpath):
+    """
+    Return the modification time and size of every watched file of the add-on.
+
+    :param unicode pluginpath: The path to the add-on.
+    :rtype: dict
+    """
+    files = {}
+    for root, dirs, filenames in os.walk(pluginpath):
+        dirs[:] = [name for name in dirs if not name.startswith(".") and name != "__pycache__"]
+        for filename in filenames:
+            if watched_file(filename):
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # File was removed while walking
+                    continue
+                files[path] = (stat.st_mtime, stat.st_size)
+    return files
+
+
+def changed_files(old, new):
+    """Return a sorted list of the files that were added, removed or modified between two snapshots."""
+    return sorted(path for path in set(old) | set(new) if old.get(path) != new.get(path))
+
+
+def wait_for_changes(pluginpath, state, interval, debounce):
+    """
+    Block until the watched files of the add-on have changed and then settled.
+
+    :param unicode pluginpath: The path to the add-on.
+    :param dict state: The last snapshot of the add-on files.
+    :param float interval: The time in seconds between polls.
+    :param float debounce: The time in seconds that the files must be unchanged before returning.
+    :returns: A tuple of the new snapshot and the list of changed files.
+    """
+    current = state
+    while current == state:
+        time.sleep(interval)
+        current = snapshot(pluginpath)
+
+    # Editors may save in several steps, so wait for the files to stop changing
+    while True:
+        time.sleep(debounce)
+        settled = snapshot(pluginpath)
+        if settled == current:
+            return current, changed_files(state, current)
+        current = settled
+
+
+def listing(data):
+    """Return the listing of a route as lines of text, used to diff the listing between runs."""
+    lines = []
+    for _, item, isfolder in data["listitem"]:
+        label = re.sub(r"\[[^\]]+?\]", "", item.get("label", "")).strip()
+        lines.append(u"{}{} | {}".format(label, "/" if isfolder else "", item.get("path", "")))
+    return lines
+
+
+def show_results(data, previous, elapsed):
+    """
+    Display the outcome of a run, along with the changes to the listing since the previous run.
+
+    :param dict data: The results returned from the add-on process.
+    :param list previous: The listing of the previous run, or None on the first run.
+    :param float elapsed: The time taken to execute the route.
+    :returns: The listing of this run.
+    :rtype: list
+    """
+    lines = listing(data)
+    if data["succeeded"]:
+        print("Route executed in {:.3f}s, {} items".format(elapsed, len(lines)))
+    else:
+        print("Route failed in {:.3f}s: {}".format(elapsed, data.get("error", "see log for details")))
+
+    if previous is None:
+        print("\n".join(lines))
+    else:
+        diff = list(difflib.unified_diff(previous, lines, "previous", "current", lineterm="", n=0))
+        print("\n".join(diff) if diff else "Listing unchanged")
+    return lines
+
+
+def watch(pluginpath, callback_url, content_type="video", interval=0.2, debounce=0.1):
+    """
+    Execute the route and then execute it again every time the add-on files change, until interrupted.
+
+    :param unicode pluginpath: The path to the add-on.
+    :param str callback_url: The callback url to execute.
+    :param str content_type: The content type to list, if more than one type is available.
+    :param float interval: The time in seconds between polls for changes.
+    :param float debounce: The time in seconds that the files must be unchanged before running.
+    """
+    worker = Worker(pluginpath, content_type)
+    try:
+        state = snapshot(pluginpath)
+        start = time.time()
+        previous = show_results(worker.execute(callback_url), None, time.time() - start)
+
+        while True:
+            print("\nWatching {} for changes, press Ctrl+C to stop".format(pluginpath))
+            state, changed = wait_for_changes(pluginpath, state, interval, debounce)
+            print("Changed: {}".format(", ".join(os.path.relpath(path, pluginpath) for path in changed)))
+
+            start = time.time()
+            data = worker.execute(callback_url, changed)
+            previous = show_results(data, previous, time.time() - start)
+    except KeyboardInterrupt:
+        support.logger.debug("Watch mode stopped")
+    finally:
+        worker.stop()
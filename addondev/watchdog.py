@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Supervision of the add-on process.
+
+Enforces the wall clock timeout, cpu timeout and memory limit of a route,
+killing the whole add-on process tree if a limit is exceeded.
+"""
+
+# Standard Library Imports
+from copy import deepcopy
+import signal
+import math
+import os
+
+try:
+    import resource
+except ImportError:
+    # resource is unavailable on windows
+    resource = None
+
+# Package imports
+from addondev import support
+
+# The max wall clock time in seconds that a route may take
+timeout = None
+
+# The max cpu time in seconds that a route may use
+cpu_timeout = None
+
+# The max address space in bytes of the add-on process
+memory_limit = None
+
+# The max time in seconds to wait for a killed add-on process to exit
+kill_timeout = 5
+
+
+def enabled():
+    """Return True if any limit is set."""
+    return timeout is not None or cpu_timeout is not None or memory_limit is not None
+
+
+def limits():
+    """
+    Return the limits to pass on to the add-on process.
+
+    The module globals only reach the add-on process when it's forked, not under the spawn or forkserver
+    start methods, so the limits are passed to limit_process explicitly.
+
+    :rtype: dict
+    """
+    return {"timeout": timeout, "cpu_timeout": cpu_timeout, "memory_limit": memory_limit}
+
+
+def limit_process(process_limits=None):
+    """
+    Apply the resource limits to the current process. Called from within the add-on process.
+
+    The process is also moved into its own process group, so that any processes it spawns can be killed with it.
+
+    :param dict process_limits: The limits of the controller, from limits().
+    """
+    global timeout, cpu_timeout, memory_limit
+    if process_limits is not None:
+        timeout = process_limits["timeout"]
+        cpu_timeout = process_limits["cpu_timeout"]
+        memory_limit = process_limits["memory_limit"]
+    if not enabled() or resource is None:
+        return
+
+    os.setpgrp()
+    reset_cpu_limit()
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def reset_cpu_limit():
+    """
+    Start the cpu timeout from the cpu time used so far. Called from within the add-on process.
+
+    Only the soft limit is changed, so that persistent add-on processes can reset the limit before each route.
+    """
+    if cpu_timeout is None or resource is None:
+        return
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    seconds = int(math.ceil(usage.ru_utime + usage.ru_stime + cpu_timeout))
+    hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    resource.setrlimit(resource.RLIMIT_CPU, (seconds, hard))
+
+
+def kill(process):
+    """
+    Kill the add-on process along with any processes it has spawned.
+
+    :param process: The multiprocessing process object of the add-on.
+    """
+    killed = False
+    if resource is not None and enabled():
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            killed = True
+        except OSError:
+            # The add-on process never got its own process group, or has already exited
+            pass
+
+    if not killed and process.is_alive():
+        # Process.kill is unavailable on python 2
+        getattr(process, "kill", process.terminate)()
+    process.join(kill_timeout)
+
+
+def exit_reason(exitcode):
+    """Return the failure reason of an add-on process that exited without sending results."""
+    if exitcode is not None and exitcode < 0:
+        if exitcode == -getattr(signal, "SIGXCPU", 0):
+            return "cpu-timeout"
+        return "killed"
+    return "exited"
+
+
+def failure(reason, elapsed, exitcode=None):
+    """
+    Return the results of a route that failed to send back its results.
+
+    :param str reason: The reason for the failure, timeout, cpu-timeout, killed or exited.
+    :param float elapsed: The time taken before the failure.
+    :param int exitcode: The exit code of the add-on process.
+    :returns: A copy of the default plugin data, with the failure details under the 'failure' key.
+    :rtype: dict
+    """
+    messages = {"timeout": "route exceeded the timeout of {}s".format(timeout),
+                "cpu-timeout": "route exceeded the cpu timeout of {}s".format(cpu_timeout),
+                "killed": "add-on process was killed by signal {}".format(-(exitcode or 0)),
+                "exited": "add-on process exited with code {} before sending results".format(exitcode)}
+
+    data = deepcopy(support.plugin_data)
+    data["succeeded"] = False
+    data["error"] = messages[reason]
+    data["failure"] = {"reason": reason, "exitcode": exitcode, "elapsed": elapsed}
+    return data
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent add-on process, that initializes the mock kodi environment once and then executes routes on request.
+
+Between routes, only the add-on modules that have changed on disk, and the modules that depend on them,
+are dropped from sys.modules so they get imported again by the next route.
+"""
+
+# Standard Library Imports
+from copy import deepcopy
+import multiprocessing
+import threading
+import traceback
+import types
+import time
+import sys
+import os
+
+# Package imports
+from addondev.interactive import execute_route, wait_for_results, process_results, record_failure, install_log
+from addondev import support, tracing, imports, watchdog
+
+# Files that hold add-on data rather than code
+_data_files = ("settings.xml", "strings.po")
+
+# Set to False to stop the add-on process from printing the traceback of route errors
+print_errors = True
+
+# Held while an add-on process is started. Without it, a process started by another thread at the same time
+# inherits the pipe and sentinel of this one, and keeps them open after this process has exited.
+_start_lock = threading.Lock()
+
+
+class Worker(object):
+    """
+    Controller side of a persistent add-on process.
+
+    The process is started on the first route and restarted if it dies or exceeds the route timeout.
+
+    :param unicode pluginpath: The path to the plugin to execute.
+    :param str content_type: The content type to list, if more than one type is available.
+    :param unicode profile: The profile directory of the plugin to use instead of the shared one.
+    """
+
+    def __init__(self, pluginpath, content_type="video", profile=None):
+        self.pluginpath = pluginpath
+        self.content_type = content_type
+        self.profile = profile
+        self.process = None
+        self._pipe = None
+
+    def start(self):
+        """Start the add-on process."""
+        with _start_lock:
+            self._pipe, pipe_send = multiprocessing.Pipe(duplex=True)
+            self.process = multiprocessing.Process(target=worker_loop, args=(pipe_send, self.pluginpath,
+                                                                             self.content_type, self.profile),
+                                                   kwargs={"limits": watchdog.limits()})
+            with tracing.span("spawn"):
+                self.process.start()
+
+            # Close our copy of the sending end, so that a dead add-on process is seen as end of file
+            pipe_send.close()
+
+    def execute(self, callback_url, changed=()):
+        """
+        Execute a route within the add-on process.
+
+        :param str callback_url: The url containing the route path and callback params.
+        :param list changed: List of files that have changed since the last route.
+        :returns: A dictionary of listitems and other related results.
+        :rtype: dict
+        """
+        start = time.time()
+        if self.process is None or not self.process.is_alive():
+            # A fresh process imports everything anyway
+            self.start()
+            changed = ()
+
+        self._pipe.send({"callback_url": callback_url, "changed": list(changed)})
+        with tracing.span("wait for results"):
+            data = wait_for_results(self._pipe, self.process, start)
+
+        if "failure" in data:
+            return self._failed(callback_url, data, start)
+
+        # The add-on process sends its own trace events after the results
+        if tracing.enabled:
+            trace = wait_for_results(self._pipe, self.process, start)
+            if "failure" in trace:
+                # The add-on process died after sending the results
+                return self._failed(callback_url, trace, start)
+            tracing.events.extend(trace["trace"])
+
+        process_results(self.pluginpath, callback_url, data, start)
+        return data
+
+    def stop(self):
+        """Stop the add-on process."""
+        if self.process is not None and self.process.is_alive():
+            try:
+                self._pipe.send(None)
+            except (IOError, OSError):
+                pass
+            self.process.join(5)
+            if self.process.is_alive():
+                watchdog.kill(self.process)
+        self._close()
+
+    def _failed(self, callback_url, data, start):
+        """Drop the dead or killed add-on process and record the failure of the route."""
+        self._close()
+        record_failure(self.pluginpath, callback_url, data, start)
+        return data
+
+    def _close(self):
+        if self._pipe is not None:
+            self._pipe.close()
+        self._pipe = None
+        self.process = None
+
+
+def worker_loop(pipe_send, pluginpath, content_type, profile=None, limits=None):
+    """
+    Initializes the add-on once, then executes every route that is received until told to stop.
+
+    :param pipe_send: The communication object used for sending data back to the initiator.
+    :param unicode pluginpath: The path to the plugin to execute.
+    :param str content_type: The content type to list, if more than one type is available.
+    :param unicode profile: The profile directory of the plugin to use instead of the shared one.
+    :param dict limits: The resource limits of the routes, from watchdog.limits().
+    """
+    watchdog.limit_process(limits)
+
+    # Discard any events inherited from the controller
+    tracing.collect()
+    tracing.process_name("add-on worker: {}".format(os.path.basename(pluginpath)))
+
+    with tracing.span("initializer"):
+        addon_data = support.initializer(pluginpath)
+    support.data_pipe = pipe_send
+
+    # Load the settings from the given profile, any settings saved by the add-on also go there
+    if profile is not None:
+        addon_data.profile = profile
+        addon_data.preload()
+
+    imports.configure_pycache(pluginpath)
+    install_log()
+
+    # The default results of a route
+    plugin_data = deepcopy(support.plugin_data)
+
+    while True:
+        try:
+            command = pipe_send.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if command is None:
+            break
+
+        if command["changed"]:
+            with tracing.span("reload"):
+                dropped = reload_changed(addon_data, command["changed"])
+            support.logger.debug("Reloading modules: {}".format(", ".join(dropped)))
+
+        # Reset the results from the last route
+        support.plugin_data.clear()
+        support.plugin_data.update(deepcopy(plugin_data))
+        del support.data_log["notifications"][:]
+        watchdog.reset_cpu_limit()
+
+        try:
+            execute_route(pipe_send, addon_data, command["callback_url"], content_type)
+        except Exception:
+            # The error has already been sent back with the results, keep the worker alive for the next route
+            if print_errors:
+                traceback.print_exc()
+
+
+def reload_changed(addon_data, changed):
+    """
+    Drop the changed add-on modules from sys.modules, along with any add-on modules that reference them.
+
+    Changes to the settings or strings files cause the add-on data to be loaded again.
+
+    :param addon_data: The add-on object of the plugin being executed.
+    :param list changed: List of files that have changed.
+    :returns: Sorted list of the dropped module names.
+    :rtype: list
+    """
+    changed = set(os.path.realpath(path) for path in changed)
+    if any(os.path.basename(path) in _data_files for path in changed):
+        addon_data.preload()
+
+    # Find all loaded modules of the add-on, keyed by name
+    root = os.path.join(os.path.realpath(addon_data.path), "")
+    modules = {}
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, "__file__", None)
+        if filename:
+            filename = os.path.realpath(filename)
+            if filename.endswith((".pyc", ".pyo")):
+                filename = filename[:-1]
+            if filename.startswith(root):
+                modules[name] = (module, filename)
+
+    dropped = set(name for name, (_, filename) in modules.items() if filename in changed)
+
+    # Modules that hold a reference to a dropped module, or to anything defined within one, must also be
+    # dropped, or they would keep using the old code. Repeat until no more dependents are found.
+    found = bool(dropped)
+    while found:
+        found = False
+        for name, (module, _) in modules.items():
+            if name not in dropped and _references(module, dropped):
+                dropped.add(name)
+                found = True
+
+    for name in dropped:
+        del sys.modules[name]
+    return sorted(dropped)
+
+
+def _references(module, names):
+    """Return True if the module holds a reference to any of the named modules or their objects."""
+    for value in list(vars(module).values()):
+        if isinstance(value, types.ModuleType):
+            ref = value.__name__
+        else:
+            ref = getattr(value, "__module__", None)
+        if ref in names:
+            return True
+    return False
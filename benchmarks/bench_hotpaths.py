@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of addondev's own hot paths, using synthetic fixtures at several scales.
+
+Usage:
+    python benchmarks/bench_hotpaths.py -o results.json
+    python benchmarks/bench_hotpaths.py --compare base.json results.json
+"""
+from __future__ import print_function
+
+# Standard Library Imports
+from argparse import ArgumentParser
+from xml.etree import ElementTree as ETree
+import subprocess
+import platform
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+
+# Allow running from a source checkout without installing
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Package imports
+from addondev import support, interactive, libraries
+
+# High resolution timer, fallback to time.time on python 2
+timer = getattr(time, "perf_counter", time.time)
+
+ADDON_XML = u"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<addon id="{id}" name="{id}" version="{version}" provider-name="bench">
+  <requires>
+{requires}
+  </requires>
+  <extension point="{point}" library="{library}">{provides}</extension>
+  <extension point="xbmc.addon.metadata">
+    <summary lang="en_GB">Summary of {id}</summary>
+    <description lang="en_GB">Description of {id}</description>
+  </extension>
+</addon>
+"""
+
+ENTRY_POINT = u"""from addondev import support
+
+def run():
+    items = []
+    for count in range({items}):
+        url = "plugin://{id}/video/%d?_json_=7b22696422203a20317d&page=%d" % (count, count)
+        items.append((url, {{"label": "[B]Video %d[/B]" % count, "path": url, "label2": "Label 2",
+                             "art": {{"thumb": "http://example.com/%d.jpg" % count, "fanart": "fanart.jpg"}},
+                             "info": {{"title": "Video %d" % count, "plot": "Plot " * 20, "duration": 300}},
+                             "properties": {{"isplayable": "true"}},
+                             "context": [("Refresh", "XBMC.Container.Refresh(plugin://{id}/?_json_=7b7d)")]}}, False))
+    support.plugin_data["listitem"] = items
+    support.plugin_data["succeeded"] = True
+"""
+
+
+def write_addon(directory, addon_id, version="1.0.0", requires=(), module=False, items=None):
+    """Create a synthetic add-on and return its path."""
+    path = os.path.join(directory, addon_id)
+    os.makedirs(path)
+    requires = u"\n".join(u'    <import addon="{}" version="1.0.0"/>'.format(req) for req in requires)
+    if module:
+        point, library, provides = u"xbmc.python.module", u"lib", u""
+        os.makedirs(os.path.join(path, "lib"))
+    else:
+        point, library, provides = u"xbmc.python.pluginsource", u"main.py", u"<provides>video</provides>"
+
+    with open(os.path.join(path, "addon.xml"), "wb") as stream:
+        stream.write(ADDON_XML.format(id=addon_id, version=version, requires=requires, point=point,
+                                      library=library, provides=provides).encode("utf8"))
+
+    if items is not None:
+        with open(os.path.join(path, "main.py"), "wb") as stream:
+            stream.write(ENTRY_POINT.format(id=addon_id, items=items).encode("utf8"))
+    return path
+
+
+def write_library(path, package, modules):
+    """Create a package with the given number of modules within the library directory of a module add-on."""
+    package_dir = os.path.join(path, "lib", package)
+    os.makedirs(package_dir)
+    open(os.path.join(package_dir, "__init__.py"), "w").close()
+    for count in range(modules):
+        with open(os.path.join(path, "lib", "{}_mod{}.py".format(package, count)), "w") as stream:
+            stream.write("import os\nfrom {} import __name__ as parent\n".format(package))
+    return ["{}_mod{}".format(package, count) for count in range(modules)] + [package]
+
+
+def write_strings(path, entries):
+    os.makedirs(os.path.join(path, "resources"))
+    with open(os.path.join(path, "resources", "strings.po"), "wb") as stream:
+        stream.write(b'msgid ""\nmsgstr ""\n\n')
+        for count in range(entries):
+            entry = 'msgctxt "#{0}"\nmsgid "String number {0}"\nmsgstr ""\n\n'.format(30000 + count)
+            stream.write(entry.encode("utf8"))
+
+
+def write_settings(path, entries):
+    tree = ETree.Element("settings")
+    for count in range(entries):
+        ETree.SubElement(tree, "setting", {"id": "setting_{}".format(count), "type": "text", "default": "value"})
+    ETree.ElementTree(tree).write(os.path.join(path, "resources", "settings.xml"))
+
+
+def repo_xml(count):
+    """Return a synthetic addons.xml, about the size of the official repository."""
+    nodes = []
+    for num in range(count):
+        nodes.append(ADDON_XML.format(id="plugin.video.bench{}".format(num), version="1.0.{}".format(num),
+                                      requires='    <import addon="xbmc.python" version="2.25.0"/>',
+                                      point="xbmc.python.pluginsource", library="main.py",
+                                      provides="<provides>video</provides>").split("\n", 1)[1])
+    return (u'<?xml version="1.0" encoding="UTF-8"?>\n<addons>\n' + u"".join(nodes) + u"</addons>").encode("utf8")
+
+
+class FakeSession(object):
+    """Session replacement that serves a fixed addons.xml."""
+
+    class Response(object):
+        def __init__(self, content):
+            self.content = content
+
+    def __init__(self, content):
+        self.content = content
+
+    def get(self, _):
+        return self.Response(self.content)
+
+
+def measure(func, repeat, number=1):
+    """
+    Time the given function and return the timing stats in seconds per call.
+
+    :param func: The function to benchmark.
+    :param int repeat: The number of measurements to take.
+    :param int number: The number of calls per measurement.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = timer()
+        for _ in range(number):
+            func()
+        timings.append((timer() - start) / number)
+
+    timings.sort()
+    return {"min": timings[0], "median": timings[len(timings) // 2], "max": timings[-1], "repeat": repeat,
+            "number": number}
+
+
+def run_benchmarks(workdir, repeat, quick=False):
+    """Build all fixtures within workdir and run every benchmark case."""
+    results = {}
+    devnull = open(os.devnull, "w")
+    stdout = sys.stdout
+
+    def bench(name, func, number=1, rounds=None):
+        results[name] = stats = measure(func, rounds or repeat, number)
+        print("{:<40} {:>10.6f}s".format(name, stats["median"]), file=stdout)
+
+    support.Repo.offline = True
+    bench("setup_paths", support.setup_paths, number=10)
+
+    # Homes with many cached add-ons
+    for count in (10, 500):
+        home = os.path.join(workdir, "home{}".format(count))
+        for num in range(count):
+            write_addon(home, "script.module.bench{}".format(num), module=True)
+        bench("find_addons[{}]".format(count), lambda: list(support.find_addons(home)))
+
+    # Add-on manifest parsing
+    xml_file = os.path.join(workdir, "home10", "script.module.bench0", "addon.xml")
+    bench("Addon.from_file", lambda: support.Addon.from_file(xml_file), number=100)
+
+    # Dependency resolution of a chain of module add-ons
+    home = os.path.join(workdir, "home10")
+    chain = [support.Addon.from_file(path) for path in support.find_addons(home)]
+
+    def resolve():
+        org_path = sys.path[:]
+        support.avail_addons.clear()
+        for addon in chain:
+            support.avail_addons[addon.id] = addon
+        support.process_dependencies([support.Dependency(addon.id, "1.0.0", False) for addon in chain])
+        sys.path[:] = org_path
+        libraries.reset()
+    bench("process_dependencies[10]", resolve)
+
+    # Imports of the modules of many library add-ons, along with a missing optional module
+    libs = os.path.join(workdir, "libs")
+    lib_chain, lib_modules = [], []
+    for num in range(30):
+        path = write_addon(libs, "script.module.lib{}".format(num), module=True)
+        lib_modules.extend(write_library(path, "lib{}".format(num), 5))
+        lib_chain.append(support.Addon.from_file(os.path.join(path, "addon.xml")))
+
+    def import_libraries():
+        org_path = sys.path[:]
+        support.avail_addons.clear()
+        for addon in lib_chain:
+            support.avail_addons[addon.id] = addon
+        support.process_dependencies([support.Dependency(addon.id, "1.0.0", False) for addon in lib_chain])
+        for name in lib_modules:
+            __import__(name)
+        try:
+            __import__("bench_missing_module")
+        except ImportError:
+            pass
+
+        for name in lib_modules:
+            del sys.modules[name]
+        sys.path[:] = org_path
+        libraries.reset()
+    bench("import_libraries[30]", import_libraries)
+
+    # Repository index parsing
+    repo_content = repo_xml(300 if quick else 1500)
+
+    def populate():
+        repo = support.Repo()
+        repo._session = FakeSession(repo_content)
+        repo.populate()
+    support.logger.disabled = True
+    bench("Repo.populate", populate)
+    support.logger.disabled = False
+
+    # Strings and settings loading
+    lang = os.path.join(workdir, "lang")
+    write_strings(lang, 5000)
+    write_settings(lang, 200)
+    bench("Strings[5000]", lambda: support.Strings(lang))
+    bench("Settings[200]", lambda: support.Settings(lang, os.path.join(workdir, "profile")))
+
+    # Add-on execution and listitem processing at several scales
+    plugins = os.path.join(workdir, "plugins")
+    for count in (10, 100, 1000):
+        addon_id = "plugin.video.bench{}".format(count)
+        path = write_addon(plugins, addon_id, requires=["xbmc.python"], items=count)
+        url = "plugin://{}/".format(addon_id)
+        data = interactive.execute_addon(path, url, "video")
+        listitems = [item[1] for item in data["listitem"]]
+
+        bench("execute_addon[{}]".format(count), lambda: interactive.execute_addon(path, url, "video"),
+              rounds=max(3, repeat // 2))
+        bench("process_listitem[{}]".format(count), lambda: [interactive.process_listitem(item.copy())
+                                                             for item in listitems])
+
+        sys.stdout = devnull
+        try:
+            bench("compact_item_selector[{}]".format(count), lambda: interactive.compact_item_selector(
+                [item.copy() for item in listitems], url, [0]))
+            bench("detailed_item_selector[{}]".format(count), lambda: interactive.detailed_item_selector(
+                [item.copy() for item in listitems], [0], False))
+        finally:
+            sys.stdout = stdout
+
+    devnull.close()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, "w")).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base_file, head_file, threshold):
+    """
+    Display the change in median time of each benchmark between two result files.
+
+    :returns: The number of benchmarks that are slower than the threshold.
+    """
+    with open(base_file) as stream:
+        base = json.load(stream)["results"]
+    with open(head_file) as stream:
+        head = json.load(stream)["results"]
+
+    slower = 0
+    print("{:<40} {:>12} {:>12} {:>8}".format("Benchmark", "Base", "Head", "Change"))
+    for name in sorted(set(base) & set(head)):
+        base_time, head_time = base[name]["median"], head[name]["median"]
+        change = (head_time - base_time) / base_time if base_time else 0.0
+        flag = ""
+        if change > threshold:
+            slower += 1
+            flag = " slower"
+        elif change < -threshold:
+            flag = " faster"
+        print("{:<40} {:>11.6f}s {:>11.6f}s {:>+8.1%}{}".format(name, base_time, head_time, change, flag))
+    return slower
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark addondev's own hot paths.")
+    parser.add_argument("-o", "--output", metavar="FILE", help="Save the results as json to FILE.")
+    parser.add_argument("-r", "--repeat", type=int, default=7, help="The number of measurements per benchmark. (7)")
+    parser.add_argument("--quick", action="store_true", help="Use fewer repeats and smaller fixtures.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"),
+                        help="Compare two result files instead of running the benchmarks.")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Percent change at which a benchmark is reported as slower. (10)")
+    args = parser.parse_args()
+
+    if args.compare:
+        return 1 if compare(args.compare[0], args.compare[1], args.threshold / 100.0) else 0
+
+    workdir = tempfile.mkdtemp(prefix="addondev-bench-")
+
+    # Run against a temporary kodi home, so the caches of the real one are left alone
+    import appdirs
+    appdirs.user_cache_dir = lambda appname=None, *args, **kwargs: os.path.join(workdir, u"home", appname)
+    try:
+        results = run_benchmarks(workdir, 3 if args.quick else args.repeat, args.quick)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {"meta": {"python": platform.python_version(), "implementation": platform.python_implementation(),
+                       "platform": platform.platform(), "revision": git_revision(), "timestamp": time.time()},
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(output, stream, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -34,7 +34,8 @@ setup(
     platforms=['OS Independent'],
     packages=['addondev'],
     package_data={'addondev': data_files()},
-    entry_points={'console_scripts': ['addondev=addondev.cli:main']},
+    entry_points={'console_scripts': ['addondev=addondev.cli:main'],
+                  'pytest11': ['addondev=addondev.pytest_plugin']},
     extras_require={'dev': ['pytest-cov', 'pytest', 'coverage', 'sphinx', 'backports.shutil_get_terminal_size']},
     include_package_data=True,
     zip_safe=False